@@ -0,0 +1,8 @@
+"""
+File:           __init__.py
+Author:         Dibyaranjan Sathua
+Created on:     19/10/26, 11:30 AM
+
+Offline benchmarks. Run them from the root directory of the repository, e.g.
+python -m benchmarks.bench_extraction
+"""
@@ -0,0 +1,91 @@
+"""
+File:           bench_backtest.py
+Author:         Dibyaranjan Sathua
+Created on:     25/10/26, 5:00 PM
+
+Backtest of a configuration grid over random offer snapshots, checked against Repricer on a
+sample of the configurations.
+
+Usage: python -m benchmarks.bench_backtest [--asins N] [--snapshots N] [--workers N]
+"""
+from typing import List
+import argparse
+import os
+import random
+import time
+
+from benchmarks.bench_batch_repricer import SELLER_NAME, make_catalog
+from src.backtest import Backtest, BacktestResult, RepricerConfig
+from src.condition import Condition
+from src.product import Product
+from src.product_listing import ProductListing
+from src.repricer import Repricer
+from src.snapshot_store import Snapshot
+
+MIN_PROFIT: float = 1.0
+
+
+def scalar_backtest(groups: List[List[ProductListing]], conditions: List[int],
+                    weights: List[float], config: RepricerConfig) -> BacktestResult:
+    """ Same backtest with one Repricer per case """
+    seller = ProductListing(seller=SELLER_NAME)
+    profits, prices = [], []
+    for group, condition, weight in zip(groups, conditions, weights):
+        repricer = Repricer(Product("", "", weight), group)
+        repricer.rating_filter = config.rating_filter
+        repricer.price_floor = config.price_floor
+        repricer.price_ceiling = config.price_ceiling
+        repricer.condition_filter = Condition(condition)
+        price = repricer.reprice(seller)
+        profit = repricer.calculate_profit(price, seller.shipping)
+        if profit > MIN_PROFIT:
+            profits.append(profit)
+            prices.append(price)
+    return BacktestResult(config, len(groups), len(profits), sum(profits),
+                          sum(profits) / len(profits) if profits else 0.0,
+                          sum(prices) / len(prices) if prices else 0.0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backtest benchmark")
+    parser.add_argument("--asins", type=int, default=10000)
+    parser.add_argument("--snapshots", type=int, default=10, help="Snapshots per ASIN")
+    parser.add_argument("--offers", type=int, default=12, help="Mean offers per ASIN")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--check", type=int, default=3,
+                        help="Configurations checked against Repricer")
+    args = parser.parse_args()
+
+    # 5 ratings x 5 floors x 2 ceilings
+    configs = RepricerConfig.grid(rating_filter=(0, 80, 85, 90, 95),
+                                  price_floor=(0.0, 2.0, 5.0, 10.0, 20.0),
+                                  price_ceiling=(RepricerConfig().price_ceiling, 40.0))
+    groups, conditions, weights = make_catalog(args.asins * args.snapshots, args.offers)
+    backtest = Backtest(SELLER_NAME, min_profit=MIN_PROFIT)
+    start = time.perf_counter()
+    for index, (group, condition, weight) in enumerate(zip(groups, conditions, weights)):
+        snapshot = Snapshot.from_listings(f"{index // args.snapshots:010d}",
+                                          float(index % args.snapshots), group)
+        backtest.add_snapshot(snapshot, Product("", "", weight), [condition])
+    load_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    results = backtest.run(configs, workers=args.workers)
+    run_time = time.perf_counter() - start
+
+    for config in random.Random(0).sample(configs, min(args.check, len(configs))):
+        result = next(result for result in results if result.config == config)
+        expected = scalar_backtest(groups, conditions, weights, config)
+        assert (result.cases, result.listed) == (expected.cases, expected.listed), config
+        assert abs(result.total_profit - expected.total_profit) < 1e-6 * len(groups), config
+
+    print(f"{args.asins} ASINs x {args.snapshots} snapshots, {backtest.case_count} cases, "
+          f"{len(configs)} configurations, {args.workers} workers")
+    print(f"Load:     {load_time:8.3f} sec")
+    print(f"Backtest: {run_time:8.3f} sec")
+    for line in list(Backtest.report(results))[:5]:
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
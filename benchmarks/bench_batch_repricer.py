@@ -0,0 +1,83 @@
+"""
+File:           bench_batch_repricer.py
+Author:         Dibyaranjan Sathua
+Created on:     20/10/26, 12:00 PM
+
+Compare Repricer over every ASIN with a single BatchRepricer call and check that both give the
+same prices and profits.
+
+Usage: python -m benchmarks.bench_batch_repricer [--asins N] [--offers N]
+"""
+from typing import List
+import argparse
+import random
+import time
+
+from src.batch_repricer import BatchRepricer, OfferTable
+from src.condition import Condition
+from src.console import Console
+from src.product import Product
+from src.product_listing import ProductListing
+from src.repricer import Repricer
+
+SELLER_NAME = "Benchmark Seller"
+
+
+def make_catalog(asins: int, offers: int, seed: int = 0):
+    """ Random sorted offers, condition filters and weights of every ASIN """
+    rnd = random.Random(seed)
+    groups: List[List[ProductListing]] = []
+    for _ in range(asins):
+        group = [
+            ProductListing(
+                seller=SELLER_NAME if rnd.random() < 0.05 else f"Seller {rnd.randint(0, 999)}",
+                price=rnd.randint(100, 5000) / 100,
+                rating=rnd.randint(70, 100),
+                total_ratings=rnd.randint(0, 10000),
+                condition=Condition(rnd.randint(1, 9))
+            )
+            for _ in range(rnd.randint(0, offers * 2))
+        ]
+        groups.append(sorted(group))
+    conditions = [rnd.randint(0, 9) for _ in range(asins)]
+    weights = [rnd.choice([-1, 1]) * rnd.randint(1, 50) / 10 for _ in range(asins)]
+    return groups, conditions, weights
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scalar vs batch repricing benchmark")
+    parser.add_argument("--asins", type=int, default=100000)
+    parser.add_argument("--offers", type=int, default=12, help="Mean offers per ASIN")
+    parser.add_argument("--rating", type=int, default=90)
+    args = parser.parse_args()
+
+    Console.SellerName = SELLER_NAME
+    groups, conditions, weights = make_catalog(args.asins, args.offers)
+    seller = ProductListing(seller=SELLER_NAME)
+
+    start = time.perf_counter()
+    scalar_prices, scalar_profits = [], []
+    for group, condition, weight in zip(groups, conditions, weights):
+        repricer = Repricer(Product("", "", weight), group)
+        repricer.rating_filter = args.rating
+        repricer.condition_filter = Condition(condition)
+        price = repricer.reprice(seller)
+        scalar_prices.append(price)
+        scalar_profits.append(repricer.calculate_profit(price, seller.shipping))
+    scalar_time = time.perf_counter() - start
+
+    table = OfferTable.from_listings(groups, seller_name=SELLER_NAME)
+    start = time.perf_counter()
+    batch = BatchRepricer(rating_filter=args.rating)
+    prices = batch.reprice(table, conditions, seller.shipping)
+    profits = batch.calculate_profit(prices, seller.shipping, batch.shipping_rate(weights))
+    batch_time = time.perf_counter() - start
+
+    assert prices.tolist() == scalar_prices and profits.tolist() == scalar_profits
+    print(f"{args.asins} ASINs, {len(table.total)} offers")
+    print(f"Repricer:      {scalar_time:8.3f} sec")
+    print(f"BatchRepricer: {batch_time:8.3f} sec ({scalar_time / batch_time:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
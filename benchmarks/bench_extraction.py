@@ -0,0 +1,98 @@
+"""
+File:           bench_extraction.py
+Author:         Dibyaranjan Sathua
+Created on:     19/10/26, 12:10 PM
+
+Micro-benchmark of the per offer row extraction cost. The legacy extraction runs a separate
+find and compiles a regex for every field; OFFER_PLAN visits the row once with precompiled
+regular expressions.
+
+Usage: python -m benchmarks.bench_extraction [--rows N] [--repeat N] [--parser BACKEND]
+"""
+from typing import Callable, Dict, List
+import argparse
+import re
+import timeit
+
+from bs4 import BeautifulSoup
+from bs4.element import Tag
+
+from benchmarks.fixtures import listing_page
+from src.condition import Condition
+from src.product_listing_parser import ProductListingParser, OFFER_PLAN
+from src.url_parser import URLParser
+
+
+def legacy_extract(row: Tag) -> Dict:
+    """ Offer row extraction before the extraction plan """
+    price = row.find("div", attrs={"class": "olpPriceColumn"}).text.strip().replace("\n", "")
+    match_obj = re.compile(r"(\d+(?:\.\d+)?)").search(price)
+    price = float(match_obj.group(1)) if match_obj is not None else 0.0
+
+    seller = row.find("div", attrs={"class": "olpSellerColumn"})
+    seller = seller.find("h3", attrs={"class": "olpSellerName"})
+    seller = seller.text.strip().replace("\n", "") if seller is not None else "Amazon.com"
+
+    rating = row.find("div", attrs={"class": "olpSellerColumn"}).find("p")
+    if rating is None:
+        rating = 100
+    else:
+        match_obj = re.compile(r"(\d+)\s*%").search(rating.text.strip().replace("\n", ""))
+        rating = int(match_obj.group(1)) if match_obj is not None else 100
+
+    no_of_ratings = row.find("div", attrs={"class": "olpSellerColumn"}).find("p")
+    if no_of_ratings is None:
+        no_of_ratings = 0
+    else:
+        match_obj = re.compile(r"\(\s*(\d+).*\)").search(
+            no_of_ratings.text.strip().replace("\n", "")
+        )
+        no_of_ratings = int(match_obj.group(1)) if match_obj is not None else 0
+
+    condition_mapping = {
+        "New": Condition.NEW,
+        "Used-LikeNew": Condition.USED_LIKE_NEW,
+        "Used-VeryGood": Condition.USED_VERY_GOOD,
+        "Used-Good": Condition.USED_GOOD,
+        "Used-Acceptable": Condition.USED_ACCEPTABLE,
+        "Collectible-LikeNew": Condition.COLLECTIBLE_LIKE_NEW,
+        "Collectible-VeryGood": Condition.COLLECTIBLE_VERY_GOOD,
+        "Collectible-Good": Condition.COLLECTIBLE_GOOD,
+        "Collectible-Acceptable": Condition.COLLECTIBLE_ACCEPTABLE
+    }
+    condition = row.find("div", attrs={"class": "olpConditionColumn"}).\
+        find("span", attrs={"class": "olpCondition"}).text.strip().\
+        replace("\n", "").replace(" ", "")
+    condition = Condition(condition_mapping[condition].value)
+    return {"price": price, "seller": seller, "rating": rating, "total_ratings": no_of_ratings,
+            "condition": condition}
+
+
+def bench(name: str, extract: Callable[[Tag], Dict], rows: List[Tag], repeat: int) -> float:
+    """ Print and return the best per row time in microseconds """
+    best = min(timeit.repeat(lambda: [extract(row) for row in rows], number=1, repeat=repeat))
+    per_row = best / len(rows) * 1e6
+    print(f"{name:>8}: {per_row:8.1f} us/row")
+    return per_row
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offer row extraction micro-benchmark")
+    parser.add_argument("--rows", type=int, default=1000, help="Number of offer rows")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of timed repetitions")
+    parser.add_argument("--parser", choices=URLParser.BACKENDS, default="html.parser",
+                        help="HTML parser backend used to build the rows")
+    args = parser.parse_args()
+
+    soup = BeautifulSoup(listing_page("0802136680", 0, 1, offers_per_page=args.rows),
+                         args.parser)
+    rows = soup.find_all("div", attrs={"class": ProductListingParser.OFFER_CLASS})
+    assert [legacy_extract(row) for row in rows] == [OFFER_PLAN.extract(row) for row in rows]
+
+    before = bench("before", legacy_extract, rows, args.repeat)
+    after = bench("after", OFFER_PLAN.extract, rows, args.repeat)
+    print(f"Speedup: {before / after:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+File:           bench_listing.py
+Author:         Dibyaranjan Sathua
+Created on:     20/10/26, 3:30 PM
+
+Memory per offer and cost to sort offers of the slot based ProductListing against the previous
+dict based implementation with property comparison chains.
+
+Usage: python -m benchmarks.bench_listing [--offers N]
+"""
+from typing import Callable, List
+import argparse
+import random
+import time
+import tracemalloc
+
+from src.condition import Condition
+from src.product_listing import ProductListing
+
+
+class LegacyProductListing:
+    """ ProductListing before the slots and the sort key """
+
+    def __init__(self, seller: str, price: float, rating: int, total_ratings: int,
+                 condition: Condition, tax: float = 0.0, shipping: float = 3.99):
+        self._seller = seller
+        self._price = price
+        self._shipping = shipping
+        self._tax = tax
+        self._rating = rating
+        self._total_ratings = total_ratings
+        self._condition = condition
+        self._total = self._price + self._shipping + self._tax
+
+    @property
+    def rating(self) -> int:
+        return self._rating
+
+    @property
+    def total_ratings(self) -> int:
+        return self._total_ratings
+
+    @property
+    def condition(self) -> Condition:
+        return self._condition
+
+    @property
+    def total(self) -> float:
+        return self._total
+
+    def __lt__(self, other):
+        if self.total == other.total:
+            if self.condition == other.condition:
+                if self.rating == other.rating:
+                    return self.total_ratings > other.total_ratings
+                return self.rating > other.rating
+            return self.condition > other.condition
+        return self.total < other.total
+
+
+def make_offers(cls: Callable, count: int, seed: int = 0) -> List:
+    """ Random offers with many equal totals to exercise the tie breaks """
+    rnd = random.Random(seed)
+    return [
+        cls(
+            seller=f"Seller {rnd.randint(0, 999)}",
+            price=rnd.randint(100, 2000) / 4,
+            rating=rnd.randint(80, 100),
+            total_ratings=rnd.randint(0, 100000),
+            condition=Condition(rnd.randint(1, 9))
+        )
+        for _ in range(count)
+    ]
+
+
+def memory_per_offer(cls: Callable, count: int) -> float:
+    """ Bytes allocated per offer """
+    tracemalloc.start()
+    offers = make_offers(cls, count)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del offers
+    return size / count
+
+
+def sort_time(offers: List, **kwargs) -> float:
+    start = time.perf_counter()
+    sorted(offers, **kwargs)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ProductListing memory and sort benchmark")
+    parser.add_argument("--offers", type=int, default=100000)
+    args = parser.parse_args()
+
+    legacy = make_offers(LegacyProductListing, args.offers)
+    offers = make_offers(ProductListing, args.offers)
+    legacy_order = sorted(range(args.offers), key=lambda i: legacy[i])
+    assert legacy_order == sorted(range(args.offers), key=lambda i: offers[i])
+
+    print(f"Memory per offer: before {memory_per_offer(LegacyProductListing, args.offers):.0f} "
+          f"bytes, after {memory_per_offer(ProductListing, args.offers):.0f} bytes")
+    print(f"Sort {args.offers} offers: before {sort_time(legacy):.3f} sec, "
+          f"after {sort_time(offers):.3f} sec, "
+          f"after with sort_key {sort_time(offers, key=ProductListing.sort_key.fget):.3f} sec")
+
+
+if __name__ == "__main__":
+    main()
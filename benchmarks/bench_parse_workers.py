@@ -0,0 +1,77 @@
+"""
+File:           bench_parse_workers.py
+Author:         Dibyaranjan Sathua
+Created on:     21/10/26, 11:20 AM
+
+Offer listing pages parsed per second by the download threads against the number of parse
+worker processes. Without workers the threads hold the GIL while building the soup, so they
+can't download in the meantime.
+
+Usage: python -m benchmarks.bench_parse_workers [--pages N] [--threads N] [--workers 0 1 2 4]
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+import argparse
+import time
+
+from benchmarks.mock_server import MockAmazonServer, amazon_urls
+from src.amazon import Amazon
+from src.http_client import HttpClient
+from src.product_listing_parser import ProductListingParser
+from src.rate_limiter import RateLimiter
+from src.url_parser import URLParser
+
+# Rate limit high enough to never throttle the local server
+UNLIMITED_RATE = 1e6
+
+
+def pages_per_second(args: argparse.Namespace, url: str, workers: int) -> float:
+    """ Parse args.pages listing pages with args.threads threads and return the throughput """
+    client = HttpClient(pool_size=args.threads,
+                        rate_limiter=RateLimiter(rate=UNLIMITED_RATE, max_rate=UNLIMITED_RATE))
+    url_parser = URLParser(client, backend=args.parser, targeted=args.targeted, workers=workers)
+    try:
+        # Start the workers before timing
+        url_parser.extract(url, ProductListingParser.extract_page,
+                           parse_only=ProductListingParser.PARSE_ONLY)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.threads) as executor:
+            results: List = list(executor.map(
+                lambda _: url_parser.extract(url, ProductListingParser.extract_page,
+                                             parse_only=ProductListingParser.PARSE_ONLY),
+                range(args.pages)
+            ))
+        elapsed = time.perf_counter() - start
+    finally:
+        url_parser.close()
+    assert all(len(offers) == args.offers for offers, _ in results)
+    return args.pages / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parse worker throughput benchmark")
+    parser.add_argument("--pages", type=int, default=200, help="Number of parsed pages")
+    parser.add_argument("--offers", type=int, default=10, help="Offers per page")
+    parser.add_argument("--threads", type=int, default=8, help="Number of download threads")
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 1, 2, 4],
+                        help="Numbers of parse workers to compare")
+    parser.add_argument("--latency", type=float, default=0.02,
+                        help="Latency in seconds of the local server")
+    parser.add_argument("--parser", choices=URLParser.BACKENDS, default=URLParser.DEFAULT_BACKEND,
+                        help="HTML parser backend")
+    parser.add_argument("--targeted", action="store_true", help="Targeted parsing")
+    args = parser.parse_args()
+
+    with MockAmazonServer(offers_per_page=args.offers, latency=args.latency) as server, \
+            amazon_urls(server.url):
+        url = Amazon.LISTING_URL.format("0802136680")
+        baseline = None
+        for workers in args.workers:
+            throughput = pages_per_second(args, url, workers)
+            baseline = baseline or throughput
+            print(f"{workers:>2} workers: {throughput:8.1f} pages/sec "
+                  f"({throughput / baseline:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+File:           bench_streaming_memory.py
+Author:         Dibyaranjan Sathua
+Created on:     24/10/26, 2:30 PM
+
+Memory check of the streaming mode over a large synthetic input. The download, parse and
+reprice stage is replaced by a synthetic result, so the check covers everything around it:
+reading and grouping the input, the in flight window, the output, journal and unprofitable
+writers. The traced memory is sampled while the results are written. The memory ceiling is
+checked by tests/test_streaming_memory.py.
+
+Usage: python -m benchmarks.bench_streaming_memory [--lines N] [--compare]
+"""
+from typing import Dict, List, TextIO, Tuple
+import argparse
+import contextlib
+import os
+import tempfile
+import time
+import tracemalloc
+
+from src.amazon import Amazon
+from src.condition import Condition
+from src.product import Product
+
+
+class SyntheticAmazon(Amazon):
+    """ Amazon with a synthetic ASIN processing stage sampling the traced memory """
+
+    def __init__(self, *args, sample_every: int = 50000, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.samples: List[int] = []
+        self._sample_every: int = sample_every
+        self._written: int = 0
+
+    def _process_asin(self, asin: str, conditions: List[int]) \
+            -> Tuple[Product, Dict[Condition, Tuple[float, float]]]:
+        product = Product(name=f"Book {asin}", asin=asin, weight=-12.8)
+        price = 5.0 + int(asin) % 20
+        return product, {Condition(condition): (price, price - 8.0) for condition in conditions}
+
+    def _write_result(self, output_file: TextIO, product: Product, price: float,
+                      profit: float) -> None:
+        super()._write_result(output_file, product, price, profit)
+        self._written += 1
+        if self._written % self._sample_every == 0:
+            self.samples.append(tracemalloc.get_traced_memory()[0])
+
+
+def write_input(path: str, lines: int) -> None:
+    """ Input of unique ASINs, the worst case for grouping the lines by ASIN """
+    with open(path, mode="w") as input_file:
+        for index in range(lines):
+            input_file.write(f"{index:010d} {index % 9 + 1}\n")
+
+
+def measure(directory: str, lines: int, streaming: bool) -> Tuple[List[int], float]:
+    """ Run a batch and return the memory samples in bytes and the elapsed seconds """
+    input_file = os.path.join(directory, "input.txt")
+    write_input(input_file, lines)
+    amazon = SyntheticAmazon("Benchmark Seller", 90, 1.0, input_file, concurrency=4,
+                             streaming=streaming, sample_every=max(1, lines // 20))
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        with open(os.devnull, mode="w") as devnull, contextlib.redirect_stdout(devnull):
+            amazon.process_input()
+    finally:
+        elapsed = time.perf_counter() - start
+        tracemalloc.stop()
+    return amazon.samples, elapsed
+
+
+def report(name: str, samples: List[int], elapsed: float) -> float:
+    """ Print the samples and return the growth after the first sample in MiB """
+    growth = (max(samples) - samples[0]) / 2 ** 20
+    print(f"{name}: {elapsed:.1f} sec, traced memory "
+          f"{' '.join(f'{sample / 2 ** 20:.1f}' for sample in samples)} MiB, "
+          f"growth {growth:.2f} MiB")
+    return growth
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Streaming mode memory check")
+    parser.add_argument("--lines", type=int, default=1000000, help="Number of input lines")
+    parser.add_argument("--compare", action="store_true",
+                        help="Also measure the default mode, which groups the whole input")
+    args = parser.parse_args()
+
+    # The journal is synced for every ASIN, a memory backed directory keeps the run short
+    shm = "/dev/shm" if os.path.isdir("/dev/shm") else None
+    with tempfile.TemporaryDirectory(dir=shm) as directory:
+        if args.compare:
+            report("default", *measure(directory, args.lines, streaming=False))
+        report("streaming", *measure(directory, args.lines, streaming=True))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+File:           fixtures.py
+Author:         Dibyaranjan Sathua
+Created on:     19/10/26, 11:35 AM
+
+Synthetic Amazon product and offer listing pages with the same structure as the pages read by
+ProductParser and ProductListingParser.
+"""
+from typing import List
+import random
+import zlib
+
+CONDITIONS: List[str] = [
+    "New", "Used - Like New", "Used - Very Good", "Used - Good", "Used - Acceptable",
+    "Collectible - Like New", "Collectible - Very Good", "Collectible - Good",
+    "Collectible - Acceptable"
+]
+OFFERS_PER_PAGE: int = 10
+# Unrelated markup to give the pages a realistic size
+FILLER: str = "".join(
+    f'<div class="a-section filler-{i}"><span class="a-size-small">Filler text {i}</span>'
+    f'<a href="/gp/help/{i}">Help</a></div>\n'
+    for i in range(200)
+)
+
+
+def product_page(asin: str, weight: str = "12.8 ounces") -> str:
+    """ Product page with the title and the detail bullets """
+    return f"""<!DOCTYPE html><html><head><title>Amazon.com: Book {asin}</title></head>
+<body><div id="dp-container">{FILLER}
+<h1 id="title"><span id="productTitle" class="a-size-extra-large">
+  Book {asin}
+</span></h1>
+<div id="detailBullets_feature_div"><ul class="a-unordered-list">
+<li><span class="a-list-item"><span class="a-text-bold">Publisher
+:
+</span><span>Grove Press (January 1, 2000)</span></span></li>
+<li><span class="a-list-item"><span class="a-text-bold">ISBN-10
+:
+</span><span>{asin}</span></span></li>
+<li><span class="a-list-item"><span class="a-text-bold">Item Weight
+:
+</span><span>{weight}</span></span></li>
+</ul></div>{FILLER}</div></body></html>"""
+
+
+def offer_row(index: int, rnd: random.Random, seller: str = "") -> str:
+    """ Offer row. Prices increase with the index so that the pages are sorted by total. """
+    price = 5 + index * 0.75 + rnd.randint(0, 50) / 100
+    condition = CONDITIONS[rnd.randint(0, len(CONDITIONS) - 1)]
+    seller = seller or f"Seller {index}"
+    rating = "" if index % 7 == 0 else \
+        f'<p><i class="a-icon a-icon-star-5"></i><a href="/gp/seller"><b>' \
+        f'{rnd.randint(80, 100)}% positive</b></a> over the past 12 months. ' \
+        f'({rnd.randint(10, 99999)} total ratings)</p>'
+    return f"""<div class="a-row a-spacing-mini olpOffer" role="row">
+<div class="a-column a-span2 olpPriceColumn" role="gridcell">
+<span class="a-size-large a-color-price olpOfferPrice a-text-bold">  ${price:.2f}  </span>
+<p class="olpShippingInfo"><span class="a-color-secondary">&amp; <b>FREE Shipping</b></span></p>
+</div>
+<div class="a-column a-span3 olpConditionColumn" role="gridcell">
+<div id="offerCondition" class="a-section a-spacing-small">
+<span class="a-size-medium olpCondition a-text-bold">
+ {condition}
+</span></div></div>
+<div class="a-column a-span2 olpDeliveryColumn" role="gridcell">
+<ul class="a-unordered-list"><li><span>Arrives between Oct 20-24.</span></li></ul></div>
+<div class="a-column a-span2 olpSellerColumn" role="gridcell">
+<h3 class="a-spacing-none olpSellerName"><span class="a-size-medium a-text-bold">
+<a href="/gp/aag/main">{seller}</a></span></h3>{rating}</div>
+<div class="a-column a-span3 olpBuyColumn a-span-last" role="gridcell">
+<form method="post" action="/gp/item-dispatch"><input type="submit" value="Add to cart"></form>
+</div></div>"""
+
+
+def listing_page(asin: str, page: int, pages: int, offers_per_page: int = OFFERS_PER_PAGE,
+                 my_seller: str = "", my_offer_index: int = 3, seed: int = 0) -> str:
+    """ Page of the offer listing with its pagination, deterministic for the same arguments """
+    rnd = random.Random(zlib.crc32(f"{asin}:{page}:{seed}".encode()))
+    rows = "".join(
+        offer_row(
+            page * offers_per_page + i,
+            rnd,
+            seller=my_seller if page * offers_per_page + i == my_offer_index else ""
+        )
+        for i in range(offers_per_page)
+    )
+    pagination = ""
+    if pages > 1:
+        if page + 1 < pages:
+            next_link = f'<li class="a-last"><a href="/gp/offer-listing/{asin}/' \
+                        f'ref=olp_page_next?ie=UTF8&amp;startIndex={(page + 1) * 10}">Next</a></li>'
+        else:
+            next_link = '<li class="a-disabled a-last">Next</li>'
+        pagination = f'<ul class="a-pagination"><li class="a-selected"><a>{page + 1}</a></li>' \
+                     f'{next_link}</ul>'
+    return f"""<!DOCTYPE html><html><head><title>Amazon.com: Buying Choices</title></head>
+<body><div id="olpOfferListColumn">{FILLER}<div id="olpOfferList">{rows}</div>
+<div class="a-text-center a-spacing-large">{pagination}</div>{FILLER}</div></body></html>"""
@@ -0,0 +1,120 @@
+"""
+File:           mock_server.py
+Author:         Dibyaranjan Sathua
+Created on:     19/10/26, 2:00 PM
+
+Local stand-in for Amazon serving the synthetic product and offer listing pages with a
+configurable latency and error rate.
+"""
+from typing import Iterator, Optional, Tuple
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+import random
+import re
+import threading
+import time
+
+from benchmarks import fixtures
+from src.amazon import Amazon
+from src.product_listing_parser import ProductListingParser
+
+
+class MockAmazonServer:
+    """ Threaded HTTP server serving the fixtures on localhost """
+    PRODUCT_PATH = re.compile(r"^/gp/product/(\w+)")
+    LISTING_PATH = re.compile(r"^/gp/offer-listing/(\w+)")
+
+    def __init__(self, pages: int = 1, offers_per_page: int = fixtures.OFFERS_PER_PAGE,
+                 latency: float = 0.0, error_rate: float = 0.0, my_seller: str = "",
+                 port: int = 0, seed: int = 0):
+        self.pages: int = pages
+        self.offers_per_page: int = offers_per_page
+        self.latency: float = latency
+        self.error_rate: float = error_rate
+        self.my_seller: str = my_seller
+        self.requests: int = 0
+        self.errors: int = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                status, body = server.respond(self.path)
+                payload = body.encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def respond(self, path: str) -> Tuple[int, str]:
+        """ Return the status and the body of the path """
+        with self._lock:
+            self.requests += 1
+            failed = self._random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+        if failed:
+            return 503, "<html><body>Service Unavailable</body></html>"
+
+        url = urlsplit(path)
+        match_obj = MockAmazonServer.PRODUCT_PATH.match(url.path)
+        if match_obj is not None:
+            return 200, fixtures.product_page(match_obj.group(1))
+        match_obj = MockAmazonServer.LISTING_PATH.match(url.path)
+        if match_obj is not None:
+            start_index = int(parse_qs(url.query).get("startIndex", ["0"])[0])
+            return 200, fixtures.listing_page(
+                match_obj.group(1), start_index // 10, self.pages,
+                offers_per_page=self.offers_per_page, my_seller=self.my_seller
+            )
+        return 404, "<html><body>Not Found</body></html>"
+
+    def start(self) -> "MockAmazonServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "MockAmazonServer":
+        return self.start()
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+
+@contextmanager
+def amazon_urls(base_url: str) -> Iterator[None]:
+    """ Point Amazon and ProductListingParser to base_url instead of amazon.com """
+    saved = (Amazon.PRODUCT_URL, Amazon.LISTING_URL, ProductListingParser.BASE_URL)
+    Amazon.PRODUCT_URL = f"{base_url}gp/product/{{}}"
+    Amazon.LISTING_URL = f"{base_url}gp/offer-listing/{{}}/ref=olp_tab_all"
+    ProductListingParser.BASE_URL = base_url
+    try:
+        yield
+    finally:
+        Amazon.PRODUCT_URL, Amazon.LISTING_URL, ProductListingParser.BASE_URL = saved
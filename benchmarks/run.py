@@ -0,0 +1,286 @@
+"""
+File:           run.py
+Author:         Dibyaranjan Sathua
+Created on:     19/10/26, 2:45 PM
+
+Offline benchmark suite. Every benchmark runs against the local MockAmazonServer, so no network
+access is needed. The results are saved as JSON to track regressions between commits.
+
+Usage: python -m benchmarks.run [--output FILE] [--parser BACKEND] [--asins N] ...
+"""
+from typing import Callable, Dict, List
+import argparse
+import asyncio
+import contextlib
+import http.client
+import io
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+
+from benchmarks import fixtures
+from benchmarks.mock_server import MockAmazonServer, amazon_urls
+from src.amazon import Amazon
+from src.condition import Condition
+from src.console import Console
+from src.http_client import HttpClient
+from src.indexed_repricer import IndexedRepricer
+from src.product import Product
+from src.product_listing import ProductListing
+from src.product_listing_parser import ProductListingParser
+from src.product_parser import ProductParser
+from src.rate_limiter import RateLimiter
+from src.repricer import Repricer
+from src.service import RepricingService
+from src.url_parser import URLParser
+
+SELLER_NAME = "Benchmark Seller"
+# Rate limit high enough to never throttle the local server
+UNLIMITED_RATE = 1e6
+
+
+def measure(function: Callable[[], object], iterations: int) -> Dict[str, float]:
+    """ Run the function iterations times and return its timing statistics in milliseconds """
+    timings: List[float] = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start) * 1000)
+    return {
+        "iterations": iterations,
+        "mean_ms": statistics.mean(timings),
+        "median_ms": statistics.median(timings),
+        "min_ms": min(timings),
+        "max_ms": max(timings),
+        "stdev_ms": statistics.stdev(timings) if len(timings) > 1 else 0.0,
+    }
+
+
+def make_url_parser(args: argparse.Namespace) -> URLParser:
+    """ URLParser of the benchmarked backend without rate limiting """
+    client = HttpClient(rate_limiter=RateLimiter(rate=UNLIMITED_RATE, max_rate=UNLIMITED_RATE))
+    return URLParser(client, backend=args.parser, targeted=args.targeted)
+
+
+def bench_url_parser(args: argparse.Namespace, server: MockAmazonServer) -> Dict[str, float]:
+    """ Fetch and build the soup of an offer listing page """
+    url_parser = make_url_parser(args)
+    url = Amazon.LISTING_URL.format("0802136680")
+    return measure(
+        lambda: url_parser.parse(url, parse_only=ProductListingParser.PARSE_ONLY),
+        args.iterations
+    )
+
+
+def bench_product_parser(args: argparse.Namespace, server: MockAmazonServer) -> Dict[str, float]:
+    """ Parse a product page """
+    url_parser = make_url_parser(args)
+    url = Amazon.PRODUCT_URL.format("0802136680")
+    return measure(lambda: ProductParser(url, url_parser).parse(), args.iterations)
+
+
+def bench_listing_parser(args: argparse.Namespace, server: MockAmazonServer) -> Dict[str, float]:
+    """ Parse all the pages of an offer listing """
+    url_parser = make_url_parser(args)
+    url = Amazon.LISTING_URL.format("0802136680")
+    result = measure(lambda: ProductListingParser(url, url_parser).parse(), args.iterations)
+    result["offers"] = args.pages * args.offers_per_page
+    return result
+
+
+def bench_repricer(args: argparse.Namespace, server: MockAmazonServer) -> Dict[str, float]:
+    """ Reprice against the offers of a fully parsed offer listing, in memory """
+    url_parser = make_url_parser(args)
+    listings = ProductListingParser(Amazon.LISTING_URL.format("0802136680"), url_parser).parse()
+    repricer = Repricer(Product("Benchmark", "0802136680", 1.0), listings)
+    # The worst case for reprice: a rating filter no offer passes scans all the offers
+    repricer.rating_filter = 101
+    repricer.condition_filter = Condition.USED_GOOD
+    seller = ProductListing(seller=SELLER_NAME)
+    result = measure(lambda: repricer.reprice(seller), args.iterations * 100)
+    result["offers"] = len(listings)
+    return result
+
+
+def bench_indexed_repricer(args: argparse.Namespace,
+                           server: MockAmazonServer) -> Dict[str, float]:
+    """ Change the price of one competitor offer and reprice incrementally """
+    url_parser = make_url_parser(args)
+    listings = ProductListingParser(Amazon.LISTING_URL.format("0802136680"), url_parser).parse()
+    repricer = IndexedRepricer(Product("Benchmark", "0802136680", 1.0), listings)
+    repricer.rating_filter = 90
+    repricer.condition_filter = Condition.USED_GOOD
+    seller = ProductListing(seller=SELLER_NAME)
+    prices = itertools.cycle([listing.price for listing in listings])
+    competitors = itertools.cycle(listings)
+
+    def update_and_reprice():
+        repricer.update_listing(next(competitors), price=next(prices))
+        repricer.reprice(seller)
+
+    result = measure(update_and_reprice, args.iterations * 100)
+    result["offers"] = len(listings)
+    return result
+
+
+def bench_amazon_run(args: argparse.Namespace, server: MockAmazonServer) -> Dict[str, float]:
+    """ End to end Amazon.run of an input file """
+    with tempfile.TemporaryDirectory() as directory:
+        input_file = os.path.join(directory, "books.txt")
+        with open(input_file, mode="w") as infile:
+            for index in range(args.asins):
+                infile.write(f"{1000000000 + index} {Condition.USED_GOOD.value + index % 4}\n")
+
+        def run():
+            amazon = Amazon(
+                seller_name=SELLER_NAME,
+                target_rating=90,
+                min_profit=1.0,
+                input_file=input_file,
+                concurrency=args.concurrency,
+                parser_backend=args.parser,
+                targeted_parse=args.targeted,
+                request_rate=UNLIMITED_RATE,
+                max_request_rate=UNLIMITED_RATE
+            )
+            with contextlib.redirect_stdout(io.StringIO()):
+                amazon.run()
+
+        server.latency = args.latency
+        server.error_rate = args.error_rate
+        requests_before = server.requests
+        try:
+            result = measure(run, args.e2e_iterations)
+        finally:
+            server.latency = 0.0
+            server.error_rate = 0.0
+        result["asins"] = args.asins
+        result["asins_per_sec"] = args.asins / (result["mean_ms"] / 1000)
+        result["requests_per_asin"] = \
+            (server.requests - requests_before) / (args.asins * args.e2e_iterations)
+        return result
+
+
+def bench_service(args: argparse.Namespace, server: MockAmazonServer) -> Dict[str, float]:
+    """ Reprice an ASIN with cached offers through the /reprice endpoint of the service """
+    service = RepricingService(
+        seller_name=SELLER_NAME,
+        target_rating=90,
+        min_profit=1.0,
+        concurrency=args.concurrency,
+        parser_backend=args.parser,
+        targeted_parse=args.targeted,
+        request_rate=UNLIMITED_RATE,
+        max_request_rate=UNLIMITED_RATE,
+        offer_ttl=3600.0
+    )
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    service_server = asyncio.run_coroutine_threadsafe(service.start("127.0.0.1", 0), loop).result()
+    connection = http.client.HTTPConnection("127.0.0.1", service_server.sockets[0].getsockname()[1])
+
+    def reprice():
+        connection.request("GET", f"/reprice?asin=0802136680&condition={Condition.USED_GOOD.value}")
+        connection.getresponse().read()
+
+    async def shutdown():
+        """ Stop the server and the connection handlers before the loop stops """
+        service_server.close()
+        await service_server.wait_closed()
+        # The handler of the closed client connection ends on its own, the others are cancelled
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=5.0)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    try:
+        reprice()
+        result = measure(reprice, args.iterations * 10)
+    finally:
+        connection.close()
+        asyncio.run_coroutine_threadsafe(shutdown(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+        service.close()
+    result["cached_ratio"] = service.metrics.counter("offer_cache_requests_total", result="hit") \
+        / (result["iterations"] + 1)
+    return result
+
+
+BENCHMARKS: Dict[str, Callable[[argparse.Namespace, MockAmazonServer], Dict[str, float]]] = {
+    "url_parser.parse": bench_url_parser,
+    "product_parser.parse": bench_product_parser,
+    "product_listing_parser.parse": bench_listing_parser,
+    "repricer.reprice": bench_repricer,
+    "indexed_repricer.update": bench_indexed_repricer,
+    "amazon.run": bench_amazon_run,
+    "service.reprice": bench_service,
+}
+
+
+def git_commit() -> str:
+    """ Return the current commit of the repository """
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline repricer benchmarks")
+    parser.add_argument("--output", default="bench_results.json",
+                        help="JSON file to save the results (default: bench_results.json)")
+    parser.add_argument("--only", choices=list(BENCHMARKS), action="append",
+                        help="Run only this benchmark (can be repeated)")
+    parser.add_argument("--parser", choices=URLParser.BACKENDS, default=URLParser.DEFAULT_BACKEND)
+    parser.add_argument("--targeted", action="store_true")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=3, help="Offer listing pages per ASIN")
+    parser.add_argument("--offers-per-page", type=int, default=fixtures.OFFERS_PER_PAGE)
+    parser.add_argument("--asins", type=int, default=50, help="ASINs of the end to end run")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="Server latency in seconds of the end to end run")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="Fraction of 503 responses of the end to end run")
+    parser.add_argument("--e2e-iterations", type=int, default=1)
+    args = parser.parse_args()
+
+    Console.SellerName = SELLER_NAME
+    results: Dict[str, Dict[str, float]] = {}
+    server = MockAmazonServer(pages=args.pages, offers_per_page=args.offers_per_page,
+                              my_seller=SELLER_NAME)
+    with server, amazon_urls(server.url):
+        for name, benchmark in BENCHMARKS.items():
+            if args.only and name not in args.only:
+                continue
+            results[name] = benchmark(args, server)
+            print(f"{name:>30}: {results[name]['mean_ms']:10.3f} ms "
+                  f"(median {results[name]['median_ms']:.3f} ms)")
+
+    report = {
+        "timestamp": time.time(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": vars(args),
+        "results": results,
+    }
+    with open(args.output, mode="w") as outfile:
+        json.dump(report, outfile, indent=2)
+    print(f"Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,16 +6,243 @@ Created on:     07/09/20, 2:05 PM
 
 This is the main function to use the repricer tool using console input.
 """
+import argparse
+import json
+import os
+import signal
+import time
+
 from src.console import Console
 from src.amazon import Amazon
+from src.http_client import HttpClient
+from src.url_parser import URLParser
+from src.rate_limiter import RateLimiter
+from src.retry_queue import RetryQueue
+from src.profiler import Profiler
+from src.sharding import ShardedRun
+from src.daemon import RepricingDaemon
+from src.scheduler import PollScheduler
+from src.product_store import ProductStore
+from src.snapshot_store import SnapshotStore
+from src.service import OfferCache, RepricingService
+
+
+def parse_args() -> argparse.Namespace:
+    """ Parse the command line options """
+    parser = argparse.ArgumentParser(description="Amazon repricer tool")
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="Number of ASINs processed in parallel (default: 1)")
+    parser.add_argument("--timeout", type=float, default=HttpClient.DEFAULT_TIMEOUT,
+                        help="Timeout in seconds for every HTTP request "
+                             f"(default: {HttpClient.DEFAULT_TIMEOUT})")
+    parser.add_argument("--parser", choices=URLParser.BACKENDS, default=URLParser.DEFAULT_BACKEND,
+                        help=f"HTML parser backend (default: {URLParser.DEFAULT_BACKEND})")
+    parser.add_argument("--targeted", action="store_true",
+                        help="Only build the parts of the pages used by the parsers "
+                             "(ignored by html5lib)")
+    parser.add_argument("--parse-workers", type=int, default=0,
+                        help="Number of processes building the pages, so that parsing doesn't "
+                             "block the downloads (default: 0, parse in the download threads)")
+    parser.add_argument("--rate", type=float, default=RateLimiter.DEFAULT_RATE,
+                        help="Initial requests per second to Amazon, adapted while running "
+                             f"(default: {RateLimiter.DEFAULT_RATE})")
+    parser.add_argument("--max-rate", type=float, default=RateLimiter.DEFAULT_MAX_RATE,
+                        help="Maximum requests per second to Amazon "
+                             f"(default: {RateLimiter.DEFAULT_MAX_RATE})")
+    parser.add_argument("--cache", metavar="FILE",
+                        help="Cache the downloaded pages in FILE between runs")
+    parser.add_argument("--product-store", metavar="FILE",
+                        help="Store the parsed products in FILE and skip their product page in "
+                             "the later runs")
+    parser.add_argument("--fingerprints", metavar="FILE",
+                        help="Store a fingerprint of the offers read to reprice every ASIN in "
+                             "FILE and reuse the last prices of the ASINs whose offers didn't "
+                             "change")
+    parser.add_argument("--snapshots", metavar="DIR",
+                        help="Append the offers read to reprice every ASIN to the snapshot store "
+                             "in DIR, e.g. to backtest the repricing settings later")
+    parser.add_argument("--refresh", metavar="ASIN", action="append", default=[],
+                        help="Parse the product page of ASIN again even if it is stored "
+                             "(can be repeated)")
+    parser.add_argument("--journal", metavar="FILE",
+                        help="Journal of the completed ASINs used to resume an interrupted run "
+                             "(default: <input>_journal.jsonl)")
+    parser.add_argument("--restart", action="store_true",
+                        help="Ignore the journal of an interrupted run and start from the first "
+                             "line")
+    parser.add_argument("--max-attempts", type=int, default=RetryQueue.DEFAULT_MAX_ATTEMPTS,
+                        help="Attempts per ASIN before it is reported as failed "
+                             f"(default: {RetryQueue.DEFAULT_MAX_ATTEMPTS})")
+    parser.add_argument("--retry-delay", type=float, default=RetryQueue.DEFAULT_DELAY,
+                        help="Seconds before the first retry of a failed ASIN, doubled on every "
+                             f"retry (default: {RetryQueue.DEFAULT_DELAY})")
+    parser.add_argument("--stream", action="store_true",
+                        help="Read the input in chunks and spill the unprofitable products to "
+                             "<input>_unprofitable.txt to keep the memory bounded on very large "
+                             "inputs")
+    parser.add_argument("--metrics-file", metavar="FILE",
+                        help="Write the run metrics to FILE in the Prometheus text format")
+    parser.add_argument("--metrics-port", type=int, metavar="PORT",
+                        help="Serve the run metrics on http://127.0.0.1:PORT/metrics")
+    parser.add_argument("--profile", metavar="DIR",
+                        help="Profile the batch run with cProfile and tracemalloc and write the pstats, "
+                             "collapsed stacks and hot path report to DIR (the parse workers "
+                             "are not profiled)")
+    parser.add_argument("--shards", type=int, metavar="K",
+                        help="Split the input by ASIN into K shards processed by K processes, "
+                             "each with its own rate limit, and merge their results")
+    parser.add_argument("--shard", type=int, metavar="I",
+                        help="With --shards, only process the shard I (0 to K-1), e.g. on one of "
+                             "several machines sharing the shard directory")
+    parser.add_argument("--merge", action="store_true",
+                        help="With --shards, merge the results of the shards into the output file")
+    parser.add_argument("--shard-dir", metavar="DIR",
+                        help="Directory of the shard inputs and results (default: <input>_shards)")
+    parser.add_argument("--seller", help="Amazon seller name, asked on the console if missing")
+    parser.add_argument("--target-rating", type=int, help="Target seller rating in percent")
+    parser.add_argument("--min-profit", type=float, help="Minimum profit in dollars")
+    parser.add_argument("--input", metavar="FILE", help="File of the product listings")
+    parser.add_argument("--daemon", action="store_true",
+                        help="Keep repricing the input ASINs, polling the ASINs whose offers "
+                             "change often and the most profitable ones more often (requires "
+                             "--seller, --target-rating, --min-profit and --input)")
+    parser.add_argument("--min-interval", type=float, default=PollScheduler.DEFAULT_MIN_INTERVAL,
+                        help="Minimum seconds between two polls of an ASIN in daemon mode "
+                             f"(default: {PollScheduler.DEFAULT_MIN_INTERVAL:g})")
+    parser.add_argument("--max-interval", type=float, default=PollScheduler.DEFAULT_MAX_INTERVAL,
+                        help="Maximum seconds between two polls of an ASIN in daemon mode "
+                             f"(default: {PollScheduler.DEFAULT_MAX_INTERVAL:g})")
+    parser.add_argument("--backtest", metavar="GRID",
+                        help="Replay the offers of the snapshot store through the repricer for "
+                             "every configuration of GRID, a JSON file of rating_filter, "
+                             "price_floor, price_ceiling and condition_filter values, and report "
+                             "their projected profit (requires --snapshots and --product-store)")
+    parser.add_argument("--backtest-days", type=float, metavar="DAYS",
+                        help="Only replay the snapshots of the last DAYS days")
+    parser.add_argument("--backtest-workers", type=int, default=os.cpu_count(),
+                        help="Processes evaluating the configurations (default: number of CPUs)")
+    parser.add_argument("--serve", type=int, metavar="PORT",
+                        help="Run the repricing HTTP service on PORT instead of a batch, keeping "
+                             "the products and the recent offer pages in memory (requires "
+                             "--seller, --target-rating and --min-profit)")
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="Address the service listens on (default: 127.0.0.1)")
+    parser.add_argument("--offer-ttl", type=float, default=OfferCache.DEFAULT_TTL,
+                        help="Seconds the service reuses the offer pages of an ASIN "
+                             f"(default: {OfferCache.DEFAULT_TTL:g})")
+    args = parser.parse_args()
+    interactive = None in (args.seller, args.target_rating, args.min_profit, args.input)
+    if args.daemon and interactive:
+        parser.error("--daemon requires --seller, --target-rating, --min-profit and --input")
+    if (args.shard is not None or args.merge) and args.shards is None:
+        parser.error("--shard and --merge require --shards")
+    if args.shard is not None and not 0 <= args.shard < args.shards:
+        parser.error(f"--shard must be between 0 and {args.shards - 1}")
+    if args.serve is not None and None in (args.seller, args.target_rating, args.min_profit):
+        parser.error("--serve requires --seller, --target-rating and --min-profit")
+    if args.backtest is not None and None in (args.snapshots, args.product_store):
+        parser.error("--backtest requires --snapshots and --product-store")
+    if args.profile is not None and (args.shards is not None or args.daemon or
+                                     args.serve is not None or args.backtest is not None):
+        parser.error("--profile only profiles a batch run, not --shards, --daemon, --serve "
+                     "or --backtest")
+    return args
 
 
 if __name__ == "__main__":
-    Console.read()
-    amazon = Amazon(
+    args = parse_args()
+    if args.serve is None and None in (args.seller, args.target_rating, args.min_profit,
+                                       args.input):
+        Console.read()
+    else:
+        Console.SellerName = args.seller
+        Console.TargetRating = args.target_rating
+        Console.MinProfit = args.min_profit
+        Console.FileName = args.input
+    amazon_options = dict(
         seller_name=Console.SellerName,
         target_rating=Console.TargetRating,
         min_profit=Console.MinProfit,
-        input_file=Console.FileName
+        concurrency=args.concurrency,
+        timeout=args.timeout,
+        parser_backend=args.parser,
+        targeted_parse=args.targeted,
+        parse_workers=args.parse_workers,
+        request_rate=args.rate,
+        max_request_rate=args.max_rate,
+        cache_file=args.cache,
+        product_store_file=args.product_store,
+        refresh_asins=args.refresh,
+        fingerprint_file=args.fingerprints,
+        snapshot_dir=args.snapshots,
+        resume=not args.restart,
+        max_attempts=args.max_attempts,
+        retry_delay=args.retry_delay,
+        streaming=args.stream,
+        metrics_file=args.metrics_file,
+        metrics_port=args.metrics_port
     )
-    amazon.run()
+    if args.serve is not None:
+        service = RepricingService(
+            seller_name=Console.SellerName,
+            target_rating=Console.TargetRating,
+            min_profit=Console.MinProfit,
+            concurrency=args.concurrency,
+            timeout=args.timeout,
+            parser_backend=args.parser,
+            targeted_parse=args.targeted,
+            parse_workers=args.parse_workers,
+            request_rate=args.rate,
+            max_request_rate=args.max_rate,
+            cache_file=args.cache,
+            product_store_file=args.product_store,
+            offer_ttl=args.offer_ttl
+        )
+        service.run(host=args.host, port=args.serve)
+    elif args.backtest is not None:
+        # NumPy is only needed by the backtest
+        from src.backtest import Backtest, RepricerConfig, read_input
+        with open(args.backtest, mode="r") as grid_file:
+            grid = json.load(grid_file)
+        grid.setdefault("rating_filter", [Console.TargetRating])
+        backtest = Backtest(Console.SellerName, min_profit=Console.MinProfit)
+        skipped = backtest.add_store(
+            SnapshotStore(args.snapshots), ProductStore(args.product_store),
+            read_input(Console.FileName),
+            start=time.time() - args.backtest_days * 24 * 3600
+            if args.backtest_days is not None else None
+        )
+        if skipped:
+            print(f"{len(skipped)} ASINs have no stored product or snapshot and are skipped")
+        results = backtest.run(RepricerConfig.grid(**grid), workers=args.backtest_workers)
+        print(f"Backtest of {backtest.case_count} cases")
+        for line in Backtest.report(results):
+            print(line)
+    elif args.daemon:
+        daemon = RepricingDaemon(input_file=Console.FileName, min_interval=args.min_interval,
+                                 max_interval=args.max_interval, **amazon_options)
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signal_number, lambda *_: daemon.stop())
+        daemon.run()
+    elif args.shards is not None:
+        sharded_run = ShardedRun(Console.FileName, args.shards, shard_dir=args.shard_dir,
+                                 **amazon_options)
+        if args.merge:
+            sharded_run.merge()
+        elif args.shard is not None:
+            sharded_run.run_shard(args.shard)
+        else:
+            sharded_run.run()
+    else:
+        amazon = Amazon(input_file=Console.FileName, journal_file=args.journal, **amazon_options)
+        if args.profile is None:
+            amazon.run()
+        else:
+            profiler = Profiler(args.profile)
+            profiler.start()
+            try:
+                amazon.run()
+            finally:
+                profiler.stop()
+                print(profiler.write(asins=int(amazon.metrics.counter("asins_total"))))
+                print(f"Profile written to {profiler.output_dir}")
@@ -3,8 +3,12 @@ File:           amazon.py
 Author:         Dibyaranjan Sathua
 Created on:     07/09/20, 11:46 AM
 """
-from typing import List
+from typing import List, Deque, Tuple, TextIO, Optional, Dict, Iterator, Iterable, Set
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future, FIRST_COMPLETED, wait
+import itertools
 import os
+import time
 
 from src.product import Product
 from src.product_parser import ProductParser
@@ -12,72 +16,489 @@ from src.product_listing import ProductListing
 from src.product_listing_parser import ProductListingParser
 from src.repricer import Repricer
 from src.condition import Condition
+from src.http_client import HttpClient
+from src.http_cache import HttpCache
+from src.rate_limiter import RateLimiter
+from src.product_store import ProductStore
+from src.journal import Journal, JournalEntry
+from src.retry_queue import RetryItem, RetryQueue
+from src.metrics import IterTimer, Metrics
+from src.fingerprint_store import FingerprintRecord, FingerprintStore, OfferFingerprint, Offers
+from src.snapshot_store import SnapshotStore
+from src.url_parser import URLParser
 
 
 class Amazon:
     """ Class for Amazon """
     PRODUCT_URL: str = "http://www.amazon.com/gp/product/{}"
     LISTING_URL: str = "http://www.amazon.com/gp/offer-listing/{}/ref=olp_tab_all"
+    # Number of queued ASINs per worker so that a slow ASIN at the head of the output order
+    # doesn't leave the other workers idle
+    WINDOW_FACTOR: int = 2
+    # Lines grouped by ASIN at once in streaming mode
+    STREAM_CHUNK_SIZE: int = 10000
 
-    def __init__(self, seller_name: str, target_rating: float, min_profit: float, input_file: str):
+    def __init__(self, seller_name: str, target_rating: float, min_profit: float, input_file: str,
+                 concurrency: int = 1, timeout: float = HttpClient.DEFAULT_TIMEOUT,
+                 parser_backend: str = URLParser.DEFAULT_BACKEND, targeted_parse: bool = False,
+                 parse_workers: int = 0,
+                 request_rate: float = RateLimiter.DEFAULT_RATE,
+                 max_request_rate: float = RateLimiter.DEFAULT_MAX_RATE,
+                 cache_file: Optional[str] = None, product_store_file: Optional[str] = None,
+                 refresh_asins: Optional[Iterable[str]] = None,
+                 journal_file: Optional[str] = None, resume: bool = True,
+                 keep_journal: bool = False,
+                 max_attempts: int = RetryQueue.DEFAULT_MAX_ATTEMPTS,
+                 retry_delay: float = RetryQueue.DEFAULT_DELAY,
+                 metrics_file: Optional[str] = None, metrics_port: Optional[int] = None,
+                 fingerprint_file: Optional[str] = None, streaming: bool = False,
+                 snapshot_dir: Optional[str] = None, url_parser: Optional[URLParser] = None):
         self._seller_name = seller_name
         self._target_rating = target_rating
         self._min_profit = min_profit
         self._input_file = os.path.abspath(input_file)
+        self._concurrency: int = max(1, concurrency)
+        # One pooled client for the whole run, shared by all the product and listing parsers
+        if url_parser is None:
+            url_parser = self.create_url_parser(
+                concurrency=self._concurrency, timeout=timeout, parser_backend=parser_backend,
+                targeted_parse=targeted_parse, parse_workers=parse_workers,
+                request_rate=request_rate, max_request_rate=max_request_rate,
+                cache_file=cache_file
+            )
+        self._url_parser: URLParser = url_parser
+        # Products already parsed in earlier runs. The refresh ASINs are parsed again.
+        self._product_store: Optional[ProductStore] = \
+            ProductStore(product_store_file) if product_store_file is not None else None
+        self._refresh_asins: Set[str] = set(refresh_asins) if refresh_asins is not None else set()
+        # Offer fingerprints of the earlier runs. ASINs with unchanged offers are not repriced.
+        self._fingerprint_store: Optional[FingerprintStore] = \
+            FingerprintStore(fingerprint_file) if fingerprint_file is not None else None
+        # History of the offers read to reprice every ASIN, for backtesting the settings
+        self._snapshot_store: Optional[SnapshotStore] = \
+            SnapshotStore(snapshot_dir) if snapshot_dir is not None else None
+        self._products: Dict[str, Product] = {}
         self._unprofitable: List[str] = []
+        # Streaming mode keeps the memory flat whatever the input size: the input is grouped by
+        # chunks, the products are not kept in memory and the unprofitable products are
+        # written to a file as they come
+        self._streaming: bool = streaming
+        self._unprofitable_file: Optional[TextIO] = None
+        self._unprofitable_count: int = 0
+        # Completed ASINs are journaled until the end of the run, so that an interrupted run
+        # resumes from the journal instead of the first line
+        self._journal: Journal = Journal(
+            journal_file if journal_file is not None else self._get_journal_file(input_file)
+        )
+        self._resume: bool = resume
+        # Kept when the journal is the result of the run, e.g. for merging shards
+        self._keep_journal: bool = keep_journal
+        # A failed ASIN doesn't stop the run. It is retried after the other ASINs.
+        self._retry_queue: RetryQueue = RetryQueue(max_attempts=max_attempts, delay=retry_delay)
+        # Stage metrics are shared with the HTTP client and the parsers
+        self._metrics: Metrics = self._url_parser.client.metrics
+        self._metrics_file: Optional[str] = metrics_file
+        self._metrics_port: Optional[int] = metrics_port
+
+    @staticmethod
+    def create_url_parser(concurrency: int = 1, timeout: float = HttpClient.DEFAULT_TIMEOUT,
+                          parser_backend: str = URLParser.DEFAULT_BACKEND,
+                          targeted_parse: bool = False, parse_workers: int = 0,
+                          request_rate: float = RateLimiter.DEFAULT_RATE,
+                          max_request_rate: float = RateLimiter.DEFAULT_MAX_RATE,
+                          cache_file: Optional[str] = None) -> URLParser:
+        """ URLParser with a pooled and rate limited HTTP client for concurrency threads """
+        return URLParser(
+            HttpClient(
+                pool_size=concurrency,
+                timeout=timeout,
+                cache=HttpCache(cache_file) if cache_file is not None else None,
+                rate_limiter=RateLimiter(rate=request_rate, max_rate=max_request_rate)
+            ),
+            backend=parser_backend,
+            targeted=targeted_parse,
+            workers=parse_workers
+        )
 
     def process_input(self):
-        """ Read the product information from the file """
+        """
+        Read the product information from the file and reprice them. The lines are grouped by
+        ASIN so that every ASIN is downloaded once whatever the number of conditions. Up to
+        concurrency ASINs are processed in parallel and the results are written in the input
+        order. ASINs completed by an interrupted run are read from the journal and the output
+        file is written again from the first line. The lines of a failed ASIN are skipped and
+        their results are written at the end of the output file if a retry succeeds.
+        In streaming mode the lines are grouped by ASIN within chunks of STREAM_CHUNK_SIZE lines
+        and every stage, from reading the input to writing the output, holds a bounded number
+        of lines.
+        """
+        if self._product_store is not None and not self._streaming:
+            self._preload_products()
+        if self._streaming:
+            self._unprofitable_file = open(self._get_unprofitable_file(self._input_file), mode="w")
+            self._unprofitable_count = 0
+
+        completed: Dict[str, JournalEntry] = self._journal.load() if self._resume else {}
+        if not self._resume:
+            self._journal.remove()
+        elif completed:
+            print(f"Resuming: {len(completed)} ASINs completed by the previous run")
+
         output_file = self._get_output_file(self._input_file)
+        window_size = self._concurrency * Amazon.WINDOW_FACTOR
+        # Results waiting for the results of the previous lines to be written
+        pending: Dict[int, Optional[Tuple[Product, float, float]]] = {}
+        next_line = 0
         with open(output_file, mode="w") as output_file:
-            with open(self._input_file, mode="r") as infile:
-                for line in infile:
-                    line = line.strip()
-                    line_values = line.split()
-                    asin: str = line_values[0]
-                    condition: int = int(line_values[1])
-
-                    print(f"Processing ASIN: {asin}")
-
-                    product_url = Amazon.PRODUCT_URL.format(asin)
-                    product_listing_url = Amazon.LISTING_URL.format(asin)
-
-                    print(f"Parsing product")
-                    product: Product = ProductParser(product_url).parse()
-                    product_listing_parser: ProductListingParser = \
-                        ProductListingParser(product_listing_url)
-                    print(f"Parsing product listings")
-                    product_listings: List[ProductListing] = product_listing_parser.parse()
-
-                    print(f"Repricing")
-                    repricer: Repricer = Repricer(product, product_listings)
-                    my_product_listing: ProductListing = product_listing_parser.my_listing
-                    repricer.rating_filter = self._target_rating
-                    repricer.condition_filter = Condition(condition)
-
-                    price = repricer.reprice(my_product_listing)
-                    profit = repricer.calculate_profit(price, my_product_listing.shipping)
-
-                    print(f"Mew Price: {price:.2f}")
-                    print(f"Profit: {profit:.2f}")
-
-                    # Output to file
-                    if profit > self._min_profit:
-                        output_file.write(f"{product}\n")
-                        output_file.write(f"{price:.2f}\n\n")
+            with ThreadPoolExecutor(max_workers=self._concurrency) as executor:
+                in_flight: Deque[Tuple[str, List[Tuple[int, int]], Future]] = deque()
+                groups = self._iter_groups() if self._streaming else self._group_input().items()
+                for asin, lines in groups:
+                    conditions = [condition for _, condition in lines]
+                    entry: Optional[JournalEntry] = completed.get(asin)
+                    if entry is not None and \
+                            all(Condition(condition) in entry[1] for condition in conditions):
+                        future = Future()
+                        future.set_result(entry)
                     else:
-                        self._unprofitable.append(str(product))
+                        completed.pop(asin, None)
+                        future = executor.submit(self._process_asin, asin, conditions)
+                    in_flight.append((asin, lines, future))
+                    if len(in_flight) < window_size:
+                        continue
+                    next_line = self._write_group(output_file, *in_flight.popleft(), pending,
+                                                  next_line, completed)
+
+                while in_flight:
+                    next_line = self._write_group(output_file, *in_flight.popleft(), pending,
+                                                  next_line, completed)
+
+                self._process_retries(output_file, executor)
+
+        if self._unprofitable_file is not None:
+            self._unprofitable_file.close()
+
+        # The journal is only needed to resume an interrupted run or to retry the failed ASINs
+        if self._keep_journal or self._retry_queue.failed:
+            self._journal.close()
+        else:
+            self._journal.remove()
+
+    def _group_input(self) -> Dict[str, List[Tuple[int, int]]]:
+        """ Return the (line index, condition) of every ASIN in the order of first appearance """
+        groups: Dict[str, List[Tuple[int, int]]] = {}
+        for index, (asin, condition) in enumerate(self._read_input()):
+            groups.setdefault(asin, []).append((index, condition))
+        return groups
+
+    def _iter_groups(self) -> Iterator[Tuple[str, List[Tuple[int, int]]]]:
+        """
+        Yield the (line index, condition) of every ASIN, grouping the lines of an ASIN within
+        chunks of STREAM_CHUNK_SIZE lines. An ASIN repeated in different chunks is processed
+        once per chunk.
+        """
+        chunk: Dict[str, List[Tuple[int, int]]] = {}
+        for index, (asin, condition) in enumerate(self._read_input()):
+            chunk.setdefault(asin, []).append((index, condition))
+            if (index + 1) % Amazon.STREAM_CHUNK_SIZE == 0:
+                yield from chunk.items()
+                chunk = {}
+        yield from chunk.items()
+
+    def _write_group(self, output_file: TextIO, asin: str, lines: List[Tuple[int, int]],
+                     future: Future, pending: Dict[int, Optional[Tuple[Product, float, float]]],
+                     next_line: int, completed: Dict[str, JournalEntry]) -> int:
+        """
+        Wait for the results of an ASIN, journal them and write all the results available in
+        the input order. A failed ASIN is queued for a retry and its lines are skipped.
+        Returns the index of the next line to write.
+        """
+        try:
+            rows = self._get_rows(asin, lines, future, journal=asin not in completed)
+        except Exception as error:
+            self._on_failure(asin, lines, error, attempts=1)
+            rows = [(index, None) for index, _ in lines]
+        pending.update(rows)
+        while next_line in pending:
+            result = pending.pop(next_line)
+            if result is not None:
+                self._write_result(output_file, *result)
+            next_line += 1
+        return next_line
+
+    def _get_rows(self, asin: str, lines: List[Tuple[int, int]], future: Future,
+                  journal: bool = True) -> List[Tuple[int, Tuple[Product, float, float]]]:
+        """ Wait for the results of an ASIN and return the (product, price, profit) per line """
+        product, results = future.result()
+        rows = [(index, (product, *results[Condition(condition)])) for index, condition in lines]
+        if journal:
+            self._journal.record(asin, (product, results))
+        self._metrics.increment("asins_total")
+        return rows
+
+    def _process_retries(self, output_file: TextIO, executor: ThreadPoolExecutor) -> None:
+        """
+        Retry the failed ASINs once their delay is over and write the results of the successful
+        retries. Stops when every failed ASIN has succeeded or failed permanently.
+        """
+        in_flight: Dict[Future, RetryItem] = {}
+        while self._retry_queue or in_flight:
+            for item in self._retry_queue.pop_ready():
+                print(f"Retrying ASIN: {item.asin} (attempt {item.attempts + 1})")
+                conditions = [condition for _, condition in item.lines]
+                in_flight[executor.submit(self._process_asin, item.asin, conditions)] = item
+            timeout: Optional[float] = self._retry_queue.next_delay()
+            if not in_flight:
+                time.sleep(timeout)
+                continue
+            done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = in_flight.pop(future)
+                try:
+                    rows = self._get_rows(item.asin, item.lines, future)
+                except Exception as error:
+                    self._on_failure(item.asin, item.lines, error, attempts=item.attempts + 1)
+                    continue
+                for _, result in rows:
+                    self._write_result(output_file, *result)
+
+    def _on_failure(self, asin: str, lines: List[Tuple[int, int]], error: Exception,
+                    attempts: int) -> None:
+        """ Queue the failed ASIN for a retry or report it as failed """
+        self._metrics.increment("asin_failures_total", error=type(error).__name__)
+        if self._retry_queue.push(asin, lines, error, attempts=attempts):
+            print(f"Failed ASIN: {asin} ({type(error).__name__}: {error}), retrying later")
+        else:
+            print(f"Failed ASIN: {asin} ({type(error).__name__}: {error}), giving up after "
+                  f"{attempts} attempts")
+
+    def _read_input(self) -> Iterator[Tuple[str, int]]:
+        """ Yield the ASIN and condition of every line of the input file """
+        with open(self._input_file, mode="r") as infile:
+            for line in infile:
+                line_values = line.strip().split()
+                if not line_values:
+                    continue
+                asin: str = line_values[0]
+                condition: int = int(line_values[1])
+                yield asin, condition
+
+    def _preload_products(self) -> None:
+        """ Load the stored products of all the input ASINs with a single query """
+        asins = {asin for asin, _ in self._read_input()} - self._refresh_asins
+        self._products = self._product_store.get_many(asins)
+        print(f"Loaded {len(self._products)} of {len(asins)} products from the product store")
+
+    def _get_product(self, asin: str) -> Product:
+        """ Return the stored product or parse the product page and store it """
+        product: Optional[Product] = self._products.get(asin)
+        if product is None and self._streaming and self._product_store is not None and \
+                asin not in self._refresh_asins:
+            product = self._product_store.get(asin)
+        if product is not None:
+            return product
+
+        print(f"Parsing product: {asin}")
+        product = ProductParser(Amazon.PRODUCT_URL.format(asin), self._url_parser).parse()
+        if self._product_store is not None:
+            self._product_store.put(asin, product)
+            if not self._streaming:
+                self._products[asin] = product
+        return product
+
+    def _process_asin(self, asin: str, conditions: List[int]) \
+            -> Tuple[Product, Dict[Condition, Tuple[float, float]]]:
+        """
+        Parse and reprice a single ASIN for all the requested conditions using one download of
+        its listings. Return the product and the new price and profit of every condition.
+        """
+        product, results, _ = self._reprice_asin(asin, conditions)
+        return product, results
+
+    def _reprice_asin(self, asin: str, conditions: List[int]) \
+            -> Tuple[Product, Dict[Condition, Tuple[float, float]], str]:
+        """
+        _process_asin also returning the fingerprint of the competitor offers of the pages read
+        to reprice the ASIN. With a fingerprint store, the prices of the last run are reused
+        when the same pages have the same fingerprint of all their offers.
+        """
+        print(f"Processing ASIN: {asin}")
+
+        product_listing_url = Amazon.LISTING_URL.format(asin)
 
-                    print(f"Completed!!!\n\n")
+        product: Product = self._get_product(asin)
+        product_listing_parser: ProductListingParser = ProductListingParser(
+            product_listing_url, self._url_parser, keep_listings=not self._streaming
+        )
+        pages: Iterable[Offers] = product_listing_parser.iter_pages()
+        record: Optional[FingerprintRecord] = \
+            self._fingerprint_store.get(asin) if self._fingerprint_store is not None else None
+        if record is not None and \
+                all(Condition(condition) in record.results for condition in conditions):
+            # Download the pages read by the last repricing and compare their fingerprint
+            previous_pages: List[Offers] = list(itertools.islice(pages, record.pages))
+            fingerprint = OfferFingerprint(self._get_fingerprint_salt(product), self._seller_name)
+            for offers in previous_pages:
+                fingerprint.update(offers)
+            if fingerprint.pages == record.pages and fingerprint.hexdigest(
+                    product_listing_parser.has_next_page) == record.fingerprint:
+                print(f"Offers unchanged, reusing the last prices: {asin}")
+                self._metrics.increment("unchanged_asins_total")
+                self._record_snapshot(asin, previous_pages,
+                                      complete=not product_listing_parser.has_next_page)
+                return product, record.results, fingerprint.competitor_hexdigest(
+                    product_listing_parser.has_next_page
+                )
+            pages = itertools.chain(previous_pages, pages)
+
+        print(f"Parsing product listings and repricing: {asin}")
+        # The listing pages are downloaded lazily while the repricer needs more listings. The
+        # parsed listings don't have their own shipping, so the default listing of the seller
+        # has the same seller and shipping as the seller listing found in the pages.
+        fingerprint = OfferFingerprint(self._get_fingerprint_salt(product), self._seller_name)
+        read_pages: List[Offers] = []
+        if self._snapshot_store is not None:
+            pages = self._keep_pages(pages, read_pages)
+        listings = IterTimer(product_listing_parser.iter_listings(fingerprint.track(pages)))
+        repricer: Repricer = Repricer(product, listings)
+        my_product_listing: ProductListing = ProductListing(seller=self._seller_name)
+        repricer.rating_filter = self._target_rating
+
+        start = time.perf_counter()
+        prices = repricer.reprice_conditions(conditions, my_product_listing)
+        # The time spent downloading and parsing the listing pages is in the other stages
+        self._metrics.observe("stage_seconds", time.perf_counter() - start - listings.elapsed,
+                              stage="reprice")
+        self._metrics.observe("listing_pages", product_listing_parser.pages_parsed,
+                              buckets=Metrics.PAGE_BUCKETS)
+        results = {
+            condition: (price, repricer.calculate_profit(price, my_product_listing.shipping))
+            for condition, price in prices.items()
+        }
+        self._record_snapshot(asin, read_pages, complete=not product_listing_parser.has_next_page)
+        if self._fingerprint_store is not None:
+            self._fingerprint_store.put(asin, FingerprintRecord(
+                fingerprint.hexdigest(product_listing_parser.has_next_page), fingerprint.pages,
+                results
+            ))
+        return product, results, fingerprint.competitor_hexdigest(
+            product_listing_parser.has_next_page
+        )
+
+    @staticmethod
+    def _keep_pages(pages: Iterable[Offers], kept: List[Offers]) -> Iterator[Offers]:
+        """ Yield the pages, keeping every page read """
+        for offers in pages:
+            kept.append(offers)
+            yield offers
+
+    def _record_snapshot(self, asin: str, pages: List[Offers], complete: bool) -> None:
+        """
+        Record all the offers of the pages read to reprice the ASIN in the snapshot store.
+        complete is False when the repricer stopped before the last page.
+        """
+        if self._snapshot_store is not None:
+            self._snapshot_store.record(
+                asin, [ProductListing(**offer) for offers in pages for offer in offers],
+                complete=complete
+            )
+
+    def _get_fingerprint_salt(self, product: Product) -> str:
+        """
+        Repricing settings changing the price given by the same offers and the shipping rate of
+        the product changing the profit of the same price
+        """
+        return f"{self._seller_name}|{self._target_rating}|{product.shipping_rate!r}"
+
+    def _write_result(self, output_file: TextIO, product: Product, price: float,
+                      profit: float) -> None:
+        """ Write a repriced product to the output file or mark it unprofitable """
+        print(f"ASIN: {product.asin}")
+        print(f"Mew Price: {price:.2f}")
+        print(f"Profit: {profit:.2f}")
+
+        # Output to file
+        with self._metrics.time("write"):
+            if profit > self._min_profit:
+                output_file.write(f"{product}\n")
+                output_file.write(f"{price:.2f}\n\n")
+            elif self._unprofitable_file is not None:
+                self._unprofitable_file.write(f"{product}\n")
+                self._unprofitable_count += 1
+            else:
+                self._unprofitable.append(str(product))
+
+        print(f"Completed!!!\n\n")
 
     def run(self):
         """ Entry function """
-        self.process_input()
+        if self._metrics_port is not None:
+            self._metrics.serve(self._metrics_port)
+            print(f"Serving metrics on http://127.0.0.1:{self._metrics_port}/metrics")
+        try:
+            self.process_input()
+        finally:
+            if self._product_store is not None:
+                self._product_store.close()
+            if self._fingerprint_store is not None:
+                self._fingerprint_store.close()
+            if self._snapshot_store is not None:
+                self._snapshot_store.close()
+            if self._metrics_file is not None:
+                self._metrics.write(self._metrics_file)
+            self._metrics.close()
+            self._url_parser.close()
 
         if self._unprofitable:
             print(f"These products did not meet the ${self._min_profit:.2f} minimum profit")
             for element in self._unprofitable:
                 print(element)
+        if self._unprofitable_count:
+            print(f"{self._unprofitable_count} products did not meet the "
+                  f"${self._min_profit:.2f} minimum profit, they are listed in "
+                  f"{self._get_unprofitable_file(self._input_file)}")
+
+        if self._retry_queue.failed:
+            print(f"These ASINs failed after {self._retry_queue.max_attempts} attempts")
+            for item in self._retry_queue.failed:
+                print(f"{item.asin}: {item.error}")
+
+        unchanged = int(self._metrics.counter("unchanged_asins_total"))
+        if self._fingerprint_store is not None:
+            print(f"Offers unchanged since the last run: {unchanged} ASINs reused their last "
+                  f"prices")
+
+        cache: Optional[HttpCache] = self._url_parser.client.cache
+        if cache is not None:
+            stats = cache.stats
+            print(f"HTTP cache: {stats['hits']} hits, {stats['revalidated']} revalidated, "
+                  f"{stats['misses']} misses, {stats['evictions']} evictions "
+                  f"({cache.hit_ratio:.0%} hit ratio)")
+
+        for host, metrics in self._url_parser.client.rate_limiter.metrics.items():
+            print(f"Rate limiter {host}: {metrics['requests']} requests, "
+                  f"{metrics['backoff_events']} backoffs, {metrics['rate']:.2f} requests/sec, "
+                  f"waited {metrics['waited']:.1f} sec")
+
+        print("Stage metrics")
+        print(self._metrics.summary())
+
+    # Class getters
+    @property
+    def metrics(self) -> Metrics:
+        return self._metrics
+
+    @staticmethod
+    def _get_journal_file(filename: str) -> str:
+        """ Return the journal file path from input file path """
+        name, _ = os.path.splitext(os.path.abspath(filename))
+        return f"{name}_journal.jsonl"
+
+    @staticmethod
+    def _get_unprofitable_file(filename: str) -> str:
+        """ Return the unprofitable products file path from input file path """
+        name, ext = os.path.splitext(os.path.abspath(filename))
+        return f"{name}_unprofitable{ext}"
 
     @staticmethod
     def _get_output_file(filename):
@@ -85,4 +506,3 @@ class Amazon:
         name, ext = os.path.splitext(os.path.abspath(filename))
         output_name = f"{name}_output"
         return f"{output_name}{ext}"
-
@@ -0,0 +1,261 @@
+"""
+File:           backtest.py
+Author:         Dibyaranjan Sathua
+Created on:     25/10/26, 3:10 PM
+
+Backtest of the repricing settings. Recorded offer snapshots, or captured offer listing pages,
+are replayed through the repricer for every configuration of a grid and the projected profit of
+every configuration is reported. The offers of all the cases are stored once in an OfferTable
+and every configuration is a single BatchRepricer call, so the grid is split between worker
+processes instead of the cases. NumPy is an optional dependency only needed by this module.
+"""
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import multiprocessing
+import sys
+
+import numpy as np
+
+from src.batch_repricer import BatchRepricer, OfferTable
+from src.condition import Condition
+from src.product import Product
+from src.product_listing import ProductListing
+from src.product_listing_parser import ProductListingParser
+from src.product_store import ProductStore
+from src.snapshot_store import Snapshot, SnapshotStore
+from src.url_parser import URLParser
+
+
+class RepricerConfig(NamedTuple):
+    """ Repricer parameters evaluated by the backtest """
+    rating_filter: int = 0
+    price_floor: float = 0.0
+    price_ceiling: float = sys.float_info.max
+    # Condition filter of every ASIN, the condition of the input line if None
+    condition_filter: Optional[int] = None
+
+    @classmethod
+    def grid(cls, rating_filter: Iterable[int] = (0, ), price_floor: Iterable[float] = (0.0, ),
+             price_ceiling: Iterable[float] = (sys.float_info.max, ),
+             condition_filter: Iterable[Optional[int]] = (None, )) -> List["RepricerConfig"]:
+        """ Every combination of the parameter values """
+        return [cls(*values) for values in itertools.product(
+            rating_filter, price_floor, price_ceiling, condition_filter
+        )]
+
+    def __str__(self):
+        ceiling = "none" if self.price_ceiling == sys.float_info.max \
+            else f"{self.price_ceiling:.2f}"
+        condition = "input" if self.condition_filter is None \
+            else Condition(self.condition_filter).name
+        return f"rating {self.rating_filter}, floor {self.price_floor:.2f}, " \
+               f"ceiling {ceiling}, condition {condition}"
+
+
+class BacktestResult(NamedTuple):
+    """ Projected results of a configuration over all the cases """
+    config: RepricerConfig
+    cases: int
+    listed: int                 # Cases above the minimum profit, which would be listed
+    total_profit: float         # Profit of the listed cases
+    mean_profit: float
+    mean_price: float
+    # Cases left out, their snapshot ran out of offers before the last listing page
+    truncated: int = 0
+
+
+class BacktestCases(NamedTuple):
+    """ Columnar cases of a backtest. A case is an ASIN, a condition and a snapshot. """
+    offers: OfferTable
+    condition: np.ndarray
+    shipping_rate: np.ndarray
+    # First case of every snapshot, the only one evaluated with a condition filter override
+    primary: np.ndarray
+    # Whether the snapshot of the case holds the whole offer listing
+    complete: np.ndarray
+
+
+def evaluate(cases: BacktestCases, config: RepricerConfig, min_profit: float,
+             seller_shipping: float) -> BacktestResult:
+    """
+    Reprice all the cases with the configuration and sum their projected profits. A case whose
+    snapshot stops before the last listing page is left out when the repricer runs out of its
+    offers, the next pages could give another price.
+    """
+    repricer = BatchRepricer(price_floor=config.price_floor, price_ceiling=config.price_ceiling,
+                             rating_filter=config.rating_filter)
+    if config.condition_filter is None:
+        condition, selected = cases.condition, slice(None)
+    else:
+        condition, selected = config.condition_filter, cases.primary
+    prices, fallback = repricer.reprice_with_fallback(cases.offers, condition_filter=condition,
+                                                      seller_shipping=seller_shipping)
+    truncated = fallback[selected] & ~cases.complete[selected]
+    prices = prices[selected][~truncated]
+    profits = BatchRepricer.calculate_profit(prices, seller_shipping,
+                                             cases.shipping_rate[selected][~truncated])
+    listed = profits > min_profit
+    count = int(listed.sum())
+    return BacktestResult(
+        config=config,
+        cases=len(prices),
+        listed=count,
+        total_profit=float(profits[listed].sum()),
+        mean_profit=float(profits[listed].mean()) if count else 0.0,
+        mean_price=float(prices[listed].mean()) if count else 0.0,
+        truncated=int(truncated.sum())
+    )
+
+
+# Cases of the worker process, sent once by the pool initializer instead of with every config
+_worker_cases: Optional[Tuple[BacktestCases, float, float]] = None
+
+
+def _init_worker(cases: BacktestCases, min_profit: float, seller_shipping: float) -> None:
+    global _worker_cases
+    _worker_cases = (cases, min_profit, seller_shipping)
+
+
+def _evaluate_in_worker(config: RepricerConfig) -> BacktestResult:
+    cases, min_profit, seller_shipping = _worker_cases
+    return evaluate(cases, config, min_profit, seller_shipping)
+
+
+def read_input(input_file: str) -> Dict[str, List[int]]:
+    """ Conditions of every ASIN of an input file in the order of first appearance """
+    conditions: Dict[str, List[int]] = {}
+    with open(input_file, mode="r") as infile:
+        for line in infile:
+            line_values = line.strip().split()
+            if line_values:
+                conditions.setdefault(line_values[0], []).append(int(line_values[1]))
+    return conditions
+
+
+class Backtest:
+    """ Replay offers through the repricer for a grid of configurations """
+
+    def __init__(self, seller_name: str, min_profit: float = 0.0,
+                 seller_shipping: float = ProductListing.DEFAULT_SHIPPING):
+        self._seller_name: str = seller_name
+        self._min_profit: float = min_profit
+        # Shipping of the seller listing, the same default listing as Amazon
+        self._seller_shipping: float = seller_shipping
+        self._offsets: array = array("q", [0])
+        self._price: array = array("d")
+        self._shipping: array = array("d")
+        self._rating: array = array("q")
+        self._total_ratings: array = array("q")
+        self._condition: array = array("q")
+        self._own: array = array("b")
+        self._case_condition: array = array("q")
+        self._shipping_rate: array = array("d")
+        self._primary: array = array("b")
+        self._complete: array = array("b")
+
+    def add_snapshot(self, snapshot: Snapshot, product: Product,
+                     conditions: Sequence[int]) -> None:
+        """ Add a case for every condition of the ASIN with the offers of the snapshot """
+        for index, condition in enumerate(conditions):
+            self._price.extend(snapshot.price)
+            self._shipping.extend(snapshot.shipping)
+            self._rating.extend(snapshot.rating)
+            self._total_ratings.extend(snapshot.total_ratings)
+            self._condition.extend(snapshot.condition)
+            self._own.extend(seller == self._seller_name for seller in snapshot.sellers)
+            self._offsets.append(len(self._price))
+            self._case_condition.append(condition)
+            self._shipping_rate.append(product.shipping_rate)
+            self._primary.append(index == 0)
+            self._complete.append(snapshot.complete)
+
+    def add_listings(self, asin: str, listings: Iterable[ProductListing], product: Product,
+                     conditions: Sequence[int]) -> None:
+        """ Add the cases of product listings sorted by total, e.g. from a test fixture """
+        self.add_snapshot(Snapshot.from_listings(asin, 0.0, listings), product, conditions)
+
+    def add_pages(self, asin: str, pages: Iterable[bytes], product: Product,
+                  conditions: Sequence[int],
+                  backend: str = URLParser.DEFAULT_BACKEND) -> None:
+        """ Add the cases of captured offer listing pages parsed by ProductListingParser """
+        listings: List[ProductListing] = []
+        for content in pages:
+            offers, _ = ProductListingParser.extract_page(
+                URLParser.build_soup(content, backend, targeted=False)
+            )
+            listings.extend(ProductListing(**offer) for offer in offers)
+        self.add_listings(asin, listings, product, conditions)
+
+    def add_store(self, snapshot_store: SnapshotStore, product_store: ProductStore,
+                  conditions: Dict[str, List[int]], start: Optional[float] = None,
+                  end: Optional[float] = None) -> List[str]:
+        """
+        Add the cases of every snapshot of the ASINs taken between start and end. Every
+        snapshot has the same weight. The cases of the incomplete snapshots are only evaluated
+        by the configurations finding a price in their offers. Return the ASINs skipped for lack
+        of a stored product or of snapshots.
+        """
+        products: Dict[str, Product] = product_store.get_many(conditions)
+        skipped: List[str] = []
+        for asin, asin_conditions in conditions.items():
+            snapshots = snapshot_store.query(asin, start, end) if asin in products else []
+            if not snapshots:
+                skipped.append(asin)
+            for snapshot in snapshots:
+                self.add_snapshot(snapshot, products[asin], asin_conditions)
+        return skipped
+
+    def cases(self) -> BacktestCases:
+        """ Columnar cases for evaluate """
+        return BacktestCases(
+            offers=OfferTable(
+                offsets=np.array(self._offsets, dtype=np.int64),
+                price=np.array(self._price, dtype=np.float64),
+                shipping=np.array(self._shipping, dtype=np.float64),
+                rating=np.array(self._rating, dtype=np.int64),
+                condition=np.array(self._condition, dtype=np.int64),
+                total_ratings=np.array(self._total_ratings, dtype=np.int64),
+                own=np.array(self._own, dtype=bool)
+            ),
+            condition=np.array(self._case_condition, dtype=np.int64),
+            shipping_rate=np.array(self._shipping_rate, dtype=np.float64),
+            primary=np.array(self._primary, dtype=bool),
+            complete=np.array(self._complete, dtype=bool)
+        )
+
+    def run(self, configs: Sequence[RepricerConfig], workers: int = 0) -> List[BacktestResult]:
+        """
+        Evaluate every configuration, in workers processes if workers > 0. Return the results
+        from the most to the least profitable.
+        """
+        cases = self.cases()
+        if workers > 0 and len(configs) > 1:
+            with ProcessPoolExecutor(
+                max_workers=min(workers, len(configs)),
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(cases, self._min_profit, self._seller_shipping)
+            ) as executor:
+                results = list(executor.map(_evaluate_in_worker, configs))
+        else:
+            results = [evaluate(cases, config, self._min_profit, self._seller_shipping)
+                       for config in configs]
+        return sorted(results, key=lambda result: result.total_profit, reverse=True)
+
+    @staticmethod
+    def report(results: Iterable[BacktestResult]) -> Iterator[str]:
+        """ Lines of a report of the results """
+        for rank, result in enumerate(results, start=1):
+            truncated = f", {result.truncated} truncated cases left out" if result.truncated \
+                else ""
+            yield f"{rank:3d}. {result.config}: projected profit ${result.total_profit:.2f} " \
+                  f"over {result.listed}/{result.cases} listed cases " \
+                  f"(mean profit ${result.mean_profit:.2f}, mean price ${result.mean_price:.2f}" \
+                  f"{truncated})"
+
+    # Class getters
+    @property
+    def case_count(self) -> int:
+        return len(self._case_condition)
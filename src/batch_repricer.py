@@ -0,0 +1,189 @@
+"""
+File:           batch_repricer.py
+Author:         Dibyaranjan Sathua
+Created on:     20/10/26, 10:20 AM
+
+Vectorized repricer for what-if runs over a whole catalog. The offers of all the ASINs are
+stored in columnar arrays with group offsets per ASIN and the new prices and profits of all the
+ASINs are computed at once with NumPy. The results are the same as Repricer. NumPy is an
+optional dependency only needed by this module.
+"""
+from typing import Optional, Sequence, Tuple, Union
+import sys
+
+import numpy as np
+
+from src.condition import Condition
+from src.product import Product
+from src.product_listing import ProductListing
+from src.repricer import Repricer
+
+ArrayLike = Union[float, int, Sequence, np.ndarray]
+
+
+class OfferTable:
+    """
+    Columnar offers of many ASINs. The offers of ASIN i are the rows offsets[i] to
+    offsets[i + 1], sorted by total like the listing pages.
+    """
+
+    def __init__(self, offsets: ArrayLike, price: ArrayLike, shipping: ArrayLike,
+                 rating: ArrayLike, condition: ArrayLike, total_ratings: ArrayLike,
+                 tax: Optional[ArrayLike] = None, own: Optional[ArrayLike] = None):
+        self.offsets: np.ndarray = np.asarray(offsets, dtype=np.int64)
+        self.price: np.ndarray = np.asarray(price, dtype=np.float64)
+        self.shipping: np.ndarray = np.asarray(shipping, dtype=np.float64)
+        self.rating: np.ndarray = np.asarray(rating, dtype=np.int64)
+        self.condition: np.ndarray = np.asarray(condition, dtype=np.int64)
+        self.total_ratings: np.ndarray = np.asarray(total_ratings, dtype=np.int64)
+        self.tax: np.ndarray = np.zeros_like(self.price) if tax is None \
+            else np.asarray(tax, dtype=np.float64)
+        # Offers of the seller being repriced, skipped like the seller listing in Repricer
+        self.own: np.ndarray = np.zeros(len(self.price), dtype=bool) if own is None \
+            else np.asarray(own, dtype=bool)
+        # Same operation order as ProductListing._get_total for identical floats
+        self.total: np.ndarray = self.price + self.shipping + self.tax
+
+    @classmethod
+    def from_listings(cls, groups: Sequence[Sequence[ProductListing]],
+                      seller_name: Optional[str] = None) -> "OfferTable":
+        """ Build the table from the product listings of every ASIN """
+        listings = [listing for group in groups for listing in group]
+        return cls(
+            offsets=np.cumsum([0] + [len(group) for group in groups]),
+            price=[listing.price for listing in listings],
+            shipping=[listing.shipping for listing in listings],
+            rating=[listing.rating for listing in listings],
+            condition=[listing.condition.value for listing in listings],
+            total_ratings=[listing.total_ratings for listing in listings],
+            tax=[listing.tax for listing in listings],
+            own=[seller_name is not None and listing.seller == seller_name
+                 for listing in listings]
+        )
+
+    @property
+    def groups(self) -> int:
+        return len(self.offsets) - 1
+
+
+class BatchRepricer:
+    """ Reprice all the ASINs of an OfferTable at once """
+
+    def __init__(self, price_floor: float = 0.0, price_ceiling: float = sys.float_info.max,
+                 rating_filter: int = 0):
+        self._price_floor: float = price_floor
+        self._price_ceiling: float = price_ceiling
+        self._rating_filter: int = rating_filter
+
+    def reprice(self, offers: OfferTable, condition_filter: ArrayLike = Condition.NONE,
+                seller_shipping: ArrayLike = ProductListing.DEFAULT_SHIPPING) -> np.ndarray:
+        """
+        Return the new price of every ASIN, same as Repricer.reprice. condition_filter and
+        seller_shipping are scalars or one value per ASIN.
+        """
+        return self.reprice_with_fallback(offers, condition_filter, seller_shipping)[0]
+
+    def reprice_with_fallback(self, offers: OfferTable,
+                              condition_filter: ArrayLike = Condition.NONE,
+                              seller_shipping: ArrayLike = ProductListing.DEFAULT_SHIPPING) \
+            -> Tuple[np.ndarray, np.ndarray]:
+        """
+        reprice also returning whether every ASIN ran out of offers, without a qualifying
+        offer or an offer above the ceiling, and got the fallback price. More offers could
+        give another price to these ASINs.
+        """
+        groups = offers.groups
+        starts = offers.offsets[:-1]
+        counts = np.diff(offers.offsets)
+        group = np.repeat(np.arange(groups), counts)
+        condition_filter = np.broadcast_to(np.asarray(condition_filter, dtype=np.int64), groups)
+        seller_shipping = np.broadcast_to(np.asarray(seller_shipping, dtype=np.float64), groups)
+        total = offers.total
+        rows = np.arange(len(total))
+
+        # Repricer stops at the first offer above the ceiling
+        above_ceiling = np.cumsum(total > self._price_ceiling)
+        above_before_group = np.concatenate(([0], above_ceiling))[starts]
+        scanned = above_ceiling == np.repeat(above_before_group, counts)
+        above_in_group = np.concatenate(([0], above_ceiling))[offers.offsets[1:]] > \
+            above_before_group
+        eligible = scanned & (total >= self._price_floor) & \
+            (offers.rating >= self._rating_filter) & ~offers.own
+
+        row_filter = condition_filter[group]
+        row_new_filter = row_filter == Condition.NEW
+        qualifies = np.where(row_new_filter, offers.condition == Condition.NEW,
+                             offers.condition >= row_filter - 1)
+        hit = eligible & qualifies
+        first_hit = self._group_reduce(np.minimum, np.where(hit, rows, len(rows)), starts, counts)
+        last_eligible = self._group_reduce(np.maximum, np.where(eligible, rows, -1), starts,
+                                           counts)
+
+        has_hit = (first_hit >= 0) & (first_hit < len(rows))
+        hit_total = total[np.where(has_hit, first_hit, 0)] if len(total) else np.zeros(groups)
+        lowest_total = total[np.where(counts > 0, starts, 0)] if len(total) else np.zeros(groups)
+        keep_total = (condition_filter == Condition.NEW) | \
+            (np.abs(hit_total - lowest_total) < Repricer.EPSILON)
+        hit_price = np.where(keep_total, hit_total - seller_shipping,
+                             hit_total - seller_shipping - 0.01)
+        fallback = np.where(last_eligible >= 0,
+                            total[np.maximum(last_eligible, 0)] if len(total) else 0.0,
+                            self._price_floor)
+        return np.where(has_hit, hit_price, fallback - seller_shipping), \
+            ~has_hit & ~above_in_group
+
+    @staticmethod
+    def _group_reduce(ufunc: np.ufunc, values: np.ndarray, starts: np.ndarray,
+                      counts: np.ndarray) -> np.ndarray:
+        """ Reduce the values of every group with ufunc. Groups without offers get -1. """
+        result = np.full(len(starts), -1, dtype=np.int64)
+        non_empty = counts > 0
+        if non_empty.any():
+            # The segment of a group ends at the start of the next non empty group
+            result[non_empty] = ufunc.reduceat(values, starts[non_empty])
+        return result
+
+    @staticmethod
+    def shipping_rate(weight: ArrayLike) -> np.ndarray:
+        """ Vectorized Product.calculate_shipping_rate """
+        weight = np.asarray(weight, dtype=np.float64)
+        lbs = np.ceil(weight)
+        pound_rate = Product.MEDIA_BASE + (lbs - 1) * Product.MEDIA_RATE + Product.AMAZON_FEE
+        oz = np.ceil(-weight).astype(np.int64)
+        first_class = np.asarray(Product.FIRST_CLASS + [Product.MEDIA_BASE])
+        ounce_rate = first_class[np.clip(oz, 1, len(Product.FIRST_CLASS) + 1) - 1] + \
+            Product.AMAZON_FEE
+        return np.where(weight >= 0, pound_rate, ounce_rate)
+
+    @staticmethod
+    def calculate_profit(price: ArrayLike, shipping: ArrayLike,
+                         shipping_rate: ArrayLike) -> np.ndarray:
+        """ Vectorized Repricer.calculate_profit with the shipping rate of every product """
+        price = np.asarray(price, dtype=np.float64)
+        return price + shipping - Repricer.VARIABLE_FEE_RATE * price - \
+            Repricer.VARIABLE_CLOSING_FEE - Repricer.PER_ITEM_FEE - shipping_rate
+
+    # Getters and setters methods
+    @property
+    def price_floor(self) -> float:
+        return self._price_floor
+
+    @price_floor.setter
+    def price_floor(self, value: float) -> None:
+        self._price_floor = value
+
+    @property
+    def price_ceiling(self) -> float:
+        return self._price_ceiling
+
+    @price_ceiling.setter
+    def price_ceiling(self, value: float) -> None:
+        self._price_ceiling = value
+
+    @property
+    def rating_filter(self) -> int:
+        return self._rating_filter
+
+    @rating_filter.setter
+    def rating_filter(self, value: int) -> None:
+        self._rating_filter = value
@@ -0,0 +1,144 @@
+"""
+File:           daemon.py
+Author:         Dibyaranjan Sathua
+Created on:     23/10/26, 5:20 PM
+
+Continuous repricing daemon. Instead of repricing every ASIN of the input at the same cadence,
+the ASINs are polled by a PollScheduler: the ASINs whose competing offers change often and the
+most profitable ones are polled more often. The output file always holds the latest prices.
+"""
+from typing import Any, Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor, Future, FIRST_COMPLETED, wait
+import os
+import threading
+import time
+
+from src.amazon import Amazon
+from src.condition import Condition
+from src.product import Product
+from src.scheduler import PollScheduler
+
+
+class RepricingDaemon(Amazon):
+    """ Amazon repricer polling the ASINs of the input file until stopped """
+    # Minimum seconds between two rewrites of the output file
+    FLUSH_INTERVAL: float = 30.0
+    # Maximum seconds between two checks of the stop flag
+    MAX_WAIT: float = 1.0
+
+    def __init__(self, seller_name: str, target_rating: float, min_profit: float, input_file: str,
+                 min_interval: float = PollScheduler.DEFAULT_MIN_INTERVAL,
+                 max_interval: float = PollScheduler.DEFAULT_MAX_INTERVAL, **amazon_options: Any):
+        # Listing pages must be downloaded again at every poll, so the daemon has no page cache
+        amazon_options.pop("cache_file", None)
+        super().__init__(seller_name, target_rating, min_profit, input_file, **amazon_options)
+        self._scheduler: PollScheduler = PollScheduler(min_interval=min_interval,
+                                                       max_interval=max_interval)
+        self._groups: Dict[str, List[Tuple[int, int]]] = {}
+        # Latest (product, price, profit) of every input line
+        self._latest: Dict[int, Tuple[Product, float, float]] = {}
+        self._stopped = threading.Event()
+        self._dirty: bool = False
+        self._flushed_at: float = 0.0
+
+    def run(self) -> None:
+        """ Poll the ASINs until stop is called, then write the latest prices """
+        if self._metrics_port is not None:
+            self._metrics.serve(self._metrics_port)
+        if self._product_store is not None:
+            self._preload_products()
+        self._groups = self._group_input()
+        # Spread the first polls over the minimum interval instead of a burst at start up
+        for index, asin in enumerate(self._groups):
+            self._scheduler.add(asin, delay=self._scheduler.min_interval * index /
+                                len(self._groups))
+        print(f"Repricing daemon started with {len(self._groups)} ASINs")
+
+        in_flight: Dict[Future, str] = {}
+        with ThreadPoolExecutor(max_workers=self._concurrency) as executor:
+            while not self._stopped.is_set():
+                for asin in self._scheduler.pop_due(limit=self._concurrency - len(in_flight)):
+                    conditions = [condition for _, condition in self._groups[asin]]
+                    in_flight[executor.submit(self._reprice_asin, asin, conditions)] = asin
+
+                timeout = RepricingDaemon.MAX_WAIT
+                next_delay: Optional[float] = self._scheduler.next_delay()
+                if next_delay is not None and len(in_flight) < self._concurrency:
+                    timeout = min(timeout, next_delay)
+                if in_flight:
+                    done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self._on_polled(in_flight.pop(future), future)
+                else:
+                    self._stopped.wait(timeout)
+                self._flush()
+
+            # Finish the polls in progress before the last flush
+            for future in wait(in_flight).done:
+                self._on_polled(in_flight.pop(future), future)
+        self._flush(force=True)
+        if self._product_store is not None:
+            self._product_store.close()
+        if self._fingerprint_store is not None:
+            self._fingerprint_store.close()
+        if self._snapshot_store is not None:
+            self._snapshot_store.close()
+        if self._metrics_file is not None:
+            self._metrics.write(self._metrics_file)
+        self._metrics.close()
+        self._url_parser.close()
+        print("Repricing daemon stopped")
+
+    def stop(self) -> None:
+        """ Ask the daemon to stop, e.g. from a signal handler """
+        self._stopped.set()
+
+    def _on_polled(self, asin: str, future: Future) -> None:
+        """ Record the new prices of a polled ASIN and schedule its next poll """
+        try:
+            product, results, fingerprint = future.result()
+            rows = [(index, (product, *results[Condition(condition)]))
+                    for index, condition in self._groups[asin]]
+        except Exception as error:
+            self._metrics.increment("asin_failures_total", error=type(error).__name__)
+            delay = self._scheduler.record_failure(asin)
+            print(f"Failed ASIN: {asin} ({type(error).__name__}: {error}), retrying in "
+                  f"{delay:.0f} sec")
+            return
+
+        self._metrics.increment("asins_total")
+        changed = self._scheduler.record(asin, fingerprint,
+                                         max(profit for _, (_, _, profit) in rows))
+        for index, result in rows:
+            previous = self._latest.get(index)
+            if previous is None or previous[1] != result[1]:
+                print(f"ASIN: {asin} New Price: {result[1]:.2f} Profit: {result[2]:.2f}")
+                self._dirty = True
+            self._latest[index] = result
+        state = self._scheduler.states[asin]
+        print(f"Next poll of {asin} in {state.interval:.0f} sec "
+              f"({'offers changed, ' if changed else ''}change rate {state.change_rate:.2f})")
+
+    def _flush(self, force: bool = False) -> None:
+        """ Atomically rewrite the output file with the latest prices, at most every interval """
+        now = time.monotonic()
+        if not self._dirty:
+            return
+        if not force and now - self._flushed_at < RepricingDaemon.FLUSH_INTERVAL:
+            return
+        output_file = self._get_output_file(self._input_file)
+        temp_file = f"{output_file}.tmp"
+        with open(temp_file, mode="w") as output:
+            for index in sorted(self._latest):
+                product, price, profit = self._latest[index]
+                if profit > self._min_profit:
+                    output.write(f"{product}\n")
+                    output.write(f"{price:.2f}\n\n")
+        os.replace(temp_file, output_file)
+        self._dirty = False
+        self._flushed_at = now
+
+    # Class getters
+    @property
+    def scheduler(self) -> PollScheduler:
+        return self._scheduler
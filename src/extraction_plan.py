@@ -0,0 +1,55 @@
+"""
+File:           extraction_plan.py
+Author:         Dibyaranjan Sathua
+Created on:     19/10/26, 10:15 AM
+
+Declarative extraction of the fields of a repeated HTML element like an offer row. The columns
+used by the fields are located with a single traversal of the element and every field is
+extracted from its column.
+"""
+from typing import Any, Callable, Dict, NamedTuple, Optional, Sequence
+
+from bs4.element import Tag
+
+
+class Field(NamedTuple):
+    """ Field extracted from a column of the element """
+    name: str
+    column: str                                     # Class of the column
+    extract: Callable[[Optional[Tag]], Any]         # Called with None if the column is missing
+
+
+class ExtractionPlan:
+    """ Extract the fields of an element by visiting its descendants once """
+
+    def __init__(self, column_tag: str, fields: Sequence[Field]):
+        self._column_tag: str = column_tag
+        self._fields: Sequence[Field] = fields
+        self._columns: frozenset = frozenset(field.column for field in fields)
+
+    def extract(self, element: Tag) -> Dict[str, Any]:
+        """ Return the field values of the element """
+        columns = self.find_columns(element)
+        return {field.name: field.extract(columns.get(field.column)) for field in self._fields}
+
+    def find_columns(self, element: Tag) -> Dict[str, Tag]:
+        """
+        Return the first descendant of the element with every column class, like
+        element.find(column_tag, attrs={"class": column}), in a single traversal.
+        """
+        columns: Dict[str, Tag] = {}
+        remaining = len(self._columns)
+        for descendant in element.descendants:
+            if not isinstance(descendant, Tag) or descendant.name != self._column_tag:
+                continue
+            for class_name in descendant.get("class") or ():
+                if class_name in self._columns and class_name not in columns:
+                    columns[class_name] = descendant
+                    remaining -= 1
+            if remaining == 0:
+                break
+        return columns
+
+    @property
+    def fields(self) -> Sequence[Field]:
+        return self._fields
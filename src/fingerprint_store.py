@@ -0,0 +1,146 @@
+"""
+File:           fingerprint_store.py
+Author:         Dibyaranjan Sathua
+Created on:     24/10/26, 10:20 AM
+
+Fingerprints of the offer listing pages read to reprice an ASIN, stored between runs with the
+resulting prices. When the same pages give the same fingerprint on the next run, the offers
+can't give another price, so building the listings and repricing are skipped.
+"""
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from src.condition import Condition
+
+# Offer fields of a listing page as returned by ProductListingParser.extract_page
+Offers = List[Dict[str, Any]]
+
+
+class OfferFingerprint:
+    """
+    Running SHA-1 of the offers of the pages tracked in order. A second SHA-1 leaves out the
+    offers of own_seller, so that changing our own price doesn't change it, e.g. to tell the
+    competitor changes apart. Our own offers can change the price, the first offer sets the
+    lowest total, so only the fingerprint of all the offers tells the same price.
+    """
+
+    def __init__(self, salt: str = "", own_seller: Optional[str] = None):
+        # The salt holds the repricing settings, a different seller or rating filter can give
+        # another price from the same offers
+        self._hash = hashlib.sha1(salt.encode())
+        self._competitor_hash = hashlib.sha1(salt.encode())
+        self._own_seller: Optional[str] = own_seller
+        self._pages: int = 0
+
+    def update(self, offers: Offers) -> None:
+        """ Add the offers of the next page """
+        for offer in offers:
+            line = f"{offer['seller']}|{offer['price']!r}|{offer['rating']}|" \
+                   f"{offer['total_ratings']}|{offer['condition'].value}\n".encode()
+            self._hash.update(line)
+            if offer["seller"] != self._own_seller:
+                self._competitor_hash.update(line)
+        self._hash.update(b"\f")
+        self._competitor_hash.update(b"\f")
+        self._pages += 1
+
+    def track(self, pages: Iterable[Offers]) -> Iterator[Offers]:
+        """ Yield the pages, adding every page to the fingerprint """
+        for offers in pages:
+            self.update(offers)
+            yield offers
+
+    def hexdigest(self, has_next_page: bool = False) -> str:
+        """
+        Fingerprint of all the offers of the pages tracked so far. has_next_page tells whether
+        the last page links to a next page, new offers on a page after the last one read can
+        change the price when the last repricing ran out of offers.
+        """
+        return self._finish(self._hash, has_next_page)
+
+    def competitor_hexdigest(self, has_next_page: bool = False) -> str:
+        """ hexdigest of the offers of the other sellers """
+        return self._finish(self._competitor_hash, has_next_page)
+
+    @staticmethod
+    def _finish(offers_hash: Any, has_next_page: bool) -> str:
+        fingerprint = offers_hash.copy()
+        fingerprint.update(b"+" if has_next_page else b".")
+        return fingerprint.hexdigest()
+
+    @property
+    def pages(self) -> int:
+        return self._pages
+
+
+class FingerprintRecord(NamedTuple):
+    """ Fingerprint of the pages read by the last repricing and its result """
+    fingerprint: str
+    pages: int
+    results: Dict[Condition, Tuple[float, float]]       # (price, profit) of every condition
+
+
+class FingerprintStore:
+    """ SQLite backed store of the last offer fingerprint of every ASIN """
+
+    def __init__(self, path: str):
+        self._path: str = os.path.abspath(path)
+        self._lock = threading.Lock()
+        # Several processes, e.g. the shards of a batch, can share the database. Readers don't
+        # block the writer in WAL mode and a writer waits for the others up to the timeout.
+        self._connection = sqlite3.connect(self._path, timeout=60.0, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS fingerprints (
+                asin TEXT PRIMARY KEY,
+                fingerprint TEXT NOT NULL,
+                pages INTEGER NOT NULL,
+                results TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+
+    def get(self, asin: str) -> Optional[FingerprintRecord]:
+        """ Return the last fingerprint of the ASIN """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT fingerprint, pages, results FROM fingerprints WHERE asin = ?", (asin, )
+            ).fetchone()
+        if row is None:
+            return None
+        results = {Condition(int(condition)): (price, profit)
+                   for condition, (price, profit) in json.loads(row[2]).items()}
+        return FingerprintRecord(row[0], row[1], results)
+
+    def put(self, asin: str, record: FingerprintRecord) -> None:
+        """ Insert or replace the fingerprint of the ASIN """
+        results = {str(condition.value): [price, profit]
+                   for condition, (price, profit) in record.results.items()}
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO fingerprints "
+                "(asin, fingerprint, pages, results, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (asin, record.fingerprint, record.pages, json.dumps(results), time.time())
+            )
+
+    def remove(self, asin: str) -> None:
+        """ Remove the ASIN so that it is repriced on the next run """
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM fingerprints WHERE asin = ?", (asin, ))
+
+    def close(self) -> None:
+        """ Close the store database """
+        with self._lock:
+            self._connection.close()
+
+    # Class getters
+    @property
+    def path(self) -> str:
+        return self._path
@@ -0,0 +1,170 @@
+"""
+File:           http_cache.py
+Author:         Dibyaranjan Sathua
+Created on:     18/10/26, 11:20 AM
+
+Persistent on-disk cache of HTTP responses keyed by URL. Every URL class has its own time to
+live, stale entries are revalidated using ETag / Last-Modified and the least recently used
+entries are evicted when the cache grows above its size limit.
+"""
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import os
+import sqlite3
+import threading
+import time
+
+
+class CacheEntry(NamedTuple):
+    """ Cached HTTP response """
+    content: bytes
+    etag: Optional[str]
+    last_modified: Optional[str]
+    fetched_at: float
+
+
+class HttpCache:
+    """ SQLite backed HTTP response cache """
+    # (URL substring, time to live in seconds). The first matching URL class is used.
+    DEFAULT_TTLS: List[Tuple[str, float]] = [
+        ("/gp/product/", 30 * 24 * 3600.0),
+        ("/gp/offer-listing/", 15 * 60.0),
+    ]
+    DEFAULT_TTL: float = 3600.0
+    DEFAULT_MAX_SIZE: int = 512 * 1024 * 1024       # Bytes
+
+    def __init__(self, path: str, ttls: Optional[List[Tuple[str, float]]] = None,
+                 default_ttl: float = DEFAULT_TTL, max_size: int = DEFAULT_MAX_SIZE):
+        self._path: str = os.path.abspath(path)
+        self._ttls: List[Tuple[str, float]] = ttls if ttls is not None else HttpCache.DEFAULT_TTLS
+        self._default_ttl: float = default_ttl
+        self._max_size: int = max_size
+        self._lock = threading.Lock()
+        self._stats: Dict[str, int] = {"hits": 0, "misses": 0, "revalidated": 0, "evictions": 0}
+        # Several processes, e.g. the shards of a batch, can share the database. Readers don't
+        # block the writer in WAL mode and a writer waits for the others up to the timeout.
+        self._connection = sqlite3.connect(self._path, timeout=60.0, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                url TEXT PRIMARY KEY,
+                content BLOB NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                size INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at);
+            """
+        )
+        self._size: int = self._connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()[0]
+
+    def ttl(self, url: str) -> float:
+        """ Return the time to live of the URL class """
+        for pattern, ttl in self._ttls:
+            if pattern in url:
+                return ttl
+        return self._default_ttl
+
+    def get(self, url: str) -> Optional[CacheEntry]:
+        """ Return the cached response of the URL, fresh or stale """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT content, etag, last_modified, fetched_at FROM responses WHERE url = ?",
+                (url, )
+            ).fetchone()
+            if row is None:
+                return None
+            with self._connection:
+                self._connection.execute(
+                    "UPDATE responses SET accessed_at = ? WHERE url = ?", (time.time(), url)
+                )
+        return CacheEntry(*row)
+
+    def is_fresh(self, url: str, entry: CacheEntry) -> bool:
+        """ Check if the cached response is within the time to live of its URL class """
+        return time.time() - entry.fetched_at < self.ttl(url)
+
+    def put(self, url: str, content: bytes, etag: Optional[str] = None,
+            last_modified: Optional[str] = None) -> None:
+        """ Store the response and evict the least recently used entries above the size limit """
+        now = time.time()
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                "SELECT size FROM responses WHERE url = ?", (url, )
+            ).fetchone()
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses "
+                "(url, content, etag, last_modified, fetched_at, accessed_at, size) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (url, content, etag, last_modified, now, now, len(content))
+            )
+            self._size += len(content) - (row[0] if row is not None else 0)
+            self._evict()
+
+    def refresh(self, url: str) -> None:
+        """ Mark the cached response as fresh after a successful revalidation """
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "UPDATE responses SET fetched_at = ?, accessed_at = ? WHERE url = ?",
+                (now, now, url)
+            )
+
+    def invalidate(self, url: str) -> None:
+        """ Remove the URL from the cache """
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                "SELECT size FROM responses WHERE url = ?", (url, )
+            ).fetchone()
+            if row is not None:
+                self._connection.execute("DELETE FROM responses WHERE url = ?", (url, ))
+                self._size -= row[0]
+
+    def record(self, stat: str) -> None:
+        """ Increment a hit / miss statistic """
+        with self._lock:
+            self._stats[stat] += 1
+
+    def _evict(self) -> None:
+        """ Delete the least recently used entries until the cache fits in max_size """
+        while self._size > self._max_size:
+            rows = self._connection.execute(
+                "SELECT url, size FROM responses ORDER BY accessed_at LIMIT 100"
+            ).fetchall()
+            if not rows:
+                break
+            for url, size in rows:
+                self._connection.execute("DELETE FROM responses WHERE url = ?", (url, ))
+                self._size -= size
+                self._stats["evictions"] += 1
+                if self._size <= self._max_size:
+                    break
+
+    def close(self) -> None:
+        """ Close the cache database """
+        with self._lock:
+            self._connection.close()
+
+    # Class getters
+    @property
+    def path(self) -> str:
+        return self._path
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
+
+    @property
+    def hit_ratio(self) -> float:
+        stats = self.stats
+        requests = stats["hits"] + stats["revalidated"] + stats["misses"]
+        return (stats["hits"] + stats["revalidated"]) / requests if requests else 0.0
@@ -0,0 +1,210 @@
+"""
+File:           http_client.py
+Author:         Dibyaranjan Sathua
+Created on:     18/10/26, 10:05 AM
+
+Shared HTTP client used by all the parsers of a run. It keeps a bounded pool of keep-alive
+connections, applies a timeout to every request and retries failed requests. Responses are
+optionally served from and stored in an HttpCache. Every request goes through an adaptive
+RateLimiter which slows down when the host throttles us. Concurrent requests of the same URL
+are coalesced into a single request. Fetch latency, bytes, status codes and cache results are
+recorded in the Metrics of the run.
+"""
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit
+import random
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from src.http_cache import HttpCache, CacheEntry
+from src.metrics import Metrics
+from src.rate_limiter import RateLimiter
+from src.single_flight import SingleFlight
+
+
+class RobotCheckError(requests.HTTPError):
+    """ Raised when the host keeps returning a robot check page instead of the requested page """
+
+
+class HttpClient:
+    """ Thread safe HTTP client with connection pooling, timeouts and retries """
+    DEFAULT_HEADER: Dict[str, str] = {
+        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.9",
+        "Accept-Encoding": "gzip, deflate, br",
+        "Accept-Language": "en-IN,en;q=0.9,hi-IN;q=0.8,hi;q=0.7,en-GB;q=0.6,en-US;q=0.5",
+        "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/85.0.4183.83 Safari/537.36"
+    }
+    DEFAULT_POOL_SIZE: int = 10
+    DEFAULT_TIMEOUT: float = 10.0
+    DEFAULT_MAX_RETRIES: int = 3
+    DEFAULT_BACKOFF: float = 0.5
+    MAX_BACKOFF: float = 30.0
+    # Status codes and page markers returned by Amazon when it throttles the requests
+    THROTTLE_STATUS: Tuple[int, ...] = (429, 503)
+    ROBOT_CHECK_MARKERS: Tuple[bytes, ...] = (
+        b"/errors/validateCaptcha",
+        b"Type the characters you see in this image",
+        b"api-services-support@amazon.com",
+    )
+
+    def __init__(self, pool_size: int = DEFAULT_POOL_SIZE, timeout: float = DEFAULT_TIMEOUT,
+                 max_retries: int = DEFAULT_MAX_RETRIES, backoff: float = DEFAULT_BACKOFF,
+                 cache: Optional[HttpCache] = None, rate_limiter: Optional[RateLimiter] = None,
+                 metrics: Optional[Metrics] = None):
+        self._timeout: float = timeout
+        self._max_retries: int = max_retries
+        self._backoff: float = backoff
+        self._cache: Optional[HttpCache] = cache
+        self._rate_limiter: RateLimiter = rate_limiter if rate_limiter is not None else RateLimiter()
+        self._single_flight: SingleFlight = SingleFlight()
+        self._metrics: Metrics = metrics if metrics is not None else Metrics()
+        self._session: requests.Session = requests.Session()
+        # Block instead of opening extra connections when all the pooled connections are in use
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, pool_block=True)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
+    def get(self, url: str, query_parameters: Optional[Dict[str, str]] = None,
+            headers: Optional[Dict[str, str]] = None) -> bytes:
+        """
+        Send a get request and return the response body. A request of a URL already being
+        downloaded waits for and shares the response of the in flight request.
+        Args:
+            url: String
+            query_parameters: dict, optional
+            headers: dict, optional
+
+        Returns: Response content
+        """
+        key = (url, tuple(sorted(query_parameters.items())) if query_parameters else ())
+        return self._single_flight.do(key, lambda: self._get(url, query_parameters, headers))
+
+    def _get(self, url: str, query_parameters: Optional[Dict[str, str]],
+             headers: Optional[Dict[str, str]]) -> bytes:
+        """
+        Return the response body. Fresh cached responses are returned without a request and
+        stale ones are revalidated with a conditional request.
+        """
+        headers = dict(headers if headers is not None else HttpClient.DEFAULT_HEADER)
+        # Requests with query parameters are not cached as the cache is keyed by URL
+        if self._cache is None or query_parameters:
+            return self._request(url, query_parameters, headers).content
+
+        entry: Optional[CacheEntry] = self._cache.get(url)
+        if entry is not None:
+            if self._cache.is_fresh(url, entry):
+                self._record_cache("hits", "hit")
+                return entry.content
+            if entry.etag is not None:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified is not None:
+                headers["If-Modified-Since"] = entry.last_modified
+
+        response = self._request(url, query_parameters, headers)
+        if response.status_code == 304 and entry is not None:
+            self._record_cache("revalidated", "revalidated")
+            self._cache.refresh(url)
+            return entry.content
+
+        self._record_cache("misses", "miss")
+        self._cache.put(url, response.content, etag=response.headers.get("ETag"),
+                        last_modified=response.headers.get("Last-Modified"))
+        return response.content
+
+    def _record_cache(self, stat: str, result: str) -> None:
+        self._cache.record(stat)
+        self._metrics.increment("cache_requests_total", result=result)
+
+    def _request(self, url: str, query_parameters: Optional[Dict[str, str]],
+                 headers: Dict[str, str]) -> requests.Response:
+        """
+        Send a rate limited get request. Throttled requests (429, 503 or a robot check page),
+        other 5XX responses, connection errors and timeouts are retried with a jittered
+        exponential backoff.
+        """
+        host = urlsplit(url).netloc
+        attempt = 0
+        while True:
+            self._rate_limiter.acquire(host)
+            try:
+                with self._metrics.time("fetch"):
+                    response = self._session.get(url, params=query_parameters, headers=headers,
+                                                 timeout=self._timeout)
+            except (requests.ConnectionError, requests.Timeout) as error:
+                self._metrics.increment("http_errors_total", error=type(error).__name__)
+                if attempt >= self._max_retries:
+                    raise
+            else:
+                self._metrics.increment("http_requests_total", status=str(response.status_code))
+                self._metrics.increment("http_bytes_total", len(response.content))
+                throttled = response.status_code in HttpClient.THROTTLE_STATUS or \
+                    self._is_robot_check(response)
+                if throttled:
+                    self._metrics.increment("http_throttled_total")
+                    self._rate_limiter.on_throttle(host)
+                else:
+                    self._rate_limiter.on_success(host)
+
+                if not throttled and response.status_code < 500:
+                    # Raise exception for a 4XX client error response
+                    response.raise_for_status()
+                    return response
+                if attempt >= self._max_retries:
+                    # Raise exception for a 5XX server error response
+                    response.raise_for_status()
+                    raise RobotCheckError(f"Robot check page returned for {url}",
+                                          response=response)
+            time.sleep(self._get_backoff(attempt))
+            attempt += 1
+
+    @staticmethod
+    def _is_robot_check(response: requests.Response) -> bool:
+        """ Check if the response is a robot check (captcha) page """
+        content = response.content
+        return response.status_code == 200 and \
+            any(marker in content for marker in HttpClient.ROBOT_CHECK_MARKERS)
+
+    def _get_backoff(self, attempt: int) -> float:
+        """ Full jitter backoff: a random delay up to the exponential backoff of the attempt """
+        return random.uniform(0, min(HttpClient.MAX_BACKOFF, self._backoff * 2 ** attempt))
+
+    def close(self) -> None:
+        """ Close all the pooled connections and the cache """
+        self._session.close()
+        if self._cache is not None:
+            self._cache.close()
+
+    # Class getters and setters
+    @property
+    def timeout(self) -> float:
+        return self._timeout
+
+    @timeout.setter
+    def timeout(self, value: float) -> None:
+        self._timeout = value
+
+    @property
+    def cache(self) -> Optional[HttpCache]:
+        return self._cache
+
+    @property
+    def single_flight(self) -> SingleFlight:
+        return self._single_flight
+
+    @property
+    def rate_limiter(self) -> RateLimiter:
+        return self._rate_limiter
+
+    @property
+    def metrics(self) -> Metrics:
+        return self._metrics
+
+    @property
+    def max_retries(self) -> int:
+        return self._max_retries
+
+    @max_retries.setter
+    def max_retries(self, value: int) -> None:
+        self._max_retries = value
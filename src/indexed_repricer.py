@@ -0,0 +1,196 @@
+"""
+File:           indexed_repricer.py
+Author:         Dibyaranjan Sathua
+Created on:     21/10/26, 10:10 AM
+
+Repricer keeping the offers in a sorted index for a continuous repricing loop. Offers can be
+added, removed or updated one at a time and the new price is found with bisect on the price
+floor and ceiling instead of rescanning all the offers.
+"""
+from typing import Dict, Iterable, List, Optional, Tuple
+import bisect
+import math
+
+from src.condition import Condition
+from src.product import Product
+from src.product_listing import ProductListing
+from src.repricer import Repricer
+
+# (total, rank, sequence number) of an offer. The sequence number makes the entries unique.
+Entry = Tuple[float, int, int]
+
+
+class IndexedRepricer(Repricer):
+    """
+    Repricer with the offers in sorted indexes: all the offers, the offers passing the rating
+    filter and one view of those per condition. reprice gives the same price as Repricer over
+    the sorted offers.
+    """
+
+    def __init__(self, product: Product, product_listings: Iterable[ProductListing] = ()):
+        super().__init__(product, [])
+        self._entries: List[Entry] = []
+        self._eligible: List[Entry] = []
+        self._views: Dict[int, List[Entry]] = {condition.value: [] for condition in Condition}
+        self._listings: Dict[int, ProductListing] = {}      # Sequence number to offer
+        self._sequences: Dict[int, int] = {}                # id of the offer to sequence number
+        self._next_sequence: int = 0
+        self._prices: Dict[Tuple, float] = {}               # Memoized prices, reset on change
+        for listing in product_listings:
+            self.add_listing(listing)
+
+    def add_listing(self, listing: ProductListing) -> None:
+        """ Add a competitor offer to the indexes """
+        sequence = self._next_sequence
+        self._next_sequence += 1
+        self._listings[sequence] = listing
+        self._sequences[id(listing)] = sequence
+        self._insert(self._entry(listing, sequence))
+
+    def remove_listing(self, listing: ProductListing) -> None:
+        """ Remove an offer previously added """
+        sequence = self._sequences.pop(id(listing))
+        del self._listings[sequence]
+        self._delete(self._entry(listing, sequence))
+
+    def update_listing(self, listing: ProductListing, price: Optional[float] = None,
+                       shipping: Optional[float] = None, rating: Optional[int] = None) -> None:
+        """ Change the price, shipping or rating of an offer previously added """
+        sequence = self._sequences[id(listing)]
+        self._delete(self._entry(listing, sequence))
+        if price is not None:
+            listing.price = price
+        if shipping is not None:
+            listing.shipping = shipping
+        if rating is not None:
+            listing.rating = rating
+        self._insert(self._entry(listing, sequence))
+
+    def reprice(self, seller: Optional[ProductListing] = None) -> float:
+        """ Reprice the seller price using the indexes """
+        if seller is None:
+            seller = ProductListing()
+
+        return self.reprice_conditions([self._condition_filter], seller)[self._condition_filter]
+
+    def reprice_conditions(self, conditions: Iterable[Condition],
+                           seller: Optional[ProductListing] = None) -> Dict[Condition, float]:
+        """ Reprice the seller price for every condition filter using the indexes """
+        if seller is None:
+            seller = ProductListing()
+
+        prices: Dict[Condition, float] = {}
+        for condition_filter in conditions:
+            condition_filter = Condition(condition_filter)
+            key = (seller.seller, seller.shipping, condition_filter, self._price_floor,
+                   self._price_ceiling)
+            price = self._prices.get(key)
+            if price is None:
+                price = self._prices[key] = self._find_price(seller, condition_filter)
+            prices[condition_filter] = price
+        return prices
+
+    def _find_price(self, seller: ProductListing, condition_filter: Condition) -> float:
+        """ First qualifying offer in the views of the condition filter, else the last eligible """
+        if condition_filter == Condition.NEW:
+            conditions = [Condition.NEW.value]
+        else:
+            conditions = [condition for condition in self._views
+                          if condition >= condition_filter.value - 1]
+
+        best: Optional[Entry] = None
+        for condition in conditions:
+            entry = self._first_entry(self._views[condition], seller.seller)
+            if entry is not None and (best is None or entry < best):
+                best = entry
+
+        if best is not None:
+            total = best[0]
+            if condition_filter == Condition.NEW or \
+                    abs(total - self._entries[0][0]) < Repricer.EPSILON:
+                return total - seller.shipping
+            return total - seller.shipping - 0.01
+
+        entry = self._last_entry(self._eligible, seller.seller)
+        reprice_value = entry[0] if entry is not None else self._price_floor
+        return reprice_value - seller.shipping
+
+    def _first_entry(self, view: List[Entry], seller_name: str) -> Optional[Entry]:
+        """ First entry of the view within the floor and ceiling not from the seller """
+        index = bisect.bisect_left(view, (self._price_floor, ))
+        while index < len(view) and self._listings[view[index][2]].seller == seller_name:
+            index += 1
+        if index < len(view) and view[index][0] <= self._price_ceiling:
+            return view[index]
+        return None
+
+    def _last_entry(self, view: List[Entry], seller_name: str) -> Optional[Entry]:
+        """ Last entry of the view within the floor and ceiling not from the seller """
+        low = bisect.bisect_left(view, (self._price_floor, ))
+        index = bisect.bisect_right(view, (self._price_ceiling, math.inf)) - 1
+        while index >= low and self._listings[view[index][2]].seller == seller_name:
+            index -= 1
+        return view[index] if index >= low else None
+
+    @staticmethod
+    def _entry(listing: ProductListing, sequence: int) -> Entry:
+        total, rank = listing.sort_key
+        return total, rank, sequence
+
+    def _insert(self, entry: Entry) -> None:
+        bisect.insort(self._entries, entry)
+        listing = self._listings[entry[2]]
+        if listing.rating >= self._rating_filter:
+            bisect.insort(self._eligible, entry)
+            bisect.insort(self._views[listing.condition.value], entry)
+        self._prices.clear()
+
+    def _delete(self, entry: Entry) -> None:
+        self._remove_entry(self._entries, entry)
+        # The offer is removed from the views it was inserted in, whatever it is now
+        self._remove_entry(self._eligible, entry)
+        for view in self._views.values():
+            if self._remove_entry(view, entry):
+                break
+        self._prices.clear()
+
+    @staticmethod
+    def _remove_entry(view: List[Entry], entry: Entry) -> bool:
+        index = bisect.bisect_left(view, entry)
+        if index < len(view) and view[index] == entry:
+            del view[index]
+            return True
+        return False
+
+    def _rebuild_views(self) -> None:
+        """ Rebuild the rating filtered views after a rating filter change """
+        self._eligible = []
+        self._views = {condition.value: [] for condition in Condition}
+        for entry in self._entries:
+            listing = self._listings[entry[2]]
+            if listing.rating >= self._rating_filter:
+                self._eligible.append(entry)
+                self._views[listing.condition.value].append(entry)
+        self._prices.clear()
+
+    # Getters and setters methods
+    @property
+    def product_listings(self) -> List[ProductListing]:
+        """ Offers sorted by total """
+        return [self._listings[entry[2]] for entry in self._entries]
+
+    @product_listings.setter
+    def product_listings(self, value: Iterable[ProductListing]) -> None:
+        for listing in self.product_listings:
+            self.remove_listing(listing)
+        for listing in value:
+            self.add_listing(listing)
+
+    @property
+    def rating_filter(self) -> int:
+        return self._rating_filter
+
+    @rating_filter.setter
+    def rating_filter(self, value: int) -> None:
+        self._rating_filter = value
+        self._rebuild_views()
@@ -0,0 +1,90 @@
+"""
+File:           journal.py
+Author:         Dibyaranjan Sathua
+Created on:     21/10/26, 2:30 PM
+
+Append-only journal of the ASINs completed by a run. Every completed ASIN is appended as one
+JSON line with its product and the price and profit of every requested condition, so an
+interrupted run can be resumed without downloading the completed ASINs again.
+"""
+from typing import Dict, Tuple
+import json
+import os
+
+from src.condition import Condition
+from src.product import Product
+
+# Product and the (price, profit) of every condition of a completed ASIN
+JournalEntry = Tuple[Product, Dict[Condition, Tuple[float, float]]]
+
+
+class Journal:
+    """ JSON lines journal of the completed ASINs """
+
+    def __init__(self, path: str):
+        self._path: str = os.path.abspath(path)
+        self._file = None
+
+    def load(self) -> Dict[str, JournalEntry]:
+        """
+        Return the completed ASINs of the previous runs. A line cut by a crash is dropped from
+        the journal so that the new entries are appended after the last complete line.
+        """
+        entries: Dict[str, JournalEntry] = {}
+        if not os.path.exists(self._path):
+            return entries
+        valid_size = 0
+        with open(self._path, mode="rb") as journal_file:
+            for line in journal_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if not line.endswith(b"\n"):
+                    break
+                product = Product(name=record["name"], asin=record["product_asin"],
+                                  weight=record["weight"])
+                entries[record["asin"]] = (product, {
+                    Condition(int(condition)): (price, profit)
+                    for condition, (price, profit) in record["results"].items()
+                })
+                valid_size += len(line)
+        if valid_size != os.path.getsize(self._path):
+            os.truncate(self._path, valid_size)
+        return entries
+
+    def record(self, asin: str, entry: JournalEntry) -> None:
+        """ Append a completed ASIN and flush it to the disk """
+        if self._file is None:
+            self._file = open(self._path, mode="a")
+        product, results = entry
+        record = {
+            "asin": asin,
+            "name": product.name,
+            "product_asin": product.asin,
+            "weight": product.weight,
+            "results": {
+                str(condition.value): [price, profit]
+                for condition, (price, profit) in results.items()
+            },
+        }
+        self._file.write(f"{json.dumps(record)}\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        """ Close the journal file """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def remove(self) -> None:
+        """ Close and delete the journal once the run is complete """
+        self.close()
+        if os.path.exists(self._path):
+            os.remove(self._path)
+
+    # Class getters
+    @property
+    def path(self) -> str:
+        return self._path
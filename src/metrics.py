@@ -0,0 +1,213 @@
+"""
+File:           metrics.py
+Author:         Dibyaranjan Sathua
+Created on:     22/10/26, 10:30 AM
+
+Run metrics: latency histograms of the stages (fetch, parse, extract, reprice, write), HTTP
+bytes and status codes, cache results, listing pages per ASIN and errors. The metrics are
+exported in the Prometheus text format to a file or a local /metrics endpoint.
+"""
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, TypeVar
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import threading
+import time
+
+T = TypeVar("T")
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """ Histogram of the observed values with fixed upper bounds """
+
+    def __init__(self, buckets: Sequence[float]):
+        self._buckets: Sequence[float] = buckets
+        self._counts: List[int] = [0] * (len(buckets) + 1)     # Last one is +Inf
+        self._sum: float = 0.0
+        self._count: int = 0
+
+    def observe(self, value: float) -> None:
+        self._counts[bisect_left(self._buckets, value)] += 1
+        self._sum += value
+        self._count += 1
+
+    def cumulative(self) -> Iterator[Tuple[str, int]]:
+        """ Yield the le label and the cumulative count of every bucket """
+        total = 0
+        for bound, count in zip(self._buckets, self._counts):
+            total += count
+            yield f"{bound:g}", total
+        yield "+Inf", self._count
+
+    @property
+    def sum(self) -> float:
+        return self._sum
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+
+class IterTimer:
+    """ Iterator wrapper adding up the time spent producing the items """
+
+    def __init__(self, iterable: Iterable[T]):
+        self._iterator: Iterator[T] = iter(iterable)
+        self.elapsed: float = 0.0
+
+    def __iter__(self) -> "IterTimer":
+        return self
+
+    def __next__(self) -> T:
+        start = time.perf_counter()
+        try:
+            return next(self._iterator)
+        finally:
+            self.elapsed += time.perf_counter() - start
+
+
+class Metrics:
+    """ Thread safe registry of counters and histograms """
+    PREFIX: str = "repricer_"
+    LATENCY_BUCKETS: Tuple[float, ...] = (
+        0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0
+    )
+    PAGE_BUCKETS: Tuple[float, ...] = (1, 2, 3, 5, 10, 20, 50)
+    HELP: Dict[str, str] = {
+        "stage_seconds": "Latency of the processing stages",
+        "http_requests_total": "HTTP responses by status code",
+        "http_bytes_total": "Bytes downloaded",
+        "http_errors_total": "HTTP requests failed without a response",
+        "http_throttled_total": "Throttled HTTP responses (429, 503 or robot check)",
+        "cache_requests_total": "HTTP cache lookups by result",
+        "listing_pages": "Offer listing pages downloaded per ASIN",
+        "asins_total": "ASINs repriced",
+        "asin_failures_total": "Failed ASIN attempts by error",
+        "unchanged_asins_total": "ASINs reusing their last prices as their offers didn't change",
+        "service_requests_total": "Repricing service requests by endpoint and status",
+        "service_request_seconds": "Latency of the repricing service requests",
+        "offer_cache_requests_total": "Offer page cache lookups of the repricing service",
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    def increment(self, name: str, value: float = 1.0, **labels: str) -> None:
+        """ Add value to the counter """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def counter(self, name: str, **labels: str) -> float:
+        """ Return the value of the counter """
+        with self._lock:
+            return self._counters.get((name, tuple(sorted(labels.items()))), 0.0)
+
+    def observe(self, name: str, value: float, buckets: Sequence[float] = LATENCY_BUCKETS,
+                **labels: str) -> None:
+        """ Add value to the histogram """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def time(self, stage: str) -> Iterator[None]:
+        """ Observe the duration of the block as the latency of the stage """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe("stage_seconds", time.perf_counter() - start, stage=stage)
+
+    def render(self) -> str:
+        """ Return the metrics in the Prometheus text exposition format """
+        lines: List[str] = []
+        with self._lock:
+            names = sorted({name for name, _ in self._counters} |
+                           {name for name, _ in self._histograms})
+            for name in names:
+                metric = f"{Metrics.PREFIX}{name}"
+                is_histogram = any(key[0] == name for key in self._histograms)
+                lines.append(f"# HELP {metric} {Metrics.HELP.get(name, name)}")
+                lines.append(f"# TYPE {metric} {'histogram' if is_histogram else 'counter'}")
+                if not is_histogram:
+                    for (_, labels), value in sorted(
+                            item for item in self._counters.items() if item[0][0] == name):
+                        lines.append(f"{metric}{self._format_labels(labels)} {value:g}")
+                    continue
+                for (_, labels), histogram in sorted(
+                        (item for item in self._histograms.items() if item[0][0] == name),
+                        key=lambda item: item[0]):
+                    for bound, count in histogram.cumulative():
+                        bucket_labels = self._format_labels(labels + (("le", bound), ))
+                        lines.append(f"{metric}_bucket{bucket_labels} {count}")
+                    lines.append(f"{metric}_sum{self._format_labels(labels)} {histogram.sum:g}")
+                    lines.append(f"{metric}_count{self._format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> str:
+        """ Return a human readable summary of the stage latencies and the counters """
+        lines: List[str] = []
+        with self._lock:
+            for (name, labels), histogram in sorted(self._histograms.items(),
+                                                    key=lambda item: item[0]):
+                label = ", ".join(value for _, value in labels) or name
+                mean = histogram.sum / histogram.count if histogram.count else 0.0
+                unit = "s" if name == "stage_seconds" else ""
+                lines.append(f"{label:>12}: {histogram.count} observations, "
+                             f"total {histogram.sum:.2f}{unit}, mean {mean:.3f}{unit}")
+            for (name, labels), value in sorted(self._counters.items()):
+                label = ", ".join(f"{key}={value}" for key, value in labels)
+                lines.append(f"{name}{f' ({label})' if label else ''}: {value:g}")
+        return "\n".join(lines)
+
+    def write(self, path: str) -> None:
+        """ Atomically write the metrics to the file, e.g. for the node exporter textfile """
+        temp_path = f"{path}.tmp"
+        with open(temp_path, mode="w") as metrics_file:
+            metrics_file.write(self.render())
+        os.replace(temp_path, path)
+
+    def serve(self, port: int, host: str = "127.0.0.1") -> None:
+        """ Serve the metrics on http://host:port/metrics from a background thread """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                payload = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def close(self) -> None:
+        """ Stop the metrics endpoint """
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    @staticmethod
+    def _format_labels(labels: Labels) -> str:
+        if not labels:
+            return ""
+        return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
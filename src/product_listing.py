@@ -5,16 +5,27 @@ Created on:     06/09/20, 7:11 PM
 
 Stores the product listing information from "http://www.amazon.com/gp/offer-listing/" site.
 """
-from typing import Optional
+from typing import Optional, Tuple
 
 from src.condition import Condition
 from src.console import Console
 
+# Condition by value, faster than calling Condition(value)
+CONDITIONS: Tuple[Condition, ...] = tuple(sorted(Condition, key=lambda condition: condition.value))
+
 
 class ProductListing:
-    """ Product Listing class """
+    """
+    Product Listing class. A listing is compared with a single precomputed sort key
+    (total, rank): the lowest total first, then the best condition, rating and number of ratings.
+    To keep the listings compact, the condition, rating and number of ratings are only stored
+    packed in the rank.
+    """
+    __slots__ = ("_seller", "_price", "_shipping", "_tax", "_sort_key")
     DEFAULT_SHIPPING: float = 3.99
     DEFAULT_TAX: float = 0.0
+    RATING_BITS: int = 8
+    TOTAL_RATINGS_BITS: int = 32
 
     def __init__(self, seller: Optional[str] = None, price: float = 0.0, rating: int = 0,
                  total_ratings: int = 0, condition: Condition = Condition.NONE,
@@ -23,18 +34,31 @@ class ProductListing:
         self._price: float = price
         self._shipping: float = shipping
         self._tax: float = tax
-        self._rating: int = rating
-        self._total_ratings: int = total_ratings
-        self._condition: Condition = condition
 
         if self._seller is None:
             self._seller = Console.SellerName
 
-        self._total = self._get_total()
+        self._sort_key: Tuple[float, int] = \
+            (self._get_total(), self._get_rank(rating, total_ratings, condition))
 
     def _get_total(self):
         return self._price + self._shipping + self._tax
 
+    @staticmethod
+    def _get_rank(rating: int, total_ratings: int, condition: Condition) -> int:
+        """ Pack condition, rating and number of ratings. Negated so the best sorts first. """
+        if not 0 <= rating < 1 << ProductListing.RATING_BITS or \
+                not 0 <= total_ratings < 1 << ProductListing.TOTAL_RATINGS_BITS:
+            raise ValueError(f"Rating {rating} or number of ratings {total_ratings} out of range")
+        return -((int(condition) << ProductListing.RATING_BITS | rating)
+                 << ProductListing.TOTAL_RATINGS_BITS | total_ratings)
+
+    def _set_total(self) -> None:
+        self._sort_key = (self._get_total(), self._sort_key[1])
+
+    def _set_rank(self, rating: int, total_ratings: int, condition: Condition) -> None:
+        self._sort_key = (self._sort_key[0], self._get_rank(rating, total_ratings, condition))
+
     # Class getters and setters
     @property
     def seller(self) -> str:
@@ -51,7 +75,7 @@ class ProductListing:
     @price.setter
     def price(self, value: float) -> None:
         self._price = value
-        self._total = self._get_total()
+        self._set_total()
 
     @property
     def shipping(self) -> float:
@@ -60,7 +84,7 @@ class ProductListing:
     @shipping.setter
     def shipping(self, value: float) -> None:
         self._shipping = value
-        self._total = self._get_total()
+        self._set_total()
 
     @property
     def tax(self) -> float:
@@ -69,60 +93,54 @@ class ProductListing:
     @tax.setter
     def tax(self, value: float) -> None:
         self._tax = value
-        self._total = self._get_total()
+        self._set_total()
 
     @property
     def rating(self) -> int:
-        return self._rating
+        return -self._sort_key[1] >> ProductListing.TOTAL_RATINGS_BITS & \
+               ((1 << ProductListing.RATING_BITS) - 1)
 
     @rating.setter
     def rating(self, value: int) -> None:
-        self._rating = value
+        self._set_rank(value, self.total_ratings, self.condition)
 
     @property
     def total_ratings(self) -> int:
-        return self._total_ratings
+        return -self._sort_key[1] & ((1 << ProductListing.TOTAL_RATINGS_BITS) - 1)
 
     @total_ratings.setter
     def total_ratings(self, value: int) -> None:
-        self._total_ratings = value
+        self._set_rank(self.rating, value, self.condition)
 
     @property
     def condition(self) -> Condition:
-        return self._condition
+        return CONDITIONS[-self._sort_key[1] >>
+                          (ProductListing.RATING_BITS + ProductListing.TOTAL_RATINGS_BITS)]
 
     @condition.setter
     def condition(self, value: Condition) -> None:
-        self._condition = value
+        self._set_rank(self.rating, self.total_ratings, value)
 
     @property
     def total(self) -> float:
-        return self._total
+        return self._sort_key[0]
+
+    @property
+    def sort_key(self) -> Tuple[float, int]:
+        """ Key for sorted(listings, key=...), faster than sorting with __lt__ """
+        return self._sort_key
 
     def __repr__(self):
         return f"{self._seller}: ${self._price:.2f} + ${self._shipping:.2f} shipping"
 
     def __str__(self):
-        self.__repr__()
+        return self.__repr__()
 
     def __eq__(self, other):
-        return self.total == other.total and self.condition == other.condition and \
-               self.rating == other.rating and self.total_ratings == other.total_ratings
+        return self._sort_key == other._sort_key
 
     def __lt__(self, other):
-        if self.total == other.total:
-            if self.condition == other.condition:
-                if self.rating == other.rating:
-                    return self.total_ratings > other.total_ratings
-                return self.rating > other.rating
-            return self.condition > other.condition
-        return self.total < other.total
+        return self._sort_key < other._sort_key
 
     def __gt__(self, other):
-        if self.total == other.total:
-            if self.condition == other.condition:
-                if self.rating == other.rating:
-                    return self.total_ratings < other.total_ratings
-                return self.rating < other.rating
-            return self.condition < other.condition
-        return self.total > other.total
+        return self._sort_key > other._sort_key
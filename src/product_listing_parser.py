@@ -5,134 +5,159 @@ Created on:     06/09/20, 10:20 PM
 
 Code to parse product listing information from "http://www.amazon.com/gp/offer-listing/".
 """
-from typing import List, Optional
+from typing import Any, Dict, Iterable, List, Optional, Iterator, Tuple
 import re
 from urllib.parse import urljoin
-import time
 
+from bs4 import SoupStrainer
 from bs4.element import Tag
 
 from src.product_listing import ProductListing
 from src.url_parser import URLParser
 from src.condition import Condition
 from src.console import Console
+from src.extraction_plan import ExtractionPlan, Field
+
+# Regular expressions are compiled once at import instead of once per offer
+PRICE_REGEX = re.compile(r"(\d+(?:\.\d+)?)")
+RATING_REGEX = re.compile(r"(\d+)\s*%")
+NO_OF_RATINGS_REGEX = re.compile(r"\(\s*(\d+).*\)")
+
+
+def _is_listing_element(name: str, attrs: Dict) -> bool:
+    """ SoupStrainer function matching the elements read by the parser """
+    return (name == "div" and URLParser.has_class(attrs, "olpOffer")) or \
+        (name == "ul" and URLParser.has_class(attrs, "a-pagination"))
 
 
 class ProductListingParser:
     """ Parse product listing information using BeautifulSoup4 """
     BASE_URL = "https://www.amazon.com/"
-
-    def __init__(self, url: str):
+    OFFER_CLASS = "a-row a-spacing-mini olpOffer"
+    CONDITION_MAPPING: Dict[str, Condition] = {
+        "New": Condition.NEW,
+        "Used-LikeNew": Condition.USED_LIKE_NEW,
+        "Used-VeryGood": Condition.USED_VERY_GOOD,
+        "Used-Good": Condition.USED_GOOD,
+        "Used-Acceptable": Condition.USED_ACCEPTABLE,
+        "Collectible-LikeNew": Condition.COLLECTIBLE_LIKE_NEW,
+        "Collectible-VeryGood": Condition.COLLECTIBLE_VERY_GOOD,
+        "Collectible-Good": Condition.COLLECTIBLE_GOOD,
+        "Collectible-Acceptable": Condition.COLLECTIBLE_ACCEPTABLE
+    }
+    # Elements read by the parser. Only these are built in targeted parse mode.
+    PARSE_ONLY: SoupStrainer = SoupStrainer(_is_listing_element)
+
+    def __init__(self, url: str, parser: Optional[URLParser] = None, keep_listings: bool = True):
         self._url: str = url
         self._product_listings: List[ProductListing] = []
-        self._parser: URLParser = URLParser()
-        self._soup: Optional[Tag] = None
+        # Without keep_listings the listings are only yielded, product_listings stays empty
+        self._keep_listings: bool = keep_listings
+        self._parser: URLParser = parser if parser is not None else URLParser()
+        self._pages_parsed: int = 0
+        self._has_next_page: bool = True
 
     def parse(self) -> List[ProductListing]:
-        """ Parse the product listing page """
+        """ Parse all the pages of the product listing """
+        for _ in self.iter_listings():
+            pass
+        return self._product_listings
+
+    def iter_listings(self, pages: Optional[Iterable[List[Dict[str, Any]]]] = None) \
+            -> Iterator[ProductListing]:
+        """
+        Lazily parse the product listing pages. The next page is only downloaded once all the
+        listings of the current page are consumed, so a consumer that stops early saves the
+        remaining requests. pages are the offers of the pages, iter_pages() by default.
+        """
+        self._product_listings = []
+        for offers in (pages if pages is not None else self.iter_pages()):
+            for offer in offers:
+                listing = ProductListing(**offer)
+                if self._keep_listings:
+                    self._product_listings.append(listing)
+                yield listing
+
+    def iter_pages(self) -> Iterator[List[Dict[str, Any]]]:
+        """ Lazily download the listing pages and yield the offer fields of every page """
+        self._pages_parsed = 0
+        self._has_next_page = True
         url_to_parse = self._url
-        while True:
-            self._soup: Tag = self._parser.parse(url=url_to_parse)
-            listings: List[Tag] = self._soup.find_all(
-                "div",
-                attrs={"class": "a-row a-spacing-mini olpOffer"}
+        while url_to_parse is not None:
+            # The pages are throttled by the rate limiter of the HTTP client
+            offers, url_to_parse = self._parser.extract(
+                url_to_parse, ProductListingParser.extract_page,
+                parse_only=ProductListingParser.PARSE_ONLY
             )
-            for row in listings:
-                price: float = self._parse_price(row)
-                seller: str = self._parse_seller(row)
-                rating: int = self._parse_rating(row)
-                no_of_ratings: int = self._parse_no_of_ratings(row)
-                condition: Condition = Condition(self._parse_condition(row))
-                self._product_listings.append(
-                    ProductListing(
-                        seller=seller,
-                        price=price,
-                        rating=rating,
-                        total_ratings=no_of_ratings,
-                        condition=condition
-                    )
-                )
-
-            url_to_parse = self._parse_next_link(self._soup)
-            if url_to_parse is None:
-                break
-
-            # Wait for 1 sec before scrapping next page
-            time.sleep(1)
-
-        return self._product_listings
+            self._pages_parsed += 1
+            self._has_next_page = url_to_parse is not None
+            yield offers
 
     @staticmethod
-    def _parse_price(row_listing: Tag) -> float:
-        """ Parse the price from a row of listing """
-        price = row_listing.find("div", attrs={"class": "olpPriceColumn"}).text.strip().\
-            replace("\n", "")
-        price_regex = re.compile(r"(\d+(?:\.\d+)?)")
-        match_obj = price_regex.search(price)
+    def extract_page(soup: Tag) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        Return the offer fields of a listing page and the link of the next page. Runs in the
+        parse workers, so only plain values are returned.
+        """
+        listings: List[Tag] = soup.find_all(
+            "div",
+            attrs={"class": ProductListingParser.OFFER_CLASS}
+        )
+        offers = [OFFER_PLAN.extract(row) for row in listings]
+        return offers, ProductListingParser._parse_next_link(soup)
+
+    # The offer fields are extracted from the columns of the offer row by OFFER_PLAN
+    @staticmethod
+    def _parse_price(price_column: Tag) -> float:
+        """ Parse the price from the price column of a listing """
+        price = price_column.text.strip().replace("\n", "")
+        match_obj = PRICE_REGEX.search(price)
         return float(match_obj.group(1)) if match_obj is not None else 0.0
 
     @staticmethod
-    def _parse_shipping(row_listing: Tag) -> float:
-        """ Parse the shipping value from a row of listing """
-        shipping = row_listing.find("div", attrs={"class": "olpPriceColumn"}).\
-            find("p", attrs={"class": "olpShippingInfo"})
+    def _parse_shipping(price_column: Tag) -> float:
+        """ Parse the shipping value from the price column of a listing """
+        shipping = price_column.find("p", attrs={"class": "olpShippingInfo"})
         return float(shipping.text.strip().replace("\n", "")) if shipping is not None else 0.0
 
     @staticmethod
-    def _parse_tax(row_listing: Tag) -> float:
-        """ Parse tax information from a row of listing """
+    def _parse_tax(price_column: Tag) -> float:
+        """ Parse tax information from the price column of a listing """
         pass
 
     @staticmethod
-    def _parse_seller(row_listing: Tag) -> str:
-        """ Parse the seller from a row of listing """
-        seller = row_listing.find("div", attrs={"class": "olpSellerColumn"})
-        seller = seller.find("h3", attrs={"class": "olpSellerName"})
+    def _parse_seller(seller_column: Tag) -> str:
+        """ Parse the seller from the seller column of a listing """
+        seller = seller_column.find("h3", attrs={"class": "olpSellerName"})
         return seller.text.strip().replace("\n", "") if seller is not None else "Amazon.com"
 
     @staticmethod
-    def _parse_rating(row_listing: Tag) -> int:
-        """ Parse rating from a row of listing """
-        details = row_listing.find("div", attrs={"class": "olpSellerColumn"})
-        rating = details.find("p")
+    def _parse_rating(seller_column: Tag) -> int:
+        """ Parse rating from the seller column of a listing """
+        rating = seller_column.find("p")
         if rating is None:
             return 100
         rating = rating.text.strip().replace("\n", "")
-        rating_regex = re.compile(r"(\d+)\s*%")
-        match_obj = rating_regex.search(rating)
+        match_obj = RATING_REGEX.search(rating)
         return int(match_obj.group(1)) if match_obj is not None else 100
 
     @staticmethod
-    def _parse_no_of_ratings(row_listing: Tag) -> int:
-        """ Parse no of user ratings from a row of listing """
-        details = row_listing.find("div", attrs={"class": "olpSellerColumn"})
-        no_of_ratings = details.find("p")
+    def _parse_no_of_ratings(seller_column: Tag) -> int:
+        """ Parse no of user ratings from the seller column of a listing """
+        no_of_ratings = seller_column.find("p")
         if no_of_ratings is None:
             return 0
         no_of_ratings = no_of_ratings.text.strip().replace("\n", "")
-        no_of_ratings_regex = re.compile(r"\(\s*(\d+).*\)")
-        match_obj = no_of_ratings_regex.search(no_of_ratings)
+        match_obj = NO_OF_RATINGS_REGEX.search(no_of_ratings)
         return int(match_obj.group(1)) if match_obj is not None else 0
 
     @staticmethod
-    def _parse_condition(row_listing: Tag) -> int:
-        """ Parse the condition from a row of listing """
-        condition_mapping = {
-            "New": Condition.NEW,
-            "Used-LikeNew": Condition.USED_LIKE_NEW,
-            "Used-VeryGood": Condition.USED_VERY_GOOD,
-            "Used-Good": Condition.USED_GOOD,
-            "Used-Acceptable": Condition.USED_ACCEPTABLE,
-            "Collectible-LikeNew": Condition.COLLECTIBLE_LIKE_NEW,
-            "Collectible-VeryGood": Condition.COLLECTIBLE_VERY_GOOD,
-            "Collectible-Good": Condition.COLLECTIBLE_GOOD,
-            "Collectible-Acceptable": Condition.COLLECTIBLE_ACCEPTABLE
-        }
+    def _parse_condition(condition_column: Tag) -> Condition:
+        """ Parse the condition from the condition column of a listing """
         # Removing all the spaces to normalize the string for easier comparison
-        condition = row_listing.find("div", attrs={"class": "olpConditionColumn"}).\
-            find("span", attrs={"class": "olpCondition"}).text.strip().\
+        condition = condition_column.find("span", attrs={"class": "olpCondition"}).text.strip().\
             replace("\n", "").replace(" ", "")
-        return condition_mapping[condition].value
+        return ProductListingParser.CONDITION_MAPPING[condition]
 
     @staticmethod
     def _parse_next_link(html_page: Tag) -> Optional[str]:
@@ -162,6 +187,15 @@ class ProductListingParser:
     def product_listings(self) -> List[ProductListing]:
         return self._product_listings
 
+    @property
+    def pages_parsed(self) -> int:
+        return self._pages_parsed
+
+    @property
+    def has_next_page(self) -> bool:
+        """ Whether the last page yielded by iter_pages links to a next page """
+        return self._has_next_page
+
     @property
     def my_listing(self) -> ProductListing:
         for listing in self._product_listings:
@@ -170,6 +204,19 @@ class ProductListingParser:
         return ProductListing()
 
 
+# Offer row schema. Every field is a ProductListing argument parsed from a column of the row.
+OFFER_PLAN = ExtractionPlan(
+    column_tag="div",
+    fields=(
+        Field("price", "olpPriceColumn", ProductListingParser._parse_price),
+        Field("seller", "olpSellerColumn", ProductListingParser._parse_seller),
+        Field("rating", "olpSellerColumn", ProductListingParser._parse_rating),
+        Field("total_ratings", "olpSellerColumn", ProductListingParser._parse_no_of_ratings),
+        Field("condition", "olpConditionColumn", ProductListingParser._parse_condition),
+    )
+)
+
+
 if __name__ == "__main__":
     test_url = "https://www.amazon.com/gp/offer-listing/0802136680/ref=olp_tab_all"
     test_listings = ProductListingParser(test_url).parse()
@@ -7,63 +7,97 @@ Code to parse product information from "http://www.amazon.com/gp/product/<asin_n
 This class will use the URLParser class to parse the information using BeautifulSoup4.
 """
 import re
-from typing import Optional, List
+from typing import Dict, Match, Optional, Pattern, Tuple
 
+from bs4 import SoupStrainer
 from bs4.element import Tag
 
 from src.url_parser import URLParser
 from src.product import Product
 
+# Regular expressions are compiled once at import instead of once per product
+WEIGHT_REGEX = re.compile(r":(\d+(?:\.\d+)?)\s+(\S+)")
+ASIN_REGEX = re.compile(r":(\d+)")
+
+
+def _is_product_element(name: str, attrs: Dict) -> bool:
+    """ SoupStrainer function matching the elements read by the parser """
+    return (name == "span" and attrs.get("id") == "productTitle") or \
+        (name == "div" and attrs.get("id") == "detailBullets_feature_div")
+
 
 class ProductParser:
     """ Parse the product information using BeautifulSoup4 """
+    # Elements read by the parser. Only these are built in targeted parse mode.
+    PARSE_ONLY: SoupStrainer = SoupStrainer(_is_product_element)
+    # Product detail schema: (field, keyword of the detail, regex applied to the detail)
+    DETAIL_FIELDS: Tuple[Tuple[str, str, Pattern], ...] = (
+        ("weight", "weight", WEIGHT_REGEX),
+        ("asin", "isbn-10", ASIN_REGEX),
+    )
 
-    def __init__(self, url: str):
+    def __init__(self, url: str, parser: Optional[URLParser] = None):
         self._url: str = url
-        self._parser: URLParser = URLParser()
-        self._soup: Optional[Tag] = None
+        self._parser: URLParser = parser if parser is not None else URLParser()
 
     def parse(self) -> Product:
         """ Parse the URL and return Product object """
-        self._soup = self._parser.parse(url=self._url)
-        name: str = self._parse_name()
-        asin: str = self._parse_asin()
-        weight: float = self._parse_weight()
+        name, asin, weight = self._parser.extract(
+            self._url, ProductParser.extract_fields, self._url,
+            parse_only=ProductParser.PARSE_ONLY
+        )
         return Product(name=name, asin=asin, weight=weight)
 
-    def _parse_name(self) -> str:
+    @staticmethod
+    def extract_fields(soup: Tag, url: str) -> Tuple[str, str, float]:
+        """ Return the name, ASIN and weight of the product page. Runs in the parse workers. """
+        name: str = ProductParser._parse_name(soup)
+        product_details: Dict[str, Match] = ProductParser._parse_product_details(soup)
+        asin: str = ProductParser._parse_asin(product_details, url)
+        weight: float = ProductParser._parse_weight(product_details)
+        return name, asin, weight
+
+    @staticmethod
+    def _parse_name(soup: Tag) -> str:
         """ Parse the name """
-        return self._soup.find("span", attrs={"id": "productTitle"}).text.strip()
+        return soup.find("span", attrs={"id": "productTitle"}).text.strip()
 
-    def _parse_product_details(self) -> List[str]:
-        """ Parse the product details and return a list of details """
-        details_div = self._soup.find("div", attrs={"id": "detailBullets_feature_div"})
-        return [detail.text.strip().replace("\n", "") for detail in details_div.find_all("li")]
+    @staticmethod
+    def _parse_product_details(soup: Tag) -> Dict[str, Match]:
+        """
+        Parse the product details in a single pass. Return the first regex match of every
+        DETAIL_FIELDS field whose keyword is in the detail.
+        """
+        details_div = soup.find("div", attrs={"id": "detailBullets_feature_div"})
+        matches: Dict[str, Match] = {}
+        for detail in details_div.find_all("li"):
+            detail = detail.text.strip().replace("\n", "")
+            lower_detail = detail.lower()
+            for field, keyword, regex in ProductParser.DETAIL_FIELDS:
+                if field not in matches and keyword in lower_detail:
+                    match_obj = regex.search(detail)
+                    if match_obj is not None:
+                        matches[field] = match_obj
+            if len(matches) == len(ProductParser.DETAIL_FIELDS):
+                break
+        return matches
 
-    def _parse_weight(self) -> float:
+    @staticmethod
+    def _parse_weight(product_details: Dict[str, Match]) -> float:
         """ Parse weight from the product details """
-        weight_regex = re.compile(r":(\d+(?:\.\d+)?)\s+(\S+)")
-        product_details = self._parse_product_details()
-        for detail in product_details:
-            if "weight" in detail.lower():
-                match_obj = weight_regex.search(detail)
-                # Return positive weight for pound and negative weight for ounces
-                if match_obj is not None:
-                    return float(match_obj.group(1)) \
-                        if "pound" in match_obj.group(2).lower() \
-                        else -float(match_obj.group(1))
-        return 0.0
-
-    def _parse_asin(self) -> str:
+        match_obj = product_details.get("weight")
+        if match_obj is None:
+            return 0.0
+        # Return positive weight for pound and negative weight for ounces
+        return float(match_obj.group(1)) \
+            if "pound" in match_obj.group(2).lower() \
+            else -float(match_obj.group(1))
+
+    @staticmethod
+    def _parse_asin(product_details: Dict[str, Match], url: str) -> str:
         """ Parse ASIN or ISBN-10 number from the product details """
-        asin_regex = re.compile(r":(\d+)")
-        product_details = self._parse_product_details()
-        for detail in product_details:
-            if "isbn-10" in detail.lower():
-                match_obj = asin_regex.search(detail)
-                if match_obj is not None:
-                    return match_obj.group(1)
-        return self._url.split("/")[-1]
+        match_obj = product_details.get("asin")
+        return match_obj.group(1) if match_obj is not None else url.split("/")[-1]
 
     # Class getters and setters
     @property
@@ -0,0 +1,85 @@
+"""
+File:           product_store.py
+Author:         Dibyaranjan Sathua
+Created on:     18/10/26, 1:40 PM
+
+Persistent store of the product information parsed from the product page. Name, ASIN and weight
+of a product don't change, so the product page only needs to be parsed once per ASIN.
+"""
+from typing import Dict, Iterable, Optional
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from src.product import Product
+
+
+class ProductStore:
+    """ SQLite backed product store indexed by the input ASIN """
+
+    def __init__(self, path: str):
+        self._path: str = os.path.abspath(path)
+        self._lock = threading.Lock()
+        # Several processes, e.g. the shards of a batch, can share the database. Readers don't
+        # block the writer in WAL mode and a writer waits for the others up to the timeout.
+        self._connection = sqlite3.connect(self._path, timeout=60.0, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS products (
+                asin TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                product_asin TEXT NOT NULL,
+                weight REAL NOT NULL,
+                shipping_rate REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+
+    def get(self, asin: str) -> Optional[Product]:
+        """ Return the stored product of the ASIN """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT name, product_asin, weight FROM products WHERE asin = ?", (asin, )
+            ).fetchone()
+        return Product(name=row[0], asin=row[1], weight=row[2]) if row is not None else None
+
+    def get_many(self, asins: Iterable[str]) -> Dict[str, Product]:
+        """ Return the stored products of all the ASINs in a single query """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT asin, name, product_asin, weight FROM products "
+                "WHERE asin IN (SELECT value FROM json_each(?))",
+                (json.dumps(list(asins)), )
+            ).fetchall()
+        return {asin: Product(name=name, asin=product_asin, weight=weight)
+                for asin, name, product_asin, weight in rows}
+
+    def put(self, asin: str, product: Product) -> None:
+        """ Insert or replace the product of the ASIN """
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO products "
+                "(asin, name, product_asin, weight, shipping_rate, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (asin, product.name, product.asin, product.weight, product.shipping_rate,
+                 time.time())
+            )
+
+    def remove(self, asin: str) -> None:
+        """ Remove the ASIN so that its product page is parsed again on the next run """
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM products WHERE asin = ?", (asin, ))
+
+    def close(self) -> None:
+        """ Close the store database """
+        with self._lock:
+            self._connection.close()
+
+    # Class getters
+    @property
+    def path(self) -> str:
+        return self._path
@@ -0,0 +1,247 @@
+"""
+File:           profiler.py
+Author:         Dibyaranjan Sathua
+Created on:     22/10/26, 3:15 PM
+
+Profiling mode of a run. Every thread runs under its own profile, cProfile up to Python 3.11 and
+the pure Python profile from 3.12, the Python memory allocations are traced with tracemalloc
+and the stacks of all the threads are sampled for a flame graph. At the end the profiler writes:
+    profile.pstats      merged profile statistics (python -m pstats, snakeviz, ...)
+    profile.collapsed   sampled stacks in the collapsed format of flamegraph.pl / speedscope
+    profile.txt         hot path breakdown per ASIN and top memory allocators
+"""
+from typing import Callable, Dict, List, Optional, Tuple
+import cProfile
+import io
+import os
+import profile
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+# pstats function key: (file name, line number, function name)
+FunctionKey = Tuple[str, int, str]
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+# cProfile runs on sys.monitoring from Python 3.12: a single profile gets the events of all the
+# threads on one call stack and no second profile can be enabled. The pure Python profile still
+# runs on sys.setprofile, which is per thread.
+PER_THREAD_CPROFILE: bool = sys.version_info < (3, 12)
+
+
+def _is_parse_helper(function: FunctionKey) -> bool:
+    return function[0].startswith(SOURCE_DIR) and function[2].startswith("_parse_")
+
+
+def _is_soup_find(function: FunctionKey) -> bool:
+    return function[0].endswith(os.path.join("bs4", "element.py")) and \
+        function[2] in ("find", "find_all", "find_next", "select", "select_one")
+
+
+def _is_soup_construction(function: FunctionKey) -> bool:
+    return function[0].endswith(os.path.join("bs4", "__init__.py")) and \
+        function[2] == "__init__"
+
+
+class _ThreadProfile(profile.Profile):
+    """
+    Pure Python profile enabled in a running thread, below the frames of its caller. The callers
+    of the statistics have the (calls, calls, time, cumulative time) of cProfile.
+    """
+
+    def __init__(self):
+        super().__init__(timer=time.perf_counter)
+        # (function, caller): [internal time, cumulative time]
+        self._edges: Dict[Tuple[FunctionKey, FunctionKey], List[float]] = {}
+
+    def trace_dispatch_return(self, frame, t):
+        # Return of a frame called before the profile was enabled
+        if self.cur[-1] is None:
+            return 1
+        if frame is not self.cur[-2]:
+            # Frames unwound by an exception
+            self.trace_dispatch_return(self.cur[-2], 0)
+        _, internal, external, function, _, parent = self.cur
+        if self.timings[function][1] == 1:
+            # Outermost call of a recursion
+            times = self._edges.setdefault((function, parent[-3]), [0.0, 0.0])
+            times[0] += internal + t
+            times[1] += internal + t + external
+        return super().trace_dispatch_return(frame, t)
+
+    def snapshot_stats(self):
+        super().snapshot_stats()
+        for function, (calls, primitive_calls, total, cumulative, callers) in \
+                self.stats.items():
+            self.stats[function] = calls, primitive_calls, total, cumulative, {
+                caller: (count, count, *self._edges.get((function, caller), (0.0, 0.0)))
+                for caller, count in callers.items()
+            }
+
+    dispatch = dict(profile.Profile.dispatch, **{
+        "return": trace_dispatch_return,
+        "c_return": trace_dispatch_return,
+    })
+
+
+class Profiler:
+    """ cProfile, tracemalloc and stack sampling of all the threads of the run """
+    # Hot path groups of the breakdown: (name, function filter)
+    HOT_PATHS: Tuple[Tuple[str, Callable[[FunctionKey], bool]], ...] = (
+        ("parser helpers (_parse_*)", _is_parse_helper),
+        ("soup find calls", _is_soup_find),
+        ("BeautifulSoup construction", _is_soup_construction),
+    )
+    SAMPLE_INTERVAL: float = 0.005
+    TRACEMALLOC_FRAMES: int = 10
+    TOP: int = 25
+
+    def __init__(self, output_dir: str):
+        self._output_dir: str = os.path.abspath(output_dir)
+        self._lock = threading.Lock()
+        self._profiles: List[profile.Profile] = []
+        self._stacks: Dict[str, int] = {}
+        self._sampler: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._snapshot: Optional[tracemalloc.Snapshot] = None
+        self._elapsed: float = 0.0
+        self._start: float = 0.0
+        self._peak_memory: int = 0
+
+    def start(self) -> None:
+        """ Start profiling the current thread and every thread started afterwards """
+        os.makedirs(self._output_dir, exist_ok=True)
+        tracemalloc.start(Profiler.TRACEMALLOC_FRAMES)
+        self._start = time.perf_counter()
+        # The sampler is started before the hook, which also skips it, so that it isn't profiled
+        self._stopped.clear()
+        self._sampler = threading.Thread(target=self._sample, name="profiler-sampler",
+                                         daemon=True)
+        self._sampler.start()
+        # A profile only profiles the thread enabling it. The hook enables a profile in every
+        # thread on its first profiler event.
+        if PER_THREAD_CPROFILE:
+            threading.setprofile(self._profile_thread)
+            self._enable_profile()
+        else:
+            # Also sets the hook of the current thread and of the threads already running
+            threading.setprofile_all_threads(self._profile_thread)
+
+    def stop(self) -> None:
+        """ Stop profiling and take the memory snapshot """
+        self._elapsed = time.perf_counter() - self._start
+        if PER_THREAD_CPROFILE:
+            threading.setprofile(None)
+            # The profile of the current thread first, disabling another profile from this
+            # thread would also remove the profiler function of this thread
+            with self._lock:
+                self._profiles[0].disable()
+                for thread_profile in self._profiles[1:]:
+                    thread_profile.disable()
+        else:
+            threading.setprofile_all_threads(None)
+        self._stopped.set()
+        self._sampler.join()
+        self._snapshot = tracemalloc.take_snapshot()
+        self._peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    def write(self, asins: int = 0) -> str:
+        """ Write the profile files and return the report """
+        stats = pstats.Stats(*self._profiles)
+        stats.dump_stats(os.path.join(self._output_dir, "profile.pstats"))
+        with open(os.path.join(self._output_dir, "profile.collapsed"), mode="w") as stacks_file:
+            for stack, count in sorted(self._stacks.items()):
+                stacks_file.write(f"{stack} {count}\n")
+        report = self.report(stats, asins)
+        with open(os.path.join(self._output_dir, "profile.txt"), mode="w") as report_file:
+            report_file.write(report)
+        return report
+
+    def report(self, stats: pstats.Stats, asins: int = 0) -> str:
+        """ Hot path breakdown, top functions and top memory allocators """
+        per_asin = max(1, asins)
+        lines: List[str] = [
+            f"Profiled {self._elapsed:.2f} sec, {len(self._profiles)} threads, {asins} ASINs",
+            "",
+            f"{'Hot path':<30} {'calls':>10} {'cumtime':>10} {'ms/ASIN':>10}",
+        ]
+        for name, is_hot in Profiler.HOT_PATHS:
+            calls = 0
+            cumulative = 0.0
+            for function, (_, calls_count, _, function_cumulative, callers) in \
+                    stats.stats.items():
+                if not is_hot(function):
+                    continue
+                calls += calls_count
+                cumulative += function_cumulative
+                # Time of nested calls (find calling find_all) is already in the caller
+                for caller, (_, _, _, nested_cumulative) in callers.items():
+                    if is_hot(caller):
+                        cumulative -= nested_cumulative
+            lines.append(f"{name:<30} {calls:>10} {cumulative:>10.3f} "
+                         f"{cumulative / per_asin * 1000:>10.2f}")
+        lines.append("")
+        for name, is_hot in Profiler.HOT_PATHS[:2]:
+            # Detail of the groups made of several functions
+            for function, (_, calls_count, _, cumulative, _) in sorted(
+                    stats.stats.items(), key=lambda item: -item[1][3]):
+                if is_hot(function):
+                    lines.append(f"  {function[2]:<28} {calls_count:>10} {cumulative:>10.3f} "
+                                 f"{cumulative / per_asin * 1000:>10.2f}")
+        lines.append("")
+
+        stream = io.StringIO()
+        pstats.Stats(*self._profiles, stream=stream).sort_stats("cumulative").\
+            print_stats(Profiler.TOP)
+        lines.append(stream.getvalue().strip())
+        lines.append("")
+
+        lines.append(f"Top memory allocators still allocated at the end of the run "
+                     f"(peak {self._peak_memory / 2 ** 20:.1f} MiB)")
+        for statistic in self._snapshot.statistics("lineno")[:Profiler.TOP]:
+            lines.append(f"  {statistic}")
+        return "\n".join(lines) + "\n"
+
+    def _enable_profile(self) -> None:
+        if PER_THREAD_CPROFILE:
+            thread_profile = cProfile.Profile()
+            with self._lock:
+                self._profiles.append(thread_profile)
+            thread_profile.enable()
+        else:
+            thread_profile = _ThreadProfile()
+            with self._lock:
+                self._profiles.append(thread_profile)
+            sys.setprofile(thread_profile.dispatcher)
+
+    def _profile_thread(self, frame, event, arg) -> None:
+        """ threading.setprofile hook replaced by the profile of the thread """
+        if threading.current_thread() is self._sampler:
+            sys.setprofile(None)
+            return
+        self._enable_profile()
+
+    def _sample(self) -> None:
+        """ Sample the stacks of the other threads until stopped """
+        own_id = threading.get_ident()
+        while not self._stopped.wait(Profiler.SAMPLE_INTERVAL):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack: List[str] = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:"
+                                 f"{code.co_firstlineno})")
+                    frame = frame.f_back
+                # Group the executor threads of the same pool by their name prefix
+                thread_name = names.get(thread_id, str(thread_id)).rsplit("_", 1)[0]
+                key = ";".join([thread_name] + stack[::-1])
+                self._stacks[key] = self._stacks.get(key, 0) + 1
+
+    @property
+    def output_dir(self) -> str:
+        return self._output_dir
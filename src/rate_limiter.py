@@ -0,0 +1,104 @@
+"""
+File:           rate_limiter.py
+Author:         Dibyaranjan Sathua
+Created on:     18/10/26, 3:10 PM
+
+Adaptive per host rate limiter. Every host has a token bucket whose rate follows AIMD: it
+increases additively after every successful request and is halved when the host throttles us.
+"""
+from typing import Dict
+import threading
+import time
+
+
+class _Bucket:
+    """ Token bucket of a single host """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate: float = rate
+        self.tokens: float = burst
+        self.updated_at: float = time.monotonic()
+        self.requests: int = 0
+        self.backoff_events: int = 0
+        self.waited: float = 0.0
+
+
+class RateLimiter:
+    """ Thread safe token bucket rate limiter with AIMD rate adaptation """
+    DEFAULT_RATE: float = 2.0           # Requests per second
+    DEFAULT_MIN_RATE: float = 0.2
+    DEFAULT_MAX_RATE: float = 10.0
+    DEFAULT_BURST: float = 1.0
+    DEFAULT_INCREASE: float = 0.05      # Added to the rate after every successful request
+    DEFAULT_DECREASE: float = 0.5       # Rate multiplier when the host throttles
+
+    def __init__(self, rate: float = DEFAULT_RATE, min_rate: float = DEFAULT_MIN_RATE,
+                 max_rate: float = DEFAULT_MAX_RATE, burst: float = DEFAULT_BURST,
+                 increase: float = DEFAULT_INCREASE, decrease: float = DEFAULT_DECREASE):
+        self._rate: float = rate
+        self._min_rate: float = min(min_rate, rate)
+        self._max_rate: float = max(max_rate, rate)
+        self._burst: float = burst
+        self._increase: float = increase
+        self._decrease: float = decrease
+        self._buckets: Dict[str, _Bucket] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, host: str) -> float:
+        """
+        Take a token for a request to the host, waiting until it is available. Tokens are
+        reserved in the calling order, so concurrent callers are spaced at the current rate.
+        Returns the waiting time in seconds.
+        """
+        with self._lock:
+            bucket = self._get_bucket(host)
+            now = time.monotonic()
+            bucket.tokens = min(self._burst,
+                                bucket.tokens + (now - bucket.updated_at) * bucket.rate)
+            bucket.updated_at = now
+            bucket.tokens -= 1
+            bucket.requests += 1
+            wait = -bucket.tokens / bucket.rate if bucket.tokens < 0 else 0.0
+            bucket.waited += wait
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def on_success(self, host: str) -> None:
+        """ Additive increase of the host rate """
+        with self._lock:
+            bucket = self._get_bucket(host)
+            bucket.rate = min(self._max_rate, bucket.rate + self._increase)
+
+    def on_throttle(self, host: str) -> None:
+        """ Multiplicative decrease of the host rate """
+        with self._lock:
+            bucket = self._get_bucket(host)
+            bucket.rate = max(self._min_rate, bucket.rate * self._decrease)
+            bucket.backoff_events += 1
+
+    def rate(self, host: str) -> float:
+        """ Return the current rate of the host in requests per second """
+        with self._lock:
+            return self._get_bucket(host).rate
+
+    def _get_bucket(self, host: str) -> _Bucket:
+        """ Return the bucket of the host. Must be called with the lock held. """
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            bucket = self._buckets[host] = _Bucket(self._rate, self._burst)
+        return bucket
+
+    @property
+    def metrics(self) -> Dict[str, Dict[str, float]]:
+        """ Current rate, requests, backoff events and total waiting time of every host """
+        with self._lock:
+            return {
+                host: {
+                    "rate": bucket.rate,
+                    "requests": bucket.requests,
+                    "backoff_events": bucket.backoff_events,
+                    "waited": bucket.waited
+                }
+                for host, bucket in self._buckets.items()
+            }
@@ -5,7 +5,7 @@ Created on:     07/09/20, 11:31 AM
 
 Code for repricer.
 """
-from typing import List, Optional
+from typing import Dict, Iterable, List, Optional
 import sys
 
 from src.product import Product
@@ -20,40 +20,63 @@ class Repricer:
     PER_ITEM_FEE = 0.99
     EPSILON = 0.00001
 
-    def __init__(self, product: Product, product_listings: List[ProductListing]):
+    def __init__(self, product: Product, product_listings: Iterable[ProductListing]):
         self._product: Product = product
-        self._product_listings: List[ProductListing] = product_listings
+        self._product_listings: Iterable[ProductListing] = product_listings
         self._price_floor: float = 0.0
         self._price_ceiling: float = sys.float_info.max
         self._condition_filter: Condition = Condition.NONE
         self._rating_filter = 0
 
     def reprice(self, seller: Optional[ProductListing] = None) -> float:
-        """ Reprice the seller price """
+        """
+        Reprice the seller price. The product listings must be sorted by total. They are
+        iterated only until the price is found, so they can be a lazy iterator.
+        """
+        return self.reprice_conditions([self._condition_filter], seller)[self._condition_filter]
+
+    def reprice_conditions(self, conditions: Iterable[Condition],
+                           seller: Optional[ProductListing] = None) -> Dict[Condition, float]:
+        """
+        Reprice the seller price for every condition filter in a single pass over the product
+        listings. The iteration stops once the price of every condition is found.
+        """
         if seller is None:
             seller = ProductListing()
 
+        pending: List[Condition] = list(dict.fromkeys(Condition(value) for value in conditions))
+        prices: Dict[Condition, float] = {}
         reprice_value = self._price_floor
+        lowest_total: Optional[float] = None
         for listing in self._product_listings:
             total = listing.total
+            if lowest_total is None:
+                lowest_total = total
             if total > self._price_ceiling:
                 break
             elif total < self._price_floor or listing.rating < self._rating_filter \
                     or listing.seller == seller.seller:
                 continue
 
-            if self._condition_filter == Condition.NEW:
-                if listing.condition == Condition.NEW:
-                    return listing.total - seller.shipping
-            elif listing.condition.value >= self._condition_filter.value - 1:
-                if abs(total - self._product_listings[0].total) < Repricer.EPSILON:
-                    return listing.total - seller.shipping
-                else:
-                    return listing.total - seller.shipping - 0.01
+            for condition_filter in list(pending):
+                if condition_filter == Condition.NEW:
+                    if listing.condition == Condition.NEW:
+                        prices[condition_filter] = listing.total - seller.shipping
+                        pending.remove(condition_filter)
+                elif listing.condition.value >= condition_filter.value - 1:
+                    if abs(total - lowest_total) < Repricer.EPSILON:
+                        prices[condition_filter] = listing.total - seller.shipping
+                    else:
+                        prices[condition_filter] = listing.total - seller.shipping - 0.01
+                    pending.remove(condition_filter)
+            if not pending:
+                return prices
 
             reprice_value = listing.total
 
-        return reprice_value - seller.shipping
+        for condition_filter in pending:
+            prices[condition_filter] = reprice_value - seller.shipping
+        return prices
 
     def calculate_profit(self, price: float, shipping: float) -> float:
         """ Calculate profit """
@@ -70,11 +93,11 @@ class Repricer:
         self._product = value
 
     @property
-    def product_listings(self) -> List[ProductListing]:
+    def product_listings(self) -> Iterable[ProductListing]:
         return self._product_listings
 
     @product_listings.setter
-    def product_listings(self, value: List[ProductListing]) -> None:
+    def product_listings(self, value: Iterable[ProductListing]) -> None:
         self._product_listings = value
 
     @property
@@ -0,0 +1,77 @@
+"""
+File:           retry_queue.py
+Author:         Dibyaranjan Sathua
+Created on:     21/10/26, 4:10 PM
+
+Dead-letter queue of the ASINs that failed. A failed ASIN is retried after an exponential delay
+until it succeeds or reaches the maximum number of attempts, then it is reported as failed.
+"""
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import heapq
+import itertools
+import time
+
+
+class RetryItem(NamedTuple):
+    """ Failed ASIN with its (line index, condition) input lines """
+    asin: str
+    lines: List[Tuple[int, int]]
+    attempts: int                       # Number of failed attempts
+    error: str                          # Cause of the last failure
+
+
+class RetryQueue:
+    """ Delayed and capped retries of the failed ASINs """
+    DEFAULT_MAX_ATTEMPTS: int = 3
+    DEFAULT_DELAY: float = 5.0
+    MAX_DELAY: float = 60.0
+
+    def __init__(self, max_attempts: int = DEFAULT_MAX_ATTEMPTS, delay: float = DEFAULT_DELAY,
+                 max_delay: float = MAX_DELAY):
+        self._max_attempts: int = max(1, max_attempts)
+        self._delay: float = delay
+        self._max_delay: float = max_delay
+        # Heap of (ready time, sequence number, item). The sequence keeps the failure order.
+        self._heap: List[Tuple[float, int, RetryItem]] = []
+        self._sequence = itertools.count()
+        self._failed: Dict[str, RetryItem] = {}
+
+    def push(self, asin: str, lines: List[Tuple[int, int]], error: Exception,
+             attempts: int = 1) -> bool:
+        """
+        Record the failure of an attempt. Return True if the ASIN is queued for a retry and
+        False if it failed permanently.
+        """
+        item = RetryItem(asin, lines, attempts, f"{type(error).__name__}: {error}")
+        if attempts >= self._max_attempts:
+            self._failed[asin] = item
+            return False
+        delay = min(self._delay * 2 ** (attempts - 1), self._max_delay)
+        heapq.heappush(self._heap, (time.monotonic() + delay, next(self._sequence), item))
+        return True
+
+    def pop_ready(self) -> List[RetryItem]:
+        """ Remove and return the items whose delay is over """
+        now = time.monotonic()
+        ready: List[RetryItem] = []
+        while self._heap and self._heap[0][0] <= now:
+            ready.append(heapq.heappop(self._heap)[2])
+        return ready
+
+    def next_delay(self) -> Optional[float]:
+        """ Seconds until the next item is ready, None if the queue is empty """
+        if not self._heap:
+            return None
+        return max(0.0, self._heap[0][0] - time.monotonic())
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    # Class getters
+    @property
+    def failed(self) -> List[RetryItem]:
+        return list(self._failed.values())
+
+    @property
+    def max_attempts(self) -> int:
+        return self._max_attempts
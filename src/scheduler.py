@@ -0,0 +1,124 @@
+"""
+File:           scheduler.py
+Author:         Dibyaranjan Sathua
+Created on:     23/10/26, 3:40 PM
+
+Poll scheduler of the repricing daemon. Every ASIN is polled again after an interval that
+shrinks when its competing offers change often and when it earns a bigger profit, so that the
+limited request budget is spent where prices move and where the money is.
+"""
+from typing import Dict, List, Optional, Tuple
+import heapq
+import itertools
+import time
+
+
+class PollState:
+    """ Change history of the competing offers of an ASIN """
+
+    def __init__(self, change_rate: float):
+        self.fingerprint: Optional[str] = None
+        self.change_rate: float = change_rate       # Smoothed fraction of polls with a change
+        self.profit: float = 0.0
+        self.interval: float = 0.0
+        self.polls: int = 0
+        self.changes: int = 0
+        self.failures: int = 0
+
+
+class PollScheduler:
+    """ Priority queue of the ASINs ordered by their next poll time """
+    DEFAULT_MIN_INTERVAL: float = 60.0
+    DEFAULT_MAX_INTERVAL: float = 6 * 3600.0
+    # Weight of the last poll in the smoothed change rate
+    SMOOTHING: float = 0.3
+    INITIAL_CHANGE_RATE: float = 0.5
+    # Profit at which an ASIN is polled twice as often as an unprofitable one
+    PROFIT_SCALE: float = 10.0
+
+    def __init__(self, min_interval: float = DEFAULT_MIN_INTERVAL,
+                 max_interval: float = DEFAULT_MAX_INTERVAL):
+        if min_interval > max_interval:
+            raise ValueError(f"Minimum interval {min_interval} is above the maximum interval "
+                             f"{max_interval}")
+        self._min_interval: float = min_interval
+        self._max_interval: float = max_interval
+        # Heap of (poll time, sequence number, ASIN). Every ASIN has at most one entry.
+        self._heap: List[Tuple[float, int, str]] = []
+        self._sequence = itertools.count()
+        self._states: Dict[str, PollState] = {}
+
+    def add(self, asin: str, delay: float = 0.0) -> None:
+        """ Schedule a new ASIN after delay seconds """
+        self._states[asin] = PollState(PollScheduler.INITIAL_CHANGE_RATE)
+        self._push(asin, delay)
+
+    def pop_due(self, limit: Optional[int] = None) -> List[str]:
+        """ Remove and return up to limit ASINs whose poll time has come, most overdue first """
+        now = time.monotonic()
+        due: List[str] = []
+        while self._heap and self._heap[0][0] <= now and (limit is None or len(due) < limit):
+            due.append(heapq.heappop(self._heap)[2])
+        return due
+
+    def next_delay(self) -> Optional[float]:
+        """ Seconds until the next poll, None if no ASIN is scheduled """
+        if not self._heap:
+            return None
+        return max(0.0, self._heap[0][0] - time.monotonic())
+
+    def record(self, asin: str, fingerprint: str, profit: float) -> bool:
+        """
+        Record a poll of the ASIN and schedule the next one. Return True if the competing
+        offers changed since the previous poll.
+        """
+        state = self._states[asin]
+        changed = state.fingerprint is not None and fingerprint != state.fingerprint
+        if state.fingerprint is not None:
+            state.change_rate += PollScheduler.SMOOTHING * (float(changed) - state.change_rate)
+        state.fingerprint = fingerprint
+        state.profit = profit
+        state.polls += 1
+        state.changes += changed
+        state.failures = 0
+        state.interval = self._get_interval(state)
+        self._push(asin, state.interval)
+        return changed
+
+    def record_failure(self, asin: str) -> float:
+        """ Schedule a failed ASIN again with an exponential delay. Return the delay. """
+        state = self._states[asin]
+        state.failures += 1
+        delay = min(self._min_interval * 2 ** (state.failures - 1), self._max_interval)
+        self._push(asin, delay)
+        return delay
+
+    def _get_interval(self, state: PollState) -> float:
+        """
+        Interval between the minimum for offers changing at every poll and the maximum for
+        offers that never change, divided by up to 2 for the most profitable ASINs.
+        """
+        span = self._max_interval - self._min_interval
+        interval = self._min_interval + span * (1.0 - state.change_rate) ** 2
+        weight = 1.0 + min(max(state.profit, 0.0), PollScheduler.PROFIT_SCALE) / \
+            PollScheduler.PROFIT_SCALE
+        return max(self._min_interval, interval / weight)
+
+    def _push(self, asin: str, delay: float) -> None:
+        heapq.heappush(self._heap, (time.monotonic() + delay, next(self._sequence), asin))
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    # Class getters
+    @property
+    def states(self) -> Dict[str, PollState]:
+        return self._states
+
+    @property
+    def min_interval(self) -> float:
+        return self._min_interval
+
+    @property
+    def max_interval(self) -> float:
+        return self._max_interval
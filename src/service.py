@@ -0,0 +1,422 @@
+"""
+File:           service.py
+Author:         Dibyaranjan Sathua
+Created on:     26/10/26, 10:00 AM
+
+Long-lived repricing HTTP service for the other systems of the shop. The HTTP client pools, the
+products and the recent offer listing pages stay in memory between the requests, so repricing
+a recently seen ASIN takes milliseconds instead of a new scrape. The asyncio server only
+handles the connections, the downloads, parsing and repricing run in a thread pool.
+
+    GET  /reprice?asin=ASIN&condition=9[&condition=5]   JSON array of the results
+    POST /batch     JSON array, or JSON lines, of {"asin": ..., "condition": ...} pairs. Every
+                    result is streamed as a JSON line as soon as its ASIN is repriced.
+    GET  /health    Cache sizes
+    GET  /metrics   Prometheus text format
+"""
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+import asyncio
+import json
+import signal
+import threading
+import time
+
+from src.amazon import Amazon
+from src.condition import Condition
+from src.fingerprint_store import Offers
+from src.http_client import HttpClient
+from src.metrics import Metrics
+from src.product import Product
+from src.product_listing import ProductListing
+from src.product_listing_parser import ProductListingParser
+from src.product_parser import ProductParser
+from src.product_store import ProductStore
+from src.rate_limiter import RateLimiter
+from src.repricer import Repricer
+from src.single_flight import SingleFlight
+from src.url_parser import URLParser
+
+# Result of a condition of an ASIN, one JSON line of the batch endpoint
+Result = Dict[str, Any]
+
+
+class ServiceError(Exception):
+    """ Invalid request, answered with its HTTP status """
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status: int = status
+
+
+class CachedOffers:
+    """
+    Offer listing pages of an ASIN shared by its repricings. The pages are downloaded lazily
+    once, by the first repricing needing them, and read from memory by the others.
+    """
+
+    def __init__(self, pages: Iterator[Offers]):
+        self._lock = threading.Lock()
+        self._pages: List[Offers] = []
+        self._remaining: Optional[Iterator[Offers]] = pages
+        self._fetched_at: float = time.monotonic()
+        self._error: Optional[Exception] = None
+
+    def iter_pages(self) -> Iterator[Offers]:
+        """ Yield the downloaded pages, then download the next ones """
+        index = 0
+        while True:
+            with self._lock:
+                if index == len(self._pages):
+                    if self._remaining is None:
+                        # Every repricing reading past the pages of a failed download fails
+                        if self._error is not None:
+                            raise self._error
+                        return
+                    try:
+                        self._pages.append(next(self._remaining))
+                    except StopIteration:
+                        self._remaining = None
+                        return
+                    except Exception as error:
+                        # The page iterator is closed by the error, the pages are incomplete
+                        self._remaining = None
+                        self._error = error
+                        raise
+                offers = self._pages[index]
+            index += 1
+            yield offers
+
+    # Class getters
+    @property
+    def fetched_at(self) -> float:
+        return self._fetched_at
+
+    @property
+    def failed(self) -> bool:
+        return self._error is not None
+
+
+class OfferCache:
+    """ Least recently used offer pages of the ASINs, fresh for ttl seconds """
+    DEFAULT_TTL: float = 60.0
+    DEFAULT_MAX_ASINS: int = 10000
+
+    def __init__(self, ttl: float = DEFAULT_TTL, max_asins: int = DEFAULT_MAX_ASINS):
+        self._ttl: float = ttl
+        self._max_asins: int = max_asins
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, CachedOffers]" = OrderedDict()
+
+    def get(self, asin: str, load: Callable[[], Iterator[Offers]]) -> Tuple[CachedOffers, bool]:
+        """ Return the offers of the ASIN and True if they are cached, or load them """
+        with self._lock:
+            entry = self._entries.get(asin)
+            if entry is not None and not entry.failed and \
+                    time.monotonic() - entry.fetched_at < self._ttl:
+                self._entries.move_to_end(asin)
+                return entry, True
+            entry = self._entries[asin] = CachedOffers(load())
+            self._entries.move_to_end(asin)
+            while len(self._entries) > self._max_asins:
+                self._entries.popitem(last=False)
+            return entry, False
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class RepricingService:
+    """ asyncio HTTP service repricing the ASINs with warm caches """
+    # Maximum (ASIN, condition) pairs of a batch request
+    MAX_BATCH: int = 100000
+    REASONS: Dict[int, str] = {200: "OK", 400: "Bad Request", 404: "Not Found",
+                               405: "Method Not Allowed", 413: "Payload Too Large",
+                               500: "Internal Server Error"}
+
+    def __init__(self, seller_name: str, target_rating: float, min_profit: float = 0.0,
+                 concurrency: int = 8, timeout: float = HttpClient.DEFAULT_TIMEOUT,
+                 parser_backend: str = URLParser.DEFAULT_BACKEND, targeted_parse: bool = False,
+                 parse_workers: int = 0,
+                 request_rate: float = RateLimiter.DEFAULT_RATE,
+                 max_request_rate: float = RateLimiter.DEFAULT_MAX_RATE,
+                 cache_file: Optional[str] = None, product_store_file: Optional[str] = None,
+                 offer_ttl: float = OfferCache.DEFAULT_TTL,
+                 max_cached_asins: int = OfferCache.DEFAULT_MAX_ASINS,
+                 url_parser: Optional[URLParser] = None):
+        self._seller_name: str = seller_name
+        self._target_rating: float = target_rating
+        self._min_profit: float = min_profit
+        self._concurrency: int = max(1, concurrency)
+        # One pooled client for the life of the service
+        if url_parser is None:
+            url_parser = Amazon.create_url_parser(
+                concurrency=self._concurrency, timeout=timeout, parser_backend=parser_backend,
+                targeted_parse=targeted_parse, parse_workers=parse_workers,
+                request_rate=request_rate, max_request_rate=max_request_rate,
+                cache_file=cache_file
+            )
+        self._url_parser: URLParser = url_parser
+        self._product_store: Optional[ProductStore] = \
+            ProductStore(product_store_file) if product_store_file is not None else None
+        self._products: Dict[str, Product] = {}
+        # Concurrent requests of a new ASIN download its product page once
+        self._product_flight: SingleFlight = SingleFlight()
+        self._offer_cache: OfferCache = OfferCache(ttl=offer_ttl, max_asins=max_cached_asins)
+        self._executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=self._concurrency)
+        self._metrics: Metrics = self._url_parser.client.metrics
+        # Path: (method, handler)
+        self._routes: Dict[str, Tuple[str, Callable]] = {
+            "/reprice": ("GET", self._handle_reprice),
+            "/batch": ("POST", self._handle_batch),
+            "/health": ("GET", self._handle_health),
+            "/metrics": ("GET", self._handle_metrics),
+        }
+
+    def reprice(self, asin: str, conditions: List[int]) \
+            -> Tuple[Dict[Condition, Tuple[float, float]], bool]:
+        """
+        Reprice the ASIN for every condition. Return the price and profit of every condition
+        and True if the offers were read from the cache.
+        """
+        product: Product = self._get_product(asin)
+        offers, cached = self._offer_cache.get(asin, lambda: ProductListingParser(
+            Amazon.LISTING_URL.format(asin), self._url_parser, keep_listings=False
+        ).iter_pages())
+        self._metrics.increment("offer_cache_requests_total", result="hit" if cached else "miss")
+        listings = (ProductListing(**offer) for page in offers.iter_pages() for offer in page)
+        repricer: Repricer = Repricer(product, listings)
+        repricer.rating_filter = self._target_rating
+        my_product_listing: ProductListing = ProductListing(seller=self._seller_name)
+        with self._metrics.time("reprice"):
+            prices = repricer.reprice_conditions(conditions, my_product_listing)
+        results = {
+            condition: (price, repricer.calculate_profit(price, my_product_listing.shipping))
+            for condition, price in prices.items()
+        }
+        return results, cached
+
+    def _get_product(self, asin: str) -> Product:
+        """ Product of the ASIN from memory, the product store or its product page """
+        product = self._products.get(asin)
+        if product is not None:
+            return product
+        return self._product_flight.do(asin, lambda: self._load_product(asin))
+
+    def _load_product(self, asin: str) -> Product:
+        product = self._product_store.get(asin) if self._product_store is not None else None
+        if product is None:
+            product = ProductParser(Amazon.PRODUCT_URL.format(asin), self._url_parser).parse()
+            if self._product_store is not None:
+                self._product_store.put(asin, product)
+        self._products[asin] = product
+        return product
+
+    def _get_results(self, asin: str, conditions: List[int]) -> List[Result]:
+        """ JSON results of the conditions of the ASIN, or an error result per condition """
+        try:
+            prices, cached = self.reprice(asin, conditions)
+        except Exception as error:
+            self._metrics.increment("asin_failures_total", error=type(error).__name__)
+            return [{"asin": asin, "condition": condition,
+                     "error": f"{type(error).__name__}: {error}"} for condition in conditions]
+        self._metrics.increment("asins_total")
+        results: List[Result] = []
+        for condition in conditions:
+            price, profit = prices[Condition(condition)]
+            results.append({"asin": asin, "condition": condition, "price": round(price, 2),
+                            "profit": round(profit, 2), "listed": profit > self._min_profit,
+                            "cached": cached})
+        return results
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8080) -> asyncio.AbstractServer:
+        """ Start accepting the connections, port 0 picks a free port """
+        return await asyncio.start_server(self._handle_connection, host, port)
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8080) -> None:
+        """ Serve the requests until the task is cancelled """
+        server = await self.start(host, port)
+        async with server:
+            await server.serve_forever()
+
+    def run(self, host: str = "127.0.0.1", port: int = 8080) -> None:
+        """ Entry function. Serve the requests until SIGINT or SIGTERM. """
+
+        async def main():
+            task = asyncio.current_task()
+            loop = asyncio.get_running_loop()
+            for signal_number in (signal.SIGINT, signal.SIGTERM):
+                loop.add_signal_handler(signal_number, task.cancel)
+            print(f"Repricing service listening on http://{host}:{port}")
+            try:
+                await self.serve(host, port)
+            except asyncio.CancelledError:
+                pass
+
+        try:
+            asyncio.run(main())
+        finally:
+            self.close()
+        print("Repricing service stopped")
+
+    def close(self) -> None:
+        """ Stop the thread pool and close the HTTP client """
+        self._executor.shutdown(wait=True)
+        self._url_parser.close()
+        if self._product_store is not None:
+            self._product_store.close()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader,
+                                 writer: asyncio.StreamWriter) -> None:
+        """ Answer the HTTP/1.1 requests of a keep alive connection """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers: Dict[str, str] = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                    body = await reader.readexactly(int(headers.get("content-length", 0)))
+                except ValueError:
+                    await self._send(writer, 400, {"error": "Malformed request"}, keep_alive=False)
+                    break
+                keep_alive = version == "HTTP/1.1" and \
+                    headers.get("connection", "").lower() != "close"
+                await self._dispatch(method, target, body, writer, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method: str, target: str, body: bytes,
+                        writer: asyncio.StreamWriter, keep_alive: bool) -> None:
+        url = urlsplit(target)
+        routes = self._routes
+        start = time.perf_counter()
+        status = 200
+        try:
+            if url.path not in routes:
+                raise ServiceError(404, f"Unknown path {url.path}")
+            route_method, handler = routes[url.path]
+            if method != route_method:
+                raise ServiceError(405, f"{url.path} only accepts {route_method}")
+            await handler(parse_qs(url.query), body, writer, keep_alive)
+        except ServiceError as error:
+            status = error.status
+            await self._send(writer, status, {"error": str(error)}, keep_alive)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            raise
+        except Exception as error:
+            status = 500
+            await self._send(writer, status, {"error": f"{type(error).__name__}: {error}"},
+                             keep_alive)
+        finally:
+            endpoint = url.path if url.path in routes else "other"
+            self._metrics.increment("service_requests_total", endpoint=endpoint,
+                                    status=str(status))
+            self._metrics.observe("service_request_seconds", time.perf_counter() - start,
+                                  endpoint=endpoint)
+
+    async def _handle_reprice(self, query: Dict[str, List[str]], body: bytes,
+                              writer: asyncio.StreamWriter, keep_alive: bool) -> None:
+        asin = query.get("asin", [None])[0]
+        if not asin or "condition" not in query:
+            raise ServiceError(400, "asin and condition are required")
+        conditions = [self._parse_condition(condition) for condition in query["condition"]]
+        results = await asyncio.get_running_loop().run_in_executor(
+            self._executor, self._get_results, asin, conditions
+        )
+        await self._send(writer, 200, results, keep_alive)
+
+    async def _handle_batch(self, query: Dict[str, List[str]], body: bytes,
+                            writer: asyncio.StreamWriter, keep_alive: bool) -> None:
+        groups = self._parse_batch(body)
+        loop = asyncio.get_running_loop()
+        futures = [loop.run_in_executor(self._executor, self._get_results, asin, conditions)
+                   for asin, conditions in groups.items()]
+        writer.write(self._get_head(200, "application/x-ndjson", keep_alive,
+                                    ("Transfer-Encoding", "chunked")))
+        try:
+            for future in asyncio.as_completed(futures):
+                chunk = "".join(f"{json.dumps(result)}\n" for result in await future).encode()
+                writer.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+                await writer.drain()
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+        except ConnectionError:
+            # The client is gone, the queued ASINs are not repriced
+            for future in futures:
+                future.cancel()
+            raise
+
+    async def _handle_health(self, query: Dict[str, List[str]], body: bytes,
+                             writer: asyncio.StreamWriter, keep_alive: bool) -> None:
+        await self._send(writer, 200, {"status": "ok", "products": len(self._products),
+                                       "offer_pages": len(self._offer_cache)}, keep_alive)
+
+    async def _handle_metrics(self, query: Dict[str, List[str]], body: bytes,
+                              writer: asyncio.StreamWriter, keep_alive: bool) -> None:
+        payload = self._metrics.render().encode()
+        writer.write(self._get_head(200, "text/plain; version=0.0.4", keep_alive,
+                                    ("Content-Length", str(len(payload)))) + payload)
+        await writer.drain()
+
+    def _parse_batch(self, body: bytes) -> Dict[str, List[int]]:
+        """ Conditions of every ASIN of a batch body, a JSON array or JSON lines """
+        try:
+            text = body.decode()
+            items = json.loads(text) if text.lstrip().startswith("[") else \
+                [json.loads(line) for line in text.splitlines() if line.strip()]
+            pairs = [(str(item["asin"]), item["condition"]) for item in items]
+        except (ValueError, TypeError, KeyError) as error:
+            raise ServiceError(400, f"Invalid batch: {error}")
+        if len(pairs) > RepricingService.MAX_BATCH:
+            raise ServiceError(413, f"More than {RepricingService.MAX_BATCH} pairs in the batch")
+        groups: Dict[str, List[int]] = {}
+        for asin, condition in pairs:
+            groups.setdefault(asin, []).append(self._parse_condition(condition))
+        return groups
+
+    @staticmethod
+    def _parse_condition(condition: Any) -> int:
+        try:
+            return Condition(int(condition)).value
+        except (ValueError, TypeError):
+            raise ServiceError(400, f"Invalid condition {condition!r}")
+
+    @staticmethod
+    def _get_head(status: int, content_type: str, keep_alive: bool,
+                  *headers: Tuple[str, str]) -> bytes:
+        lines = [f"HTTP/1.1 {status} {RepricingService.REASONS[status]}",
+                 f"Content-Type: {content_type}",
+                 f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+        lines.extend(f"{name}: {value}" for name, value in headers)
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+    async def _send(self, writer: asyncio.StreamWriter, status: int, payload: Any,
+                    keep_alive: bool) -> None:
+        """ Send a JSON response """
+        data = json.dumps(payload).encode()
+        writer.write(self._get_head(status, "application/json", keep_alive,
+                                    ("Content-Length", str(len(data)))) + data)
+        await writer.drain()
+
+    # Class getters
+    @property
+    def metrics(self) -> Metrics:
+        return self._metrics
+
+    @property
+    def offer_cache(self) -> OfferCache:
+        return self._offer_cache
@@ -0,0 +1,161 @@
+"""
+File:           sharding.py
+Author:         Dibyaranjan Sathua
+Created on:     23/10/26, 11:00 AM
+
+Sharded batch mode. The input lines are split by a stable hash of the ASIN into K shards, so
+every shard can be processed independently by its own process, or on another machine sharing
+the shard directory. Every shard keeps its own HTTP client and rate limiter. The results of a
+shard are its journal, and merging the journals in the input order gives the same output file
+as a single Amazon run.
+"""
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import multiprocessing
+import os
+import zlib
+
+from src.amazon import Amazon
+from src.condition import Condition
+from src.journal import Journal, JournalEntry
+
+
+def shard_of(asin: str, shards: int) -> int:
+    """ Shard of the ASIN. crc32 is stable between processes and machines unlike hash(). """
+    return zlib.crc32(asin.encode()) % shards
+
+
+def _run_shard(input_file: str, journal_file: str, amazon_options: Dict[str, Any]) -> None:
+    """ Process entry of a shard """
+    Amazon(input_file=input_file, journal_file=journal_file, keep_journal=True,
+           **amazon_options).run()
+
+
+class ShardedRun:
+    """ Split the input into shards, run the shards and merge their results """
+
+    def __init__(self, input_file: str, shards: int, shard_dir: Optional[str] = None,
+                 **amazon_options: Any):
+        if shards < 1:
+            raise ValueError(f"Number of shards must be at least 1, got {shards}")
+        self._input_file: str = os.path.abspath(input_file)
+        self._shards: int = shards
+        name, _ = os.path.splitext(self._input_file)
+        self._shard_dir: str = os.path.abspath(shard_dir) if shard_dir is not None \
+            else f"{name}_shards"
+        # Options of the Amazon instance of every shard, e.g. seller_name and request_rate
+        self._amazon_options: Dict[str, Any] = amazon_options
+
+    def run(self) -> None:
+        """ Run all the shards in parallel local processes and merge their results """
+        self.split()
+        context = multiprocessing.get_context("spawn")
+        processes: List[multiprocessing.Process] = []
+        for shard in range(self._shards):
+            process = context.Process(target=_run_shard, args=self._shard_args(shard),
+                                      name=f"shard-{shard}")
+            process.start()
+            processes.append(process)
+        for process in processes:
+            process.join()
+        failed = [process.name for process in processes if process.exitcode != 0]
+        if failed:
+            print(f"Shards {', '.join(failed)} exited with an error, their completed ASINs are "
+                  f"merged and the others are reported as failed")
+        self.merge()
+
+    def run_shard(self, shard: int) -> None:
+        """ Run a single shard in this process, e.g. on one of the machines of the batch """
+        self.split(shard)
+        _run_shard(*self._shard_args(shard))
+
+    def merge(self) -> None:
+        """
+        Merge the journals of the shards into the output file of the input, in the input order.
+        Lines of the ASINs not in any journal are reported as failed.
+        """
+        completed: Dict[str, JournalEntry] = {}
+        for shard in range(self._shards):
+            completed.update(Journal(self._get_journal_file(shard)).load())
+
+        min_profit: float = self._amazon_options.get("min_profit", 0.0)
+        unprofitable: List[str] = []
+        failed: List[str] = []
+        output_file = Amazon._get_output_file(self._input_file)
+        with open(output_file, mode="w") as output_file:
+            for asin, condition in self._read_input():
+                entry: Optional[JournalEntry] = completed.get(asin)
+                if entry is None or Condition(condition) not in entry[1]:
+                    failed.append(f"{asin} {condition}")
+                    continue
+                product, results = entry
+                price, profit = results[Condition(condition)]
+                if profit > min_profit:
+                    output_file.write(f"{product}\n")
+                    output_file.write(f"{price:.2f}\n\n")
+                else:
+                    unprofitable.append(str(product))
+
+        print(f"Merged {self._shards} shards into {Amazon._get_output_file(self._input_file)}")
+        if unprofitable:
+            print(f"These products did not meet the ${min_profit:.2f} minimum profit")
+            for element in unprofitable:
+                print(element)
+        if failed:
+            print("These lines failed or their shard didn't complete")
+            for element in failed:
+                print(element)
+        else:
+            # A complete merge doesn't need the journals to resume the shards
+            for shard in range(self._shards):
+                Journal(self._get_journal_file(shard)).remove()
+
+    def split(self, shard: Optional[int] = None) -> None:
+        """ Write the input file of every shard, or only of the shard """
+        os.makedirs(self._shard_dir, exist_ok=True)
+        shards = range(self._shards) if shard is None else (shard, )
+        shard_files = {index: open(self._get_input_file(index), mode="w") for index in shards}
+        try:
+            for asin, condition in self._read_input():
+                shard_file = shard_files.get(shard_of(asin, self._shards))
+                if shard_file is not None:
+                    shard_file.write(f"{asin} {condition}\n")
+        finally:
+            for shard_file in shard_files.values():
+                shard_file.close()
+
+    def _shard_args(self, shard: int) -> Tuple[str, str, Dict[str, Any]]:
+        """ Return the _run_shard arguments of the shard """
+        options = dict(self._amazon_options)
+        # Every shard has its own metrics and one port can't be shared
+        options.pop("metrics_port", None)
+        if options.get("metrics_file") is not None:
+            name, ext = os.path.splitext(options["metrics_file"])
+            options["metrics_file"] = f"{name}_{self._get_shard_name(shard)}{ext}"
+        return self._get_input_file(shard), self._get_journal_file(shard), options
+
+    def _read_input(self) -> Iterator[Tuple[str, int]]:
+        """ Yield the ASIN and condition of every line of the input file """
+        with open(self._input_file, mode="r") as infile:
+            for line in infile:
+                line_values = line.strip().split()
+                if not line_values:
+                    continue
+                yield line_values[0], int(line_values[1])
+
+    def _get_shard_name(self, shard: int) -> str:
+        return f"shard-{shard:03d}-of-{self._shards:03d}"
+
+    def _get_input_file(self, shard: int) -> str:
+        return os.path.join(self._shard_dir, f"{self._get_shard_name(shard)}.txt")
+
+    def _get_journal_file(self, shard: int) -> str:
+        return os.path.join(self._shard_dir, f"{self._get_shard_name(shard)}_journal.jsonl")
+
+    # Class getters
+    @property
+    def shards(self) -> int:
+        return self._shards
+
+    @property
+    def shard_dir(self) -> str:
+        return self._shard_dir
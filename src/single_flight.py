@@ -0,0 +1,49 @@
+"""
+File:           single_flight.py
+Author:         Dibyaranjan Sathua
+Created on:     21/10/26, 2:00 PM
+
+Coalesce concurrent calls with the same key: the first caller runs the function and the callers
+arriving while it runs wait for and share its result.
+"""
+from typing import Any, Callable, Dict, Hashable
+from concurrent.futures import Future
+import threading
+
+
+class SingleFlight:
+    """ Thread safe duplicate call suppression """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, Future] = {}
+        self._coalesced: int = 0
+
+    def do(self, key: Hashable, function: Callable[[], Any]) -> Any:
+        """ Run the function unless a call with the same key is in flight, then share its result """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+            else:
+                self._coalesced += 1
+        if not leader:
+            return future.result()
+
+        try:
+            result = function()
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    @property
+    def coalesced(self) -> int:
+        """ Number of calls which shared the result of an in flight call """
+        return self._coalesced
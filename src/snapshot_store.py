@@ -0,0 +1,520 @@
+"""
+File:           snapshot_store.py
+Author:         Dibyaranjan Sathua
+Created on:     25/10/26, 10:10 AM
+
+Historical store of the offers read to reprice every ASIN, so that the repricing settings can
+be backtested over months of offers without downloading them again. Snapshots are appended
+to an in-memory buffer of columns and written as immutable segment files: a JSON header with
+the ASIN and seller dictionaries followed by one array per column. A SQLite index maps every
+ASIN and timestamp to its segment, and keeps the latest snapshot of every ASIN. Old segments
+are merged by compact(), which also drops the snapshots repeating the previous offers.
+"""
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+from array import array
+import glob
+import json
+import mmap
+import os
+import sqlite3
+import struct
+import sys
+import threading
+import time
+import uuid
+
+from src.product_listing import CONDITIONS, ProductListing
+
+MAGIC: bytes = b"RPSNAP01"
+# Column name and array typecode. The snapshot columns have a row per snapshot and the offer
+# columns a row per offer, the offers of a snapshot are rows first_row to first_row + rows.
+SNAPSHOT_COLUMNS: Tuple[Tuple[str, str], ...] = (
+    ("asin", "I"), ("timestamp", "d"), ("first_row", "Q"), ("rows", "I"), ("complete", "B"),
+)
+OFFER_COLUMNS: Tuple[Tuple[str, str], ...] = (
+    ("seller", "I"), ("price", "d"), ("shipping", "d"), ("rating", "B"), ("total_ratings", "I"),
+    ("condition", "B"),
+)
+
+
+def _align(size: int, alignment: int = 8) -> int:
+    """ Size rounded up to the alignment of the columns """
+    return -(-size // alignment) * alignment
+
+
+class Snapshot(NamedTuple):
+    """
+    Offers of an ASIN at a time, one list per offer field. The repricer stops reading the
+    listing pages once it has its prices, complete is False when the offers end before the
+    last page of the listing.
+    """
+    asin: str
+    timestamp: float
+    sellers: List[str]
+    price: List[float]
+    shipping: List[float]
+    rating: List[int]
+    total_ratings: List[int]
+    condition: List[int]
+    complete: bool = True
+
+    @classmethod
+    def from_listings(cls, asin: str, timestamp: float, listings: Iterable[ProductListing],
+                      complete: bool = True) -> "Snapshot":
+        listings = list(listings)
+        return cls(
+            asin=asin,
+            timestamp=timestamp,
+            sellers=[listing.seller for listing in listings],
+            price=[listing.price for listing in listings],
+            shipping=[listing.shipping for listing in listings],
+            rating=[listing.rating for listing in listings],
+            total_ratings=[listing.total_ratings for listing in listings],
+            condition=[listing.condition.value for listing in listings],
+            complete=complete
+        )
+
+    def listings(self) -> List[ProductListing]:
+        """ Product listings of the offers, e.g. for a Repricer """
+        return [
+            ProductListing(seller=seller, price=price, rating=rating, total_ratings=total_ratings,
+                           condition=CONDITIONS[condition], shipping=shipping)
+            for seller, price, shipping, rating, total_ratings, condition in zip(
+                self.sellers, self.price, self.shipping, self.rating, self.total_ratings,
+                self.condition
+            )
+        ]
+
+    def same_offers(self, other: "Snapshot") -> bool:
+        """ True if both snapshots have the same offers, whatever their time """
+        return self[2:] == other[2:]
+
+
+class SegmentWriter:
+    """ Snapshots buffered in columns until they are written as a segment file """
+
+    def __init__(self):
+        self._asins: Dict[str, int] = {}
+        self._asin_names: List[str] = []
+        self._sellers: Dict[str, int] = {}
+        self._seller_names: List[str] = []
+        self._columns: Dict[str, array] = {
+            name: array(typecode) for name, typecode in SNAPSHOT_COLUMNS + OFFER_COLUMNS
+        }
+        # Positions of the snapshots of every ASIN, to query the buffered snapshots
+        self._positions: Dict[str, List[int]] = {}
+        self._created_at: float = time.monotonic()
+
+    def append(self, snapshot: Snapshot) -> None:
+        columns = self._columns
+        asin = self._asins.get(snapshot.asin)
+        if asin is None:
+            asin = self._asins[snapshot.asin] = len(self._asin_names)
+            self._asin_names.append(snapshot.asin)
+        self._positions.setdefault(snapshot.asin, []).append(len(columns["asin"]))
+        columns["asin"].append(asin)
+        columns["timestamp"].append(snapshot.timestamp)
+        columns["first_row"].append(len(columns["price"]))
+        columns["rows"].append(len(snapshot.price))
+        columns["complete"].append(snapshot.complete)
+        for seller in snapshot.sellers:
+            seller_id = self._sellers.get(seller)
+            if seller_id is None:
+                seller_id = self._sellers[seller] = len(self._seller_names)
+                self._seller_names.append(seller)
+            columns["seller"].append(seller_id)
+        columns["price"].extend(snapshot.price)
+        columns["shipping"].extend(snapshot.shipping)
+        columns["rating"].extend(snapshot.rating)
+        columns["total_ratings"].extend(snapshot.total_ratings)
+        columns["condition"].extend(snapshot.condition)
+
+    def snapshot(self, position: int) -> Snapshot:
+        columns = self._columns
+        first = columns["first_row"][position]
+        last = first + columns["rows"][position]
+        return Snapshot(
+            asin=self._asin_names[columns["asin"][position]],
+            timestamp=columns["timestamp"][position],
+            sellers=[self._seller_names[seller] for seller in columns["seller"][first:last]],
+            price=columns["price"][first:last].tolist(),
+            shipping=columns["shipping"][first:last].tolist(),
+            rating=columns["rating"][first:last].tolist(),
+            total_ratings=columns["total_ratings"][first:last].tolist(),
+            condition=columns["condition"][first:last].tolist(),
+            complete=bool(columns["complete"][position])
+        )
+
+    def positions(self, asin: str) -> List[int]:
+        return self._positions.get(asin, [])
+
+    def write(self, path: str, replaces: Sequence[str] = ()) -> None:
+        """ Atomically write the segment file. replaces are the segments merged into it. """
+        offsets: Dict[str, Tuple[str, int]] = {}
+        offset = 0
+        for name, typecode in SNAPSHOT_COLUMNS + OFFER_COLUMNS:
+            offsets[name] = (typecode, offset)
+            offset += _align(len(self._columns[name]) * self._columns[name].itemsize)
+        header = json.dumps({
+            "byteorder": sys.byteorder,
+            "snapshots": self.snapshots,
+            "rows": self.rows,
+            "asins": self._asin_names,
+            "sellers": self._seller_names,
+            "columns": offsets,
+            "replaces": list(replaces),
+        }).encode()
+        temp_file = f"{path}.tmp"
+        with open(temp_file, mode="wb") as segment_file:
+            segment_file.write(MAGIC + struct.pack("<Q", len(header)) + header)
+            segment_file.write(bytes(_align(segment_file.tell()) - segment_file.tell()))
+            for name, _ in SNAPSHOT_COLUMNS + OFFER_COLUMNS:
+                data = self._columns[name].tobytes()
+                segment_file.write(data + bytes(_align(len(data)) - len(data)))
+            segment_file.flush()
+            os.fsync(segment_file.fileno())
+        os.replace(temp_file, path)
+
+    @property
+    def snapshots(self) -> int:
+        return len(self._columns["asin"])
+
+    @property
+    def rows(self) -> int:
+        return len(self._columns["price"])
+
+    @property
+    def created_at(self) -> float:
+        return self._created_at
+
+    @property
+    def asins(self) -> List[str]:
+        return list(self._positions)
+
+
+class Segment:
+    """ Segment file mapped in memory. The offer columns are only read for the queried rows. """
+
+    def __init__(self, path: str):
+        self._path: str = path
+        with open(path, mode="rb") as segment_file:
+            if segment_file.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a snapshot segment")
+            header_size, = struct.unpack("<Q", segment_file.read(8))
+            header = json.loads(segment_file.read(header_size))
+            self._mmap = mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._base: int = _align(len(MAGIC) + 8 + header_size)
+        self._swap: bool = header["byteorder"] != sys.byteorder
+        self._columns: Dict[str, Tuple[str, int]] = header["columns"]
+        self._asins: List[str] = header["asins"]
+        self._sellers: List[str] = header["sellers"]
+        self._replaces: List[str] = header["replaces"]
+        # The snapshot columns are small and read by every query
+        self._snapshot_columns: Dict[str, array] = {
+            name: self._read(name, 0, header["snapshots"]) for name, _ in SNAPSHOT_COLUMNS
+            if name in self._columns
+        }
+        if "complete" not in self._snapshot_columns:
+            # Segments written before the column only have the offers read by the repricer
+            self._snapshot_columns["complete"] = array("B", bytes(header["snapshots"]))
+
+    def _read(self, name: str, start: int, stop: int) -> array:
+        typecode, offset = self._columns[name]
+        values = array(typecode)
+        offset += self._base
+        values.frombytes(self._mmap[offset + start * values.itemsize:
+                                    offset + stop * values.itemsize])
+        if self._swap:
+            values.byteswap()
+        return values
+
+    def snapshot(self, position: int) -> Snapshot:
+        first = self._snapshot_columns["first_row"][position]
+        last = first + self._snapshot_columns["rows"][position]
+        return Snapshot(
+            asin=self._asins[self._snapshot_columns["asin"][position]],
+            timestamp=self._snapshot_columns["timestamp"][position],
+            sellers=[self._sellers[seller] for seller in self._read("seller", first, last)],
+            price=self._read("price", first, last).tolist(),
+            shipping=self._read("shipping", first, last).tolist(),
+            rating=self._read("rating", first, last).tolist(),
+            total_ratings=self._read("total_ratings", first, last).tolist(),
+            condition=self._read("condition", first, last).tolist(),
+            complete=bool(self._snapshot_columns["complete"][position])
+        )
+
+    def index_rows(self) -> List[Tuple[str, float, int]]:
+        """ (ASIN, timestamp, position) of every snapshot """
+        return [(self._asins[asin], timestamp, position) for position, (asin, timestamp) in
+                enumerate(zip(self._snapshot_columns["asin"],
+                              self._snapshot_columns["timestamp"]))]
+
+    def close(self) -> None:
+        self._mmap.close()
+
+    @property
+    def snapshots(self) -> int:
+        return len(self._snapshot_columns["asin"])
+
+    @property
+    def replaces(self) -> List[str]:
+        return self._replaces
+
+
+class SnapshotStore:
+    """ Append-only columnar store of the offer snapshots of every ASIN """
+    # Offers buffered before they are written as a segment
+    DEFAULT_SEGMENT_ROWS: int = 65536
+    # Maximum seconds a snapshot stays in the buffer, e.g. in a daemon polling a few ASINs
+    DEFAULT_MAX_BUFFER_AGE: float = 300.0
+
+    def __init__(self, directory: str, segment_rows: int = DEFAULT_SEGMENT_ROWS,
+                 max_buffer_age: float = DEFAULT_MAX_BUFFER_AGE):
+        self._directory: str = os.path.abspath(directory)
+        self._segment_rows: int = segment_rows
+        self._max_buffer_age: float = max_buffer_age
+        os.makedirs(self._directory, exist_ok=True)
+        self._lock = threading.RLock()
+        self._writer: SegmentWriter = SegmentWriter()
+        self._segments: Dict[str, Segment] = {}
+        # Several processes, e.g. the shards of a batch, can share the directory
+        self._connection = sqlite3.connect(os.path.join(self._directory, "index.db"),
+                                           timeout=60.0, check_same_thread=False)
+        self._connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS segments (
+                id INTEGER PRIMARY KEY,
+                name TEXT UNIQUE NOT NULL,
+                snapshots INTEGER NOT NULL,
+                min_timestamp REAL NOT NULL,
+                max_timestamp REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS snapshots (
+                asin TEXT NOT NULL,
+                timestamp REAL NOT NULL,
+                segment INTEGER NOT NULL,
+                position INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS snapshots_asin_timestamp ON snapshots (asin, timestamp);
+            CREATE INDEX IF NOT EXISTS snapshots_segment ON snapshots (segment);
+            CREATE TABLE IF NOT EXISTS latest (
+                asin TEXT PRIMARY KEY,
+                timestamp REAL NOT NULL,
+                segment INTEGER NOT NULL,
+                position INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS replaced (
+                name TEXT PRIMARY KEY
+            );
+            """
+        )
+        self._recover()
+
+    def record(self, asin: str, listings: Iterable[ProductListing],
+               timestamp: Optional[float] = None, complete: bool = True) -> None:
+        """
+        Append a snapshot of the listings of the ASIN, taken now by default. complete is False
+        when the listings are only the first pages of the offer listing.
+        """
+        snapshot = Snapshot.from_listings(asin, time.time() if timestamp is None else timestamp,
+                                          listings, complete)
+        with self._lock:
+            self._writer.append(snapshot)
+            if self._writer.rows >= self._segment_rows or \
+                    time.monotonic() - self._writer.created_at >= self._max_buffer_age:
+                self.flush()
+
+    def query(self, asin: str, start: Optional[float] = None,
+              end: Optional[float] = None) -> List[Snapshot]:
+        """ Snapshots of the ASIN taken between start and end included, oldest first """
+        start = -sys.float_info.max if start is None else start
+        end = sys.float_info.max if end is None else end
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT segments.name, snapshots.position FROM snapshots "
+                "JOIN segments ON segments.id = snapshots.segment "
+                "WHERE snapshots.asin = ? AND snapshots.timestamp BETWEEN ? AND ? "
+                "ORDER BY snapshots.timestamp",
+                (asin, start, end)
+            ).fetchall()
+            snapshots = [self._get_segment(name).snapshot(position) for name, position in rows]
+            buffered = [self._writer.snapshot(position)
+                        for position in self._writer.positions(asin)]
+        snapshots.extend(snapshot for snapshot in buffered if start <= snapshot.timestamp <= end)
+        snapshots.sort(key=lambda snapshot: snapshot.timestamp)
+        return snapshots
+
+    def latest(self, asins: Optional[Iterable[str]] = None) -> Dict[str, Snapshot]:
+        """ Latest snapshot of the ASINs, of all the ASINs by default """
+        query = "SELECT latest.asin, segments.name, latest.position FROM latest " \
+                "JOIN segments ON segments.id = latest.segment"
+        parameters: Tuple = ()
+        if asins is not None:
+            asins = list(asins)
+            query += " WHERE latest.asin IN (SELECT value FROM json_each(?))"
+            parameters = (json.dumps(asins), )
+        with self._lock:
+            # Read in the segment order for sequential reads
+            rows = self._connection.execute(
+                f"{query} ORDER BY latest.segment, latest.position", parameters
+            ).fetchall()
+            latest = {asin: self._get_segment(name).snapshot(position)
+                      for asin, name, position in rows}
+            for asin in (self._writer.asins if asins is None else asins):
+                positions = self._writer.positions(asin)
+                if positions:
+                    snapshot = self._writer.snapshot(positions[-1])
+                    if asin not in latest or snapshot.timestamp >= latest[asin].timestamp:
+                        latest[asin] = snapshot
+        return latest
+
+    def asins(self) -> List[str]:
+        """ ASINs with at least one snapshot """
+        with self._lock:
+            asins = {asin for asin, in self._connection.execute("SELECT asin FROM latest")}
+            asins.update(self._writer.asins)
+        return sorted(asins)
+
+    def flush(self) -> None:
+        """ Write the buffered snapshots as a new segment """
+        with self._lock:
+            if not self._writer.snapshots:
+                return
+            name = f"segment-{uuid.uuid4().hex}.snap"
+            self._writer.write(os.path.join(self._directory, name))
+            self._writer = SegmentWriter()
+            self._index_segment(name)
+
+    def compact(self, before: Optional[float] = None) -> int:
+        """
+        Merge the segments whose snapshots are all older than before, all the segments by
+        default, into one segment sorted by ASIN and time. A snapshot with the same offers as
+        the previous snapshot of its ASIN is dropped, except the last snapshot of every ASIN,
+        as the offers of a snapshot hold until the next snapshot. Return the number of
+        dropped snapshots. Only one process should compact the store at a time.
+        """
+        before = sys.float_info.max if before is None else before
+        with self._lock:
+            self.flush()
+            segments = [name for name, in self._connection.execute(
+                "SELECT name FROM segments WHERE max_timestamp < ? ORDER BY id", (before, )
+            )]
+            if len(segments) < 2:
+                return 0
+            rows = self._connection.execute(
+                "SELECT snapshots.asin, segments.name, snapshots.position FROM snapshots "
+                "JOIN segments ON segments.id = snapshots.segment "
+                "WHERE segments.max_timestamp < ? ORDER BY snapshots.asin, snapshots.timestamp",
+                (before, )
+            ).fetchall()
+
+            writer = SegmentWriter()
+            dropped = 0
+            previous: Optional[Snapshot] = None
+            for index, (asin, name, position) in enumerate(rows):
+                snapshot = self._get_segment(name).snapshot(position)
+                last = index + 1 == len(rows) or rows[index + 1][0] != asin
+                if previous is not None and previous.asin == asin and not last and \
+                        snapshot.same_offers(previous):
+                    dropped += 1
+                    continue
+                writer.append(snapshot)
+                previous = snapshot
+
+            name = f"segment-{uuid.uuid4().hex}.snap"
+            writer.write(os.path.join(self._directory, name), replaces=segments)
+            self._index_segment(name)
+        return dropped
+
+    def close(self) -> None:
+        """ Write the buffered snapshots and close the store """
+        with self._lock:
+            self.flush()
+            for segment in self._segments.values():
+                segment.close()
+            self._segments.clear()
+            self._connection.close()
+
+    def _index_segment(self, name: str) -> None:
+        """
+        Add the snapshots of a segment file to the index and remove the segments it replaces,
+        in one transaction. Indexing a segment twice, e.g. by two processes, is a no-op.
+        """
+        segment = self._get_segment(name)
+        index_rows = segment.index_rows()
+        timestamps = [timestamp for _, timestamp, _ in index_rows]
+        with self._connection:
+            cursor = self._connection.execute(
+                "INSERT OR IGNORE INTO segments (name, snapshots, min_timestamp, max_timestamp) "
+                "VALUES (?, ?, ?, ?)", (name, segment.snapshots, min(timestamps), max(timestamps))
+            )
+            if not cursor.rowcount:
+                return
+            segment_id = cursor.lastrowid
+            replaced = json.dumps(segment.replaces)
+            self._connection.execute(
+                "INSERT OR IGNORE INTO replaced (name) SELECT value FROM json_each(?)",
+                (replaced, )
+            )
+            for table in ("snapshots", "latest"):
+                self._connection.execute(
+                    f"DELETE FROM {table} WHERE segment IN (SELECT id FROM segments "
+                    f"WHERE name IN (SELECT value FROM json_each(?)))", (replaced, )
+                )
+            self._connection.execute(
+                "DELETE FROM segments WHERE name IN (SELECT value FROM json_each(?))", (replaced, )
+            )
+            self._connection.executemany(
+                "INSERT INTO snapshots (asin, timestamp, segment, position) VALUES (?, ?, ?, ?)",
+                [(asin, timestamp, segment_id, position)
+                 for asin, timestamp, position in index_rows]
+            )
+            self._connection.executemany(
+                "INSERT INTO latest (asin, timestamp, segment, position) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (asin) DO UPDATE SET timestamp = excluded.timestamp, "
+                "segment = excluded.segment, position = excluded.position "
+                "WHERE excluded.timestamp >= latest.timestamp",
+                [(asin, timestamp, segment_id, position)
+                 for asin, timestamp, position in index_rows]
+            )
+        for replaced_name in segment.replaces:
+            self._remove_segment(replaced_name)
+
+    def _recover(self) -> None:
+        """
+        Index the segment files written by a process stopped before indexing them and remove
+        the files of the segments replaced by a compaction
+        """
+        indexed = {name for name, in self._connection.execute("SELECT name FROM segments")}
+        replaced = {name for name, in self._connection.execute("SELECT name FROM replaced")}
+        for path in sorted(glob.glob(os.path.join(self._directory, "segment-*.snap")),
+                           key=os.path.getmtime):
+            name = os.path.basename(path)
+            if name in replaced:
+                self._remove_segment(name)
+            elif name not in indexed:
+                self._index_segment(name)
+
+    def _get_segment(self, name: str) -> Segment:
+        segment = self._segments.get(name)
+        if segment is None:
+            segment = self._segments[name] = Segment(os.path.join(self._directory, name))
+        return segment
+
+    def _remove_segment(self, name: str) -> None:
+        segment = self._segments.pop(name, None)
+        if segment is not None:
+            segment.close()
+        path = os.path.join(self._directory, name)
+        if os.path.exists(path):
+            os.remove(path)
+
+    # Class getters
+    @property
+    def directory(self) -> str:
+        return self._directory
+
+    @property
+    def segments(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM segments").fetchone()[0]
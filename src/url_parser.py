@@ -5,41 +5,140 @@ Created on:     06/09/20, 4:36 PM
 
 Code to except an URL and send http get request and return beautifulsoup object.
 """
-from typing import Dict, Optional
+from typing import Any, Callable, Dict, Optional, Tuple, TypeVar
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import time
 
-import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 from bs4.element import Tag
 
+from src.http_client import HttpClient
+
+T = TypeVar("T")
+
+
+def _extract_in_worker(content: bytes, backend: str, targeted: bool,
+                       parse_only: Optional[SoupStrainer], extractor: Callable[..., T],
+                       args: Tuple) -> Tuple[T, float, float]:
+    """
+    Build the soup and run the extractor in a parse worker process. Return the result with
+    the parse and extract durations.
+    """
+    start = time.perf_counter()
+    soup = URLParser.build_soup(content, backend, targeted, parse_only)
+    parsed = time.perf_counter()
+    result = extractor(soup, *args)
+    return result, parsed - start, time.perf_counter() - parsed
+
 
 class URLParser:
     """ Parse URL and return the BeautifulSoup object """
+    # lxml is the fastest backend but it is an optional dependency
+    BACKENDS: Tuple[str, ...] = ("html5lib", "lxml", "html.parser")
+    DEFAULT_BACKEND: str = "html5lib"
 
-    def __init__(self):
-        self._session: requests.Session = requests.Session()
-        self._default_header: Dict = {
-            "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.9",
-            "Accept-Encoding": "gzip, deflate, br",
-            "Accept-Language": "en-IN,en;q=0.9,hi-IN;q=0.8,hi;q=0.7,en-GB;q=0.6,en-US;q=0.5",
-            "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/85.0.4183.83 Safari/537.36"
-        }
+    def __init__(self, client: Optional[HttpClient] = None, backend: str = DEFAULT_BACKEND,
+                 targeted: bool = False, workers: int = 0):
+        if backend not in URLParser.BACKENDS:
+            raise ValueError(f"Unknown parser backend {backend}. "
+                             f"Choose one of {', '.join(URLParser.BACKENDS)}")
+        # Share the same client between parsers to reuse the pooled connections
+        self._client: HttpClient = client if client is not None else HttpClient()
+        self._backend: str = backend
+        self._targeted: bool = targeted
+        self._workers: int = workers
+        # Building the soup holds the GIL, so with workers the pages are parsed in a process
+        # pool. Spawned workers as the pool is used from the fetching threads.
+        self._executor: Optional[ProcessPoolExecutor] = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+        ) if workers > 0 else None
 
     def parse(self, url: str, query_parameters: Optional[Dict[str, str]] = None,
-              headers: Optional[Dict[str, str]] = None) -> Tag:
+              headers: Optional[Dict[str, str]] = None,
+              parse_only: Optional[SoupStrainer] = None) -> Tag:
         """
         Parse URL
         Args:
             url: String
             query_parameters: dict, optional
             headers: dict, optional
+            parse_only: SoupStrainer, optional. Elements to build in targeted mode
 
         Returns: BeautifulSoup object
         """
-        # Send get request to URL
-        headers = headers if headers is not None else self._default_header
-        page = self._session.get(url, data=query_parameters, headers=headers)
-        # Raise exception for a 4XX client error or 5XX server error response
-        page.raise_for_status()
-        soup = BeautifulSoup(page.content, "html5lib")
-        return soup
+        content = self._client.get(url, query_parameters=query_parameters, headers=headers)
+        with self._client.metrics.time("parse"):
+            return self.make_soup(content, parse_only=parse_only)
+
+    def extract(self, url: str, extractor: Callable[..., T], *args: Any,
+                parse_only: Optional[SoupStrainer] = None) -> T:
+        """
+        Download the URL and return extractor(soup, *args). With parse workers, the page is
+        downloaded in the calling thread and the soup is built and read in a worker process, so
+        the extractor must be picklable and return a small picklable result.
+        """
+        content = self._client.get(url)
+        metrics = self._client.metrics
+        if self._executor is None:
+            with metrics.time("parse"):
+                soup = self.make_soup(content, parse_only=parse_only)
+            with metrics.time("extract"):
+                return extractor(soup, *args)
+        result, parse_seconds, extract_seconds = self._executor.submit(
+            _extract_in_worker, content, self._backend, self._targeted, parse_only, extractor, args
+        ).result()
+        metrics.observe("stage_seconds", parse_seconds, stage="parse")
+        metrics.observe("stage_seconds", extract_seconds, stage="extract")
+        return result
+
+    def make_soup(self, content: bytes, parse_only: Optional[SoupStrainer] = None) -> Tag:
+        """ Build the BeautifulSoup object from the page content """
+        return URLParser.build_soup(content, self._backend, self._targeted, parse_only)
+
+    @staticmethod
+    def build_soup(content: bytes, backend: str, targeted: bool,
+                   parse_only: Optional[SoupStrainer] = None) -> Tag:
+        """
+        Build the BeautifulSoup object. In targeted mode only the elements matched by
+        parse_only and their children are built. html5lib always builds the full tree as it
+        doesn't support parse_only.
+        """
+        if not targeted or backend == "html5lib":
+            parse_only = None
+        return BeautifulSoup(content, backend, parse_only=parse_only)
+
+    def close(self) -> None:
+        """ Stop the parse workers and close the HTTP client """
+        if self._executor is not None:
+            self._executor.shutdown()
+        self._client.close()
+
+    @staticmethod
+    def has_class(attrs: Dict, class_name: str) -> bool:
+        """ Check class_name in the raw attributes passed to a SoupStrainer function """
+        classes = attrs.get("class") or ""
+        if isinstance(classes, str):
+            classes = classes.split()
+        return class_name in classes
+
+    # Class getters and setters
+    @property
+    def client(self) -> HttpClient:
+        return self._client
+
+    @property
+    def backend(self) -> str:
+        return self._backend
+
+    @property
+    def workers(self) -> int:
+        return self._workers
+
+    @property
+    def targeted(self) -> bool:
+        return self._targeted
 
+    @targeted.setter
+    def targeted(self, value: bool) -> None:
+        self._targeted = value
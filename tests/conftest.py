@@ -0,0 +1,11 @@
+"""
+File:           conftest.py
+Author:         Dibyaranjan Sathua
+Created on:     28/10/26, 11:30 AM
+
+Test configuration, run the quick tests only with: python -m pytest -m "not slow"
+"""
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "slow: tests running for minutes, e.g. memory checks")
@@ -0,0 +1,57 @@
+"""
+File:           test_fingerprint_store.py
+Author:         Dibyaranjan Sathua
+Created on:     28/10/26, 10:00 AM
+
+Offer fingerprints telling when the last prices can be reused.
+"""
+from src.condition import Condition
+from src.fingerprint_store import OfferFingerprint, Offers
+from src.product import Product
+from src.product_listing import ProductListing
+from src.repricer import Repricer
+
+SELLER = "Me"
+
+
+def offer(seller: str, price: float) -> dict:
+    return {"seller": seller, "price": price, "rating": 95, "total_ratings": 100,
+            "condition": Condition.NEW}
+
+
+def reprice(offers: Offers) -> float:
+    repricer = Repricer(Product("Book", "0000000000", 12.8),
+                        [ProductListing(**listing) for listing in offers])
+    return repricer.reprice_conditions([Condition.USED_GOOD],
+                                       ProductListing(seller=SELLER))[Condition.USED_GOOD]
+
+
+def fingerprint(offers: Offers) -> OfferFingerprint:
+    offer_fingerprint = OfferFingerprint("salt", own_seller=SELLER)
+    offer_fingerprint.update(offers)
+    return offer_fingerprint
+
+
+def test_own_offer_changes_the_fingerprint_of_all_the_offers():
+    with_own = [offer(SELLER, 10.0), offer("A", 12.0)]
+    without_own = [offer("A", 12.0)]
+    # Our own first offer sets the lowest total, so the competitor isn't matched exactly
+    assert reprice(with_own) != reprice(without_own)
+
+    assert fingerprint(with_own).hexdigest() != fingerprint(without_own).hexdigest()
+    assert fingerprint(with_own).competitor_hexdigest() == \
+        fingerprint(without_own).competitor_hexdigest()
+
+
+def test_own_offer_rank_changes_the_fingerprint():
+    first = [offer(SELLER, 10.0), offer("A", 12.0)]
+    second = [offer("A", 12.0), offer(SELLER, 13.0)]
+    assert fingerprint(first).hexdigest() != fingerprint(second).hexdigest()
+    assert fingerprint(first).competitor_hexdigest() == \
+        fingerprint(second).competitor_hexdigest()
+
+
+def test_next_page_changes_the_fingerprint():
+    offers = [offer("A", 12.0)]
+    assert fingerprint(offers).hexdigest(has_next_page=True) != \
+        fingerprint(offers).hexdigest(has_next_page=False)
@@ -0,0 +1,68 @@
+"""
+File:           test_service.py
+Author:         Dibyaranjan Sathua
+Created on:     27/10/26, 11:00 AM
+
+Offer pages shared by concurrent repricings of the service.
+"""
+from typing import Iterator, List
+import threading
+
+import pytest
+
+from src.fingerprint_store import Offers
+from src.service import CachedOffers
+
+PAGE: Offers = [{"seller": "Seller", "price": 10.0, "rating": 95, "total_ratings": 100}]
+
+
+def failing_pages(downloading: threading.Event, release: threading.Event) -> Iterator[Offers]:
+    """ One page, then a download failing once released """
+    yield PAGE
+    downloading.set()
+    release.wait()
+    raise ConnectionError("listing page download failed")
+
+
+def read_pages(offers: CachedOffers, pages: List[Offers], errors: List[Exception]) -> None:
+    try:
+        for page in offers.iter_pages():
+            pages.append(page)
+    except Exception as error:
+        errors.append(error)
+
+
+def test_concurrent_readers_get_the_download_error():
+    downloading, release = threading.Event(), threading.Event()
+    offers = CachedOffers(failing_pages(downloading, release))
+    results = [([], []) for _ in range(3)]
+    leader = threading.Thread(target=read_pages, args=(offers, *results[0]))
+    leader.start()
+    # The leader downloads the second page while holding the lock, the others wait for it
+    assert downloading.wait(5)
+    readers = [threading.Thread(target=read_pages, args=(offers, *result))
+               for result in results[1:]]
+    for reader in readers:
+        reader.start()
+    release.set()
+    for thread in [leader] + readers:
+        thread.join(5)
+
+    assert offers.failed
+    for pages, errors in results:
+        assert pages == [PAGE]
+        assert len(errors) == 1 and isinstance(errors[0], ConnectionError)
+
+
+def test_reader_after_the_failure_gets_the_download_error():
+    downloading, release = threading.Event(), threading.Event()
+    release.set()
+    offers = CachedOffers(failing_pages(downloading, release))
+    with pytest.raises(ConnectionError):
+        list(offers.iter_pages())
+
+    pages = []
+    with pytest.raises(ConnectionError):
+        for page in offers.iter_pages():
+            pages.append(page)
+    assert pages == [PAGE]
@@ -0,0 +1,48 @@
+"""
+File:           test_streaming_memory.py
+Author:         Dibyaranjan Sathua
+Created on:     28/10/26, 11:30 AM
+
+Memory ceiling of the streaming mode. The download, parse and reprice stage is replaced by the
+synthetic stage of the benchmark, the peak of the traced memory must not grow with the input.
+"""
+import contextlib
+import os
+import tempfile
+import tracemalloc
+
+import pytest
+
+from benchmarks.bench_streaming_memory import SyntheticAmazon, write_input
+
+SMALL_INPUT: int = 25000
+LARGE_INPUT: int = 100000
+# Maximum growth of the traced memory peak between the small and the large input
+MAX_GROWTH: int = 2 * 2 ** 20
+
+
+def peak_memory(directory: str, lines: int) -> int:
+    """ Peak traced memory in bytes of a streaming run over lines unique ASINs """
+    input_file = os.path.join(directory, f"input_{lines}.txt")
+    write_input(input_file, lines)
+    amazon = SyntheticAmazon("Benchmark Seller", 90, 1.0, input_file, concurrency=4,
+                             streaming=True)
+    tracemalloc.start()
+    try:
+        with open(os.devnull, mode="w") as devnull, contextlib.redirect_stdout(devnull):
+            amazon.process_input()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+@pytest.mark.slow
+def test_streaming_peak_memory_is_bounded():
+    # The journal is synced for every ASIN, a memory backed directory keeps the run short
+    shm = "/dev/shm" if os.path.isdir("/dev/shm") else None
+    with tempfile.TemporaryDirectory(dir=shm) as directory:
+        small = peak_memory(directory, SMALL_INPUT)
+        large = peak_memory(directory, LARGE_INPUT)
+    assert large - small < MAX_GROWTH, \
+        f"Streaming peak memory grew from {small / 2 ** 20:.2f} MiB to " \
+        f"{large / 2 ** 20:.2f} MiB"